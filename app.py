@@ -1,3 +1,4 @@
+import sys
 import streamlit as st
 
 __version__ = "0.0.2"
@@ -54,6 +55,7 @@ menu = [
     st.Page("page5.py", title="📥☁️ Load remote data from Azure"),
     st.Page("page6.py", title="🔎❄️ Query Snowflake data"),
     st.Page("page7.py", title="🔎🖥️ Query local data"),
+    st.Page("page8.py", title="📈 Metrics"),
 ]
 
 init()
@@ -61,3 +63,8 @@ init()
 pg = st.navigation(menu)
 pg.run()
 st.sidebar.markdown(APP_INFO, unsafe_allow_html=True)
+
+# ods is only imported by pages that need it, so the report is shown once it is loaded
+if "ods" in sys.modules:
+    with st.sidebar.expander("Startup timings", expanded=False):
+        st.dataframe(sys.modules["ods"].get_startup_report(), hide_index=True)
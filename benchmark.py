@@ -0,0 +1,477 @@
+"""
+Benchmark of the storage paths of ODS Booster: the ODS API, local parquet files, Azure
+Blob Storage and a SQL engine in place of Snowflake.
+
+The benchmark runs offline against local stand-ins: synthetic datasets are served by a
+local HTTP server that imitates the ODS export endpoint, Azure is replaced by the Azurite
+emulator and Snowflake by DuckDB. Every stage is run several times per dataset size and
+reported with the median (p50) and 95th percentile (p95) of its duration, its throughput
+and its memory peak.
+
+Usage:
+    python benchmark.py --rows 10000 100000 --repeat 5
+    python benchmark.py --columns int:2,text:4,datetime:1 --output results.jsonl
+    python benchmark.py --skip-azure
+"""
+
+import argparse
+import http.server
+import json
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import catalog
+import ods
+
+# Well-known development account of the Azurite emulator
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+)
+DEFAULT_ROWS = [10000, 100000]
+DEFAULT_COLUMNS = "int:2,double:2,text:3,date:1,datetime:1"
+DEFAULT_REPEAT = 5
+DATASET_ID_OFFSET = 900000  # synthetic datasets get identifiers that do not exist on ODS
+MEMORY_SAMPLE_INTERVAL = 0.005  # seconds between two memory samples
+SERVER_CHUNK_SIZE = 64 * 1024  # bytes per write of the ODS stand-in
+
+
+def parse_columns(spec: str) -> list:
+    """
+    Parses a column mix such as "int:2,text:3,date:1" into a list of ODS field types, one
+    per column. Supported types are int, double, boolean, text, date and datetime.
+    """
+    columns = []
+    for item in spec.split(","):
+        field_type, _, count = item.strip().partition(":")
+        if field_type not in ("int", "double", "boolean", "text", "date", "datetime"):
+            raise ValueError(f"Unknown column type: {field_type}")
+        columns += [field_type] * int(count or 1)
+    return columns
+
+
+def generate_dataset(rows: int, column_types: list, seed: int = 0) -> tuple:
+    """
+    Generates a synthetic dataset with the given ODS field types. Every second text
+    column has few distinct values, like codes or district names; the others have a
+    distinct value per row, like addresses or comments. Date columns form a time series
+    with one value per hour.
+
+    Returns:
+        tuple: The dataset as a DataFrame and its ODS field definitions.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    text_columns = 0
+    for i, field_type in enumerate(column_types):
+        name = f"{field_type}_{i}"
+        if field_type == "int":
+            data[name] = rng.integers(0, 100000, rows)
+        elif field_type == "double":
+            data[name] = rng.normal(100, 25, rows).round(3)
+        elif field_type == "boolean":
+            data[name] = rng.random(rows) < 0.5
+        elif field_type == "text":
+            if text_columns % 2 == 0:
+                data[name] = rng.choice([f"Kategorie {j}" for j in range(20)], rows)
+            else:
+                values = rng.integers(0, 2**32, rows)
+                data[name] = [f"Eintrag {j} {value:x}" for j, value in enumerate(values)]
+            text_columns += 1
+        elif field_type == "date":
+            data[name] = pd.date_range("2000-01-01", periods=rows, freq="h").strftime("%Y-%m-%d")
+        else:
+            dates = pd.date_range("2000-01-01", periods=rows, freq="h", tz="UTC")
+            data[name] = dates.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    fields = [
+        {"name": name, "label": name, "type": field_type}
+        for name, field_type in zip(data, column_types)
+    ]
+    return pd.DataFrame(data), fields
+
+
+class OdsStandIn(http.server.ThreadingHTTPServer):
+    """
+    A local HTTP server imitating the ODS Explore API v2.1: the dataset endpoint returns
+    the field definitions and the CSV export streams the pre-rendered CSV of a dataset.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), OdsRequestHandler)
+        self.exports = {}
+        self.fields = {}
+        self.base_url = f"http://127.0.0.1:{self.server_port}/api/explore/v2.1"
+
+    def add_dataset(self, ds_id: str, df: pd.DataFrame, fields: list) -> int:
+        """
+        Publishes a dataset and returns the size of its CSV export in bytes.
+        """
+        self.exports[ds_id] = df.to_csv(sep=";", index=False).encode()
+        self.fields[ds_id] = fields
+        return len(self.exports[ds_id])
+
+
+class OdsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        # /api/explore/v2.1/catalog/datasets/<id>[/exports/csv]
+        ds_id = parts[5] if len(parts) > 5 else None
+        if ds_id not in self.server.exports:
+            self.send_error(404)
+            return
+        if parts[-1] == "csv":
+            body, content_type = self.server.exports[ds_id], "text/csv"
+        else:
+            body = json.dumps({"dataset_id": ds_id, "fields": self.server.fields[ds_id]}).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), SERVER_CHUNK_SIZE):
+            self.wfile.write(body[start : start + SERVER_CHUNK_SIZE])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _get_rss() -> int:
+    """
+    Returns the resident set size of the process in bytes, or 0 where /proc is not
+    available.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * 4096
+    except OSError:
+        return 0
+
+
+class MemorySampler:
+    """
+    Samples the resident set size of the process and the memory allocated by arrow in a
+    background thread while a stage runs, and reports the peak increase of both.
+    """
+
+    def __enter__(self):
+        self.rss_start = _get_rss()
+        self.arrow_start = pa.total_allocated_bytes()
+        self.rss_peak = self.rss_start
+        self.arrow_peak = self.arrow_start
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while self.running:
+            self.rss_peak = max(self.rss_peak, _get_rss())
+            self.arrow_peak = max(self.arrow_peak, pa.total_allocated_bytes())
+            time.sleep(MEMORY_SAMPLE_INTERVAL)
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        self.rss_peak = max(self.rss_peak, _get_rss())
+
+    @property
+    def peak_mb(self) -> float:
+        return max(self.rss_peak - self.rss_start, self.arrow_peak - self.arrow_start) / 2**20
+
+
+def measure(stage, repeat: int) -> list:
+    """
+    Runs a stage repeat times. A stage is a function returning the number of bytes it
+    read from its source and the number of rows it processed: the CSV export for the
+    download and conversion stages, the parquet file or blob for the local, Azure and
+    load stages and the query result for the query stage. The throughput is based on
+    these bytes.
+
+    Returns:
+        list: One dict per run with the keys "seconds", "bytes", "rows" and "peak_mb".
+    """
+    runs = []
+    for _ in range(repeat):
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            size, rows = stage()
+            seconds = time.perf_counter() - start
+        runs.append(
+            {"seconds": seconds, "bytes": size, "rows": rows, "peak_mb": sampler.peak_mb}
+        )
+    return runs
+
+
+def summarize(runs: list) -> dict:
+    """
+    Returns the p50 and p95 duration, the throughput at the median duration and the
+    highest memory peak of the runs of a stage.
+    """
+    seconds = np.array([run["seconds"] for run in runs])
+    p50 = float(np.percentile(seconds, 50))
+    return {
+        "runs": len(runs),
+        "p50_s": p50,
+        "p95_s": float(np.percentile(seconds, 95)),
+        "mb_per_s": runs[0]["bytes"] / 2**20 / max(p50, 1e-9),
+        "rows_per_s": runs[0]["rows"] / max(p50, 1e-9),
+        "peak_mb": max(run["peak_mb"] for run in runs),
+    }
+
+
+def get_azurite_client(connection_string: str):
+    """
+    Connects to Azurite and creates the data container if needed. Returns None if the
+    emulator cannot be reached, so the Azure stages are skipped.
+    """
+    from azure.core.exceptions import AzureError, ResourceExistsError
+    from azure.storage.blob import BlobServiceClient
+
+    client = BlobServiceClient.from_connection_string(
+        connection_string,
+        max_block_size=ods.get_azure_setting("max_block_size"),
+        max_single_put_size=ods.get_azure_setting("max_single_put_size"),
+        max_single_get_size=ods.get_azure_setting("max_chunk_get_size"),
+        max_chunk_get_size=ods.get_azure_setting("max_chunk_get_size"),
+        retry_total=0,
+        connection_timeout=5,
+    )
+    try:
+        client.create_container(ods.data_container_name)
+    except ResourceExistsError:
+        pass
+    except AzureError as e:
+        print(f"Azurite not reachable, Azure stages are skipped: {e}", file=sys.stderr)
+        return None
+    return client
+
+
+def get_stages(
+    ds_id: str, csv_size: int, rows: int, work_folder: Path, azure: bool, sql_engine
+) -> dict:
+    """
+    Returns the benchmark stages of a dataset by name. Stages are run in this order, since
+    later stages read the files written by earlier ones.
+    """
+    export_url = ods.url_ods_data.format(ds_id)
+    filename = ods.data_folder / f"{ds_id}.parquet"
+
+    def column_names():
+        return pq.read_schema(filename).names
+
+    def ods_export():
+        size = 0
+        with urllib.request.urlopen(export_url) as response:
+            for block in iter(lambda: response.read(2**20), b""):
+                size += len(block)
+        return size, rows
+
+    def ods_read_pandas():
+        # querying ODS directly: the whole export is parsed on every access
+        return csv_size, len(pd.read_csv(export_url, sep=";"))
+
+    def download():
+        ods.download_ods_table(ds_id, filename, row_size=csv_size / rows)
+        return csv_size, rows
+
+    def convert():
+        # CSV to parquet from a local file, i.e. the download without the network
+        csv_file = work_folder / f"{ds_id}.csv"
+        if not csv_file.exists():
+            with urllib.request.urlopen(export_url) as response:
+                csv_file.write_bytes(response.read())
+        target = work_folder / f"{ds_id}.parquet"
+        chunk_rows = ods.get_chunk_rows(ods.DOWNLOAD_MEMORY_BUDGET, csv_size / rows)
+        field_types = ods._get_field_types(ds_id)
+        dtype = {
+            name: str
+            for name, field_type in field_types.items()
+            if field_type not in ("int", "double", "boolean")
+        }
+
+        def chunks():
+            # every chunk is written before the next one is read, like download_ods_table
+            schema = None
+            for chunk in pd.read_csv(csv_file, sep=";", chunksize=chunk_rows, dtype=dtype):
+                if schema is None:
+                    schema = ods._infer_schema(
+                        chunk, field_types, complete=len(chunk) < chunk_rows
+                    )
+                yield ods._conform_chunk(chunk, schema)
+
+        ods._write_parquet(chunks(), target, chunk_rows)
+        return csv_size, rows
+
+    def local_read():
+        return filename.stat().st_size, pq.read_table(filename).num_rows
+
+    def local_query():
+        column = column_names()[0]
+        ods.run_local_query(f'SELECT COUNT(*), COUNT(DISTINCT "{column}") FROM DS_{ds_id}')
+        return filename.stat().st_size, rows
+
+    def azure_upload():
+        return ods.upload_to_azure_storage(filename)["bytes"], rows
+
+    def azure_download():
+        target = work_folder / f"{ds_id}.azure.parquet"
+        return ods.download_from_azure_storage(filename.name, target)["bytes"], rows
+
+    def azure_read_columns():
+        # the byte ranges downloaded, as read_remote_table does for a column selection
+        blob_file = ods.BlobFile(
+            ods.get_blob_service_client().get_blob_client(
+                container=ods.data_container_name, blob=filename.name
+            )
+        )
+        table = pq.ParquetFile(blob_file, pre_buffer=True).read(columns=column_names()[:2])
+        return blob_file.bytes_read, table.num_rows
+
+    def snowflake_load():
+        # COPY INTO stand-in: the parquet file is loaded into a table of the SQL engine
+        path = filename.resolve().as_posix()
+        sql_engine.execute(
+            f"CREATE OR REPLACE TABLE DS_{ds_id} AS SELECT * FROM read_parquet('{path}')"
+        )
+        return filename.stat().st_size, rows
+
+    def snowflake_query():
+        table = sql_engine.execute(f"SELECT * FROM DS_{ds_id}").to_arrow_table()
+        return table.nbytes, table.num_rows
+
+    stages = {
+        "ods_export": ods_export,
+        "ods_read_pandas": ods_read_pandas,
+        "convert": convert,
+        "download": download,
+        "local_read": local_read,
+        "local_query": local_query,
+    }
+    if azure:
+        stages.update(
+            {
+                "azure_upload": azure_upload,
+                "azure_download": azure_download,
+                "azure_read_columns": azure_read_columns,
+            }
+        )
+    stages.update({"snowflake_load": snowflake_load, "snowflake_query": snowflake_query})
+    return stages
+
+
+def run_benchmark(
+    rows_list: list,
+    column_types: list,
+    repeat: int = DEFAULT_REPEAT,
+    azurite_connection_string: str = None,
+) -> list:
+    """
+    Runs all stages for every dataset size against the local stand-ins. The data folder,
+    the catalog, the ODS URLs and the Azure client of ods are redirected to the stand-ins
+    and a temporary folder for the duration of the benchmark.
+
+    Args:
+        rows_list (list): Number of rows of every synthetic dataset.
+        column_types (list): ODS field types of the columns, see parse_columns.
+        repeat (int): Number of runs per stage.
+        azurite_connection_string (str): Connection string of Azurite, None to skip the
+            Azure stages.
+
+    Returns:
+        list: One dict per dataset and stage with the dataset size and the summary of
+            summarize.
+    """
+    import duckdb
+
+    server = OdsStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ods.url_ods_dataset = server.base_url + "/catalog/datasets/{}?lang=de"
+    ods.url_ods_data = server.base_url + "/catalog/datasets/{}/exports/csv?lang=de&delimiter=%3B"
+    ods.HOST_MIN_INTERVAL = 0
+    azure_client = None
+    if azurite_connection_string:
+        azure_client = get_azurite_client(azurite_connection_string)
+    if azure_client is not None:
+        ods.get_blob_service_client = lambda: azure_client
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        work_folder = Path(tmp)
+        ods.data_folder = work_folder / "data"
+        ods.data_folder.mkdir()
+        # operations recorded by ods go to a catalog of their own
+        catalog.catalog_file = str(work_folder / "catalog.db")
+        sql_engine = duckdb.connect(str(work_folder / "snowflake.duckdb"))
+        try:
+            for i, rows in enumerate(rows_list):
+                ds_id = str(DATASET_ID_OFFSET + i)
+                df, fields = generate_dataset(rows, column_types, seed=i)
+                csv_size = server.add_dataset(ds_id, df, fields)
+                del df
+                print(f"{ds_id}: {rows} rows, {csv_size / 2**20:.1f} MB CSV", file=sys.stderr)
+                stages = get_stages(
+                    ds_id, csv_size, rows, work_folder, azure_client is not None, sql_engine
+                )
+                for name, stage in stages.items():
+                    summary = summarize(measure(stage, repeat))
+                    results.append(
+                        {
+                            "dataset": ds_id,
+                            "rows": rows,
+                            "csv_mb": csv_size / 2**20,
+                            "stage": name,
+                            **summary,
+                        }
+                    )
+                    print(f"  {name}: p50 {summary['p50_s']:.3f}s", file=sys.stderr)
+        finally:
+            sql_engine.close()
+            server.shutdown()
+    return results
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Rows of every synthetic dataset."
+    )
+    parser.add_argument(
+        "--columns", default=DEFAULT_COLUMNS, help="Column mix, e.g. int:2,text:3,date:1."
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per stage.")
+    parser.add_argument(
+        "--azurite",
+        default=AZURITE_CONNECTION_STRING,
+        help="Connection string of the Azurite emulator.",
+    )
+    parser.add_argument("--skip-azure", action="store_true", help="Do not run the Azure stages.")
+    parser.add_argument("--output", help="Write the results as JSON lines to this file.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        args.rows,
+        parse_columns(args.columns),
+        args.repeat,
+        None if args.skip_azure else args.azurite,
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(pd.DataFrame(results).round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import sqlite3
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Iterable
+
+import pandas as pd
+
+catalog_file = "catalog.db"
+legacy_config_file = "log.json"  # local metadata of versions before the sqlite catalog
+SCHEMA_VERSION = 5
+SYNC_TARGETS = ("azure", "snowflake")
+
+schema_sql = """
+CREATE TABLE IF NOT EXISTS datasets (
+    dataset_identifier TEXT PRIMARY KEY,
+    title TEXT,
+    modified TEXT,
+    data_processed TEXT,
+    number_of_records INTEGER,
+    downloaded_at TEXT,
+    file_size INTEGER,
+    row_count INTEGER,
+    content_hash TEXT,
+    azure_synced_at TEXT,
+    snowflake_synced_at TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation TEXT NOT NULL,
+    dataset_identifier TEXT,
+    started_at TEXT NOT NULL,
+    seconds REAL,
+    bytes INTEGER,
+    rows INTEGER,
+    peak_memory INTEGER,
+    memory_increase INTEGER,
+    error TEXT,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_started_at ON operations (started_at);
+CREATE TABLE IF NOT EXISTS modified_history (
+    dataset_identifier TEXT NOT NULL,
+    modified TEXT NOT NULL,
+    observed_at TEXT NOT NULL,
+    PRIMARY KEY (dataset_identifier, modified)
+);
+CREATE TABLE IF NOT EXISTS table_schemas (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (table_name, column_name)
+);
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS datasets_inserted AFTER INSERT ON datasets
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS datasets_updated AFTER UPDATE ON datasets
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS datasets_deleted AFTER DELETE ON datasets
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+"""
+
+
+@contextmanager
+def connect():
+    """
+    Opens a connection to the local catalog and commits all changes made in the block as
+    one transaction. The catalog is created and log.json is migrated on first use.
+
+    Yields:
+        sqlite3.Connection: The connection to the catalog database.
+    """
+    conn = sqlite3.connect(catalog_file, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            with conn:
+                conn.executescript(schema_sql)
+                migrate_legacy_config(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def migrate_legacy_config(conn: sqlite3.Connection):
+    """
+    Imports the entries of the legacy log.json file into the catalog. Entries already in
+    the catalog are kept.
+    """
+    if not Path(legacy_config_file).exists():
+        return
+    with open(legacy_config_file, "r") as file:
+        log = json.load(file)
+    for ds in log.values():
+        ds = json.loads(pd.Series(ds).to_json())  # NaN values to null
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO datasets (
+                dataset_identifier, title, modified, data_processed, number_of_records,
+                row_count, metadata
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                str(ds["dataset_identifier"]),
+                ds.get("title"),
+                ds.get("modified"),
+                ds.get("data_processed"),
+                ds.get("number_of_records"),
+                ds.get("number_of_records_local"),
+                json.dumps(ds),
+            ),
+        )
+
+
+def get_file_hash(file_path: Path) -> str:
+    """
+    Returns the sha256 hash of a file, read in blocks of 1 MB. For the partition folder
+    of a partitioned dataset, the paths and sizes of its part files are hashed; part files
+    are never rewritten, so they identify the content without reading all of it.
+    """
+    sha256 = hashlib.sha256()
+    file_path = Path(file_path)
+    if file_path.is_dir():
+        for part_file in sorted(file_path.glob("year=*/month=*/*.parquet")):
+            relative_path = part_file.relative_to(file_path).as_posix()
+            sha256.update(f"{relative_path}:{part_file.stat().st_size}\n".encode())
+        return sha256.hexdigest()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def upsert_dataset(ds: dict, row_count: int, file_size: int, content_hash: str):
+    """
+    Inserts or replaces the catalog entry of a downloaded dataset.
+
+    Args:
+        ds (dict): ODS metadata of the dataset at the time of the download.
+        row_count (int): Number of rows in the local parquet file.
+        file_size (int): Size of the local parquet file in bytes.
+        content_hash (str): Hash of the local parquet file.
+    """
+    with connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO datasets (
+                dataset_identifier, title, modified, data_processed, number_of_records,
+                downloaded_at, file_size, row_count, content_hash, metadata
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset_identifier) DO UPDATE SET
+                title = excluded.title,
+                modified = excluded.modified,
+                data_processed = excluded.data_processed,
+                number_of_records = excluded.number_of_records,
+                downloaded_at = excluded.downloaded_at,
+                file_size = excluded.file_size,
+                row_count = excluded.row_count,
+                content_hash = excluded.content_hash,
+                metadata = excluded.metadata
+            """,
+            (
+                str(ds["dataset_identifier"]),
+                ds.get("title"),
+                ds.get("modified"),
+                ds.get("data_processed"),
+                ds.get("number_of_records"),
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                file_size,
+                row_count,
+                content_hash,
+                json.dumps(ds),
+            ),
+        )
+        if ds.get("modified"):
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO modified_history (dataset_identifier, modified, observed_at)
+                VALUES (?, ?, ?)
+                """,
+                (
+                    str(ds["dataset_identifier"]),
+                    ds["modified"],
+                    datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                ),
+            )
+
+
+def record_modified(observations: Iterable[tuple]):
+    """
+    Records the modification timestamps of datasets as seen on ODS. Every distinct
+    timestamp is stored once, so the history shows how often a dataset is updated.
+
+    Args:
+        observations (Iterable[tuple]): Pairs of dataset identifier and ODS modified
+            timestamp.
+    """
+    observed_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with connect() as conn:
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO modified_history (dataset_identifier, modified, observed_at)
+            VALUES (?, ?, ?)
+            """,
+            (
+                (str(dataset_identifier), modified, observed_at)
+                for dataset_identifier, modified in observations
+                if modified
+            ),
+        )
+
+
+def get_modified_history() -> pd.DataFrame:
+    """
+    Returns the recorded modification timestamps, ordered by dataset and timestamp.
+    """
+    with connect() as conn:
+        return pd.read_sql_query(
+            "SELECT * FROM modified_history ORDER BY dataset_identifier, modified", conn
+        )
+
+
+def mark_synced(dataset_identifier: str, target: str):
+    """
+    Records that the local file of a dataset has been uploaded to a target.
+
+    Args:
+        dataset_identifier (str): The dataset identifier.
+        target (str): One of SYNC_TARGETS.
+    """
+    if target not in SYNC_TARGETS:
+        raise ValueError(f"Unknown sync target: {target}")
+    with connect() as conn:
+        conn.execute(
+            f"UPDATE datasets SET {target}_synced_at = ? WHERE dataset_identifier = ?",
+            (
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                str(dataset_identifier),
+            ),
+        )
+
+
+def get_version() -> int:
+    """
+    Returns the version of the datasets table, which triggers increment on every change,
+    also by other processes such as the sync CLI. Views derived from the catalog are
+    cached by this version.
+    """
+    with connect() as conn:
+        return conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+
+
+def get_content_hash(dataset_identifier: str) -> str:
+    """
+    Returns the hash of the local file of a dataset recorded at its download, or None if
+    the dataset is not in the catalog.
+    """
+    with connect() as conn:
+        row = conn.execute(
+            "SELECT content_hash FROM datasets WHERE dataset_identifier = ?",
+            (str(dataset_identifier),),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def get_table_schemas(table_names: Iterable[str]) -> dict:
+    """
+    Returns the registered column types of Snowflake tables. Tables without a registered
+    schema are left out.
+
+    Returns:
+        dict: Per table name a dict of column name to Snowflake type, in column order.
+    """
+    table_names = [name.upper() for name in table_names]
+    if not table_names:
+        return {}
+    schemas = {}
+    with connect() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT table_name, column_name, data_type FROM table_schemas
+            WHERE table_name IN ({", ".join("?" * len(table_names))})
+            ORDER BY table_name, position
+            """,
+            table_names,
+        )
+        for table_name, column_name, data_type in rows:
+            schemas.setdefault(table_name, {})[column_name] = data_type
+    return schemas
+
+
+def set_table_schema(table_name: str, columns: dict):
+    """
+    Registers the column types of a Snowflake table, replacing its previous schema.
+
+    Args:
+        table_name (str): The table name.
+        columns (dict): Column name to Snowflake type, in column order.
+    """
+    with connect() as conn:
+        conn.execute("DELETE FROM table_schemas WHERE table_name = ?", (table_name.upper(),))
+        conn.executemany(
+            """
+            INSERT INTO table_schemas (table_name, column_name, data_type, position)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                (table_name.upper(), column, data_type, position)
+                for position, (column, data_type) in enumerate(columns.items())
+            ),
+        )
+
+
+def delete_table_schema(table_name: str):
+    """
+    Removes the registered schema of a table, e.g. after a load found the table changed
+    or missing, so the next load reads it from Snowflake again.
+    """
+    with connect() as conn:
+        conn.execute("DELETE FROM table_schemas WHERE table_name = ?", (table_name.upper(),))
+
+
+def get_datasets() -> pd.DataFrame:
+    """
+    Returns all catalog entries without the ODS metadata json.
+    """
+    with connect() as conn:
+        return pd.read_sql_query(
+            "SELECT * FROM datasets ORDER BY dataset_identifier", conn
+        ).drop(columns="metadata")
+
@@ -0,0 +1,303 @@
+import hashlib
+import logging
+import re
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+import catalog
+import metrics
+import ods
+
+DATASET_CACHE_BYTES = 2 * 1024 * 1024 * 1024  # bytes of arrow tables shared by all sessions
+DATASET_CACHE_MAX_ENTRY_BYTES = 512 * 1024 * 1024  # larger datasets are read from parquet
+DATASET_CACHE_PROMOTE_QUERIES = 3  # queries reading a dataset from parquet before it is cached
+
+cache_folder = ods.cache_folder / "datasets"  # arrow IPC files the tables are mapped from
+
+logger = logging.getLogger(__name__)
+
+
+def get_uncompressed_size(preview: ods.ParquetPreview) -> int:
+    """
+    Returns the uncompressed size of the files of a preview from their parquet footers,
+    an estimate of the size of the arrow table.
+    """
+    return sum(
+        metadata.row_group(i).total_byte_size
+        for metadata in preview.metadata
+        for i in range(metadata.num_row_groups)
+    )
+
+
+def write_ipc_file(batches, schema: pa.Schema, path: Path):
+    """
+    Writes record batches to an arrow IPC file, which replaces path once it is complete.
+    Batches with a different schema, e.g. dictionary encoded in one part file only, are
+    cast to schema.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(path.name + ".tmp")
+    with pa.OSFile(str(tmp_file), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch if batch.schema == schema else batch.cast(schema))
+    tmp_file.replace(path)
+
+
+def _get_partition(path: Path, part_file: Path) -> list:
+    return re.findall(r"(year|month)=(\d+)", part_file.relative_to(path).as_posix())
+
+
+def _iter_local_batches(path: Path):
+    # the part files of a partition folder get its year and month, like the DuckDB views
+    for part_file in ods.get_part_files(path):
+        partition = _get_partition(path, part_file)
+        for batch in pq.ParquetFile(part_file).iter_batches():
+            for key, value in partition:
+                batch = batch.append_column(
+                    key, pa.array(np.full(batch.num_rows, int(value), dtype=np.int64))
+                )
+            yield batch
+
+
+class DatasetCache:
+    """
+    Datasets as arrow tables shared by all sessions, so a dataset used by several
+    sessions is held once.
+
+    A dataset is converted once to an arrow IPC file in the cache folder and memory-mapped
+    from there: the tables are zero-copy views of the mapped file, backed by the page cache
+    instead of the memory of the process. Every entry has a signature, e.g. the content
+    hash of a local file or the modification time of a blob; a request with another
+    signature converts the dataset again. The least recently used datasets are evicted
+    when max_bytes is exceeded; datasets larger than max_entry_bytes are not cached.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DATASET_CACHE_BYTES,
+        max_entry_bytes: int = DATASET_CACHE_MAX_ENTRY_BYTES,
+        folder: Path = cache_folder,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.loading = {}  # key -> lock held while the dataset is converted
+        self.queries = Counter()  # key -> queries that read the dataset from parquet
+        self.entries = OrderedDict()  # key -> (signature, table, IPC file), LRU first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # files of an earlier process may be stale
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def _get_entry(self, key, signature) -> pa.Table:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != signature:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get(
+        self, key, signature, size, write, dataset_identifier: str = None, load: bool = True
+    ) -> pa.Table:
+        """
+        Returns the table of a dataset, converting the dataset if it is not cached with
+        this signature. Sessions requesting a dataset that is being converted wait for
+        the conversion instead of converting it again.
+
+        Args:
+            key: Identifies the dataset, e.g. its path.
+            signature: Identifies the content of the dataset.
+            size (callable): Returns the estimated size of the table in bytes.
+            write (callable): Writes the dataset to the arrow IPC file passed to it.
+            dataset_identifier (str): The dataset, for the metrics.
+            load (bool): If False, only a cached table is returned.
+
+        Returns:
+            pa.Table: The shared table, which must not be modified, or None if the
+                dataset is larger than max_entry_bytes or not cached and load is False.
+        """
+        with self.lock:
+            table = self._get_entry(key, signature)
+            if table is not None or not load:
+                return table
+            key_lock = self.loading.setdefault(key, threading.Lock())
+        try:
+            return self._load(key, key_lock, signature, size, write, dataset_identifier)
+        finally:
+            with self.lock:
+                # sessions still waiting hold the lock object themselves
+                if self.loading.get(key) is key_lock and not key_lock.locked():
+                    del self.loading[key]
+
+    def _load(self, key, key_lock, signature, size, write, dataset_identifier) -> pa.Table:
+        with key_lock:
+            with self.lock:
+                table = self._get_entry(key, signature)
+                if table is not None:
+                    return table
+                self.misses += 1
+            if size() > self.max_entry_bytes:
+                return None
+            name = hashlib.sha256(repr((key, signature)).encode()).hexdigest()
+            path = self.folder / f"{name}.arrow"
+            with metrics.record("dataset_cache_load", dataset_identifier) as m:
+                write(path)
+                with pa.memory_map(str(path)) as source:
+                    table = pa.ipc.open_file(source).read_all()
+                m["rows"], m["bytes"] = table.num_rows, table.nbytes
+            with self.lock:
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self._remove(old)
+                self.entries[key] = (signature, table, path)
+                self.bytes += table.nbytes
+                while self.bytes > self.max_bytes and len(self.entries) > 1:
+                    self._remove(self.entries.popitem(last=False)[1])
+                    self.evictions += 1
+            return table
+
+    def _remove(self, entry: tuple):
+        _, table, path = entry
+        self.bytes -= table.nbytes
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass  # still mapped by a session on Windows, the next start removes it
+
+    def get_local_table(self, path: Path, load: bool = True) -> pa.Table:
+        """
+        Returns a local parquet file or partition folder as a shared arrow table, with
+        the year and month columns of a partitioned dataset. The table is converted again
+        if the content hash in the catalog or the size or modification time of a file
+        changed. Returns None if the dataset is too large to be cached, or if it is not
+        cached and load is False.
+        """
+        path = Path(path)
+        ds_id = ods.get_file_dataset(path.name)
+        files = ods.get_part_files(path)
+        if not files:
+            return None
+        signature = (
+            catalog.get_content_hash(ds_id),
+            tuple((file.stat().st_mtime_ns, file.stat().st_size) for file in files),
+        )
+
+        def write(ipc_file):
+            schema = pq.read_schema(files[0])
+            for key, _ in _get_partition(path, files[0]):
+                schema = schema.append(pa.field(key, pa.int64()))
+            write_ipc_file(_iter_local_batches(path), schema, ipc_file)
+
+        return self.get(
+            ("local", str(path)),
+            signature,
+            lambda: get_uncompressed_size(ods.get_local_preview(path)),
+            write,
+            ds_id,
+            load,
+        )
+
+    def _promote(self, path: Path):
+        try:
+            self.get_local_table(path)
+        except Exception as e:
+            logger.warning("Caching %s failed: %s", path, e)
+
+    def get_remote_table(self, file: str, last_modified, partitions: list = None) -> pa.Table:
+        """
+        Returns a parquet blob, or some partitions of a partitioned dataset, as a shared
+        arrow table, downloading it only if it is not cached or was uploaded again.
+        Returns None if the dataset is too large to be cached.
+
+        Args:
+            file (str): Name of the blob, or the prefix of a partitioned dataset (<id>/).
+            last_modified: Time of the last change of the blobs from the listing.
+            partitions (list): Partitions of a partitioned dataset, all if None.
+        """
+        partitions = tuple(partitions) if partitions is not None else None
+
+        def size():
+            if not file.endswith("/"):
+                blobs = [file]
+            else:
+                part_files = ods.get_remote_partitions(file)
+                blobs = [
+                    blob
+                    for partition in (partitions or part_files)
+                    for blob in part_files[partition]
+                ]
+            return get_uncompressed_size(ods.get_remote_preview(blobs, last_modified))
+
+        def write(ipc_file):
+            table = ods.read_remote_table(
+                file, partitions=list(partitions) if partitions else None
+            )
+            write_ipc_file(table.to_batches(), table.schema, ipc_file)
+
+        return self.get(
+            ("azure", file, partitions),
+            str(last_modified),
+            size,
+            write,
+            ods.get_file_dataset(file),
+        )
+
+    def get_query_tables(self, query: str) -> dict:
+        """
+        Returns the shared tables of the cached local datasets a query refers to, by table
+        name, for ods.run_local_query. The other datasets are left out and read from
+        parquet, where DuckDB only reads the row groups and columns the query needs, so a
+        single query never waits for a whole dataset to be converted. A dataset read from
+        parquet by DATASET_CACHE_PROMOTE_QUERIES queries is converted in the background.
+        """
+        tables = {}
+        for ds_id in sorted(set(re.findall(r"\bDS_(\d+)\b", query, re.IGNORECASE))):
+            path = ods.get_local_path(ds_id)
+            if not path.exists():
+                continue
+            table = self.get_local_table(path, load=False)
+            if table is not None:
+                tables[f"DS_{ds_id}"] = table
+                continue
+            with self.lock:
+                self.queries[str(path)] += 1
+                promote = self.queries[str(path)] >= DATASET_CACHE_PROMOTE_QUERIES
+                if promote:
+                    del self.queries[str(path)]
+            if promote:
+                threading.Thread(target=self._promote, args=(path,), daemon=True).start()
+        return tables
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of the cache: "hits", "misses", "evictions", and the number
+        and size of the cached datasets ("entries", "bytes").
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+
+@st.cache_resource
+def get_dataset_cache() -> DatasetCache:
+    """
+    Returns the dataset cache shared by all sessions.
+    """
+    return DatasetCache()
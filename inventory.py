@@ -0,0 +1,237 @@
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+import catalog
+import ods
+
+LISTING_TTL = 600  # seconds an Azure or Snowflake listing is used before it is listed again
+BLOB_PAGE_SIZE = 5000  # blobs per page of a container listing
+REMOTE_TARGETS = ("azure", "snowflake")
+STATUS_MISSING = "missing"
+STATUS_BEHIND = "behind"
+STATUS_CURRENT = "current"
+LISTING_COLUMNS = {  # inventory column per key of a listing entry
+    "azure": {"name": "azure_name", "bytes": "azure_bytes", "last_modified": "azure_changed_at"},
+    "snowflake": {
+        "table_name": "snowflake_table",
+        "rows": "snowflake_rows",
+        "bytes": "snowflake_bytes",
+        "last_altered": "snowflake_changed_at",
+    },
+}
+
+
+def list_blobs(dataset_identifier: str = None) -> dict:
+    """
+    Lists the dataset blobs in the data container page by page, following the
+    continuation tokens, and sums them up per dataset. The part files of a partitioned
+    dataset are counted as one entry, its prefix <id>/.
+
+    Args:
+        dataset_identifier (str): Only list the blobs of this dataset.
+
+    Returns:
+        dict: Per dataset identifier the keys "name", "bytes", "blobs" and "last_modified".
+    """
+    container_client = ods.get_blob_service_client().get_container_client(
+        ods.data_container_name
+    )
+    pages = container_client.list_blobs(
+        name_starts_with=dataset_identifier, results_per_page=BLOB_PAGE_SIZE
+    ).by_page()
+    entries = {}
+    for page in pages:
+        for blob in page:
+            ds_id = ods.get_file_dataset(blob.name)
+            # the prefix "1000" also matches the blobs of dataset 10001
+            if ds_id is None or dataset_identifier not in (None, ds_id):
+                continue
+            name = f"{ds_id}/" if "/" in blob.name else blob.name
+            last_modified = pd.Timestamp(blob.last_modified)
+            entry = entries.setdefault(
+                ds_id, {"name": name, "bytes": 0, "blobs": 0, "last_modified": last_modified}
+            )
+            entry["bytes"] += blob.size
+            entry["blobs"] += 1
+            if last_modified >= entry["last_modified"]:
+                # both layouts exist while an upload replaces one with the other
+                entry["name"] = name
+                entry["last_modified"] = last_modified
+    return entries
+
+
+def list_tables(table_names: list = None) -> dict:
+    """
+    Lists the dataset tables of the current Snowflake schema with their row count, size
+    and time of the last change from INFORMATION_SCHEMA.TABLES, which unlike SHOW TABLES
+    can be filtered to single tables.
+
+    Args:
+        table_names (list): Only list these tables.
+
+    Returns:
+        dict: Per dataset identifier the keys "table_name", "rows", "bytes" and
+            "last_altered".
+    """
+    query = """
+        SELECT TABLE_NAME, ROW_COUNT, BYTES, LAST_ALTERED
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_TYPE = 'BASE TABLE'
+    """
+    params = []
+    if table_names:
+        query += f" AND TABLE_NAME IN ({', '.join(['%s'] * len(table_names))})"
+        params = [name.upper() for name in table_names]
+    with ods.snowflake_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    entries = {}
+    for table_name, row_count, size, last_altered in rows:
+        ds_id = ods.get_query_dataset(table_name)
+        if ds_id is not None:
+            entries[ds_id] = {
+                "table_name": table_name,
+                "rows": row_count,
+                "bytes": size,
+                "last_altered": pd.Timestamp(last_altered).tz_convert("UTC"),
+            }
+    return entries
+
+
+class Inventory:
+    """
+    Cached listings of the datasets in the Azure data container and in Snowflake, kept
+    next to the local files and the local catalog to tell per dataset which targets are
+    missing or behind.
+
+    A listing is fetched on first use and again after ttl seconds. Uploads refresh only
+    the datasets they touched with refresh(), which lists a single blob prefix or table.
+    """
+
+    def __init__(self, ttl: float = LISTING_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listings = {}  # target -> {dataset identifier: entry}
+        self.listed_at = {}  # target -> time.monotonic() of the last full listing
+
+    def get_listing(self, target: str, refresh: bool = False, ttl: float = None) -> dict:
+        """
+        Returns the listing of "azure" or "snowflake", listing the target again if it
+        is older than ttl (self.ttl if None) or refresh is True. The listing is shared
+        and must not be modified.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            listed_at = self.listed_at.get(target)
+            if refresh or listed_at is None or time.monotonic() - listed_at > ttl:
+                self.listings[target] = list_blobs() if target == "azure" else list_tables()
+                self.listed_at[target] = time.monotonic()
+            return self.listings[target]
+
+    def refresh(self, target: str, identifiers: list):
+        """
+        Lists the blobs or tables of some datasets again, e.g. after they were uploaded.
+        Does nothing if the target has not been listed yet.
+        """
+        with self.lock:
+            if target not in self.listings:
+                return
+            if target == "azure":
+                entries = {}
+                for ds_id in identifiers:
+                    entries.update(list_blobs(str(ds_id)))
+            else:
+                names = [ods.get_snowflake_table_name(str(ds_id)) for ds_id in identifiers]
+                entries = list_tables(names) if names else {}
+            # copy on write, the old listing may still be in use by another session
+            listing = {
+                ds_id: entry
+                for ds_id, entry in self.listings[target].items()
+                if ds_id not in set(map(str, identifiers))
+            }
+            listing.update(entries)
+            self.listings[target] = listing
+
+    def get_listing_frame(self, target: str) -> pd.DataFrame:
+        """
+        Returns the listing of a target as a DataFrame with one row per dataset, sorted by
+        blob or table name, with the dataset identifier in the column "dataset_identifier".
+        """
+        columns = ["dataset_identifier", *LISTING_COLUMNS[target]]
+        df = pd.DataFrame.from_dict(self.get_listing(target), orient="index")
+        df = df.rename_axis("dataset_identifier").reset_index().reindex(columns=columns)
+        return df.sort_values(columns[1], ignore_index=True)
+
+    def get_status(self, targets: tuple = REMOTE_TARGETS) -> pd.DataFrame:
+        """
+        Returns the inventory of every dataset stored locally or in one of the targets,
+        indexed by dataset identifier.
+
+        The local copy is behind if the dataset changed on ODS since its download. A
+        target is behind if it was last changed before the local download or before the
+        modification of the dataset on ODS.
+
+        Args:
+            targets (tuple): The remote targets to include, listed if necessary.
+
+        Returns:
+            pd.DataFrame: Title and ODS modification time, the local file, size and
+                download time, and per target its name, size, time of the last change and
+                status ("missing", "behind" or "current").
+        """
+        local_files = ods.get_local_files()
+        local = catalog.get_datasets().set_index("dataset_identifier")
+        local = local.reindex(local_files["identifier"].dropna().unique())
+        local["file_path"] = local_files.dropna(subset="identifier").drop_duplicates(
+            "identifier"
+        ).set_index("identifier")["file_path"]
+        listings = {target: self.get_listing(target) for target in targets}
+        identifiers = set(local.index).union(*listings.values())
+        df = pd.DataFrame(index=pd.Index(sorted(identifiers), name="dataset_identifier"))
+        metadata = ods.get_metadata_view()
+        df["title"] = metadata["title"].reindex(df.index)
+        df["modified"] = pd.to_datetime(metadata["modified"].reindex(df.index), utc=True)
+        df["local_file"] = local["file_path"].reindex(df.index)
+        df["local_bytes"] = local["file_size"].reindex(df.index)
+        df["local_downloaded_at"] = pd.to_datetime(
+            local["downloaded_at"].reindex(df.index), utc=True
+        )
+        stale = set(ods.get_stale_datasets()["dataset_identifier"])
+        df["local_status"] = STATUS_CURRENT
+        df.loc[df.index.isin(stale), "local_status"] = STATUS_BEHIND
+        df.loc[df["local_file"].isna(), "local_status"] = STATUS_MISSING
+        reference = df[["modified", "local_downloaded_at"]].max(axis=1)
+        for target, listing in listings.items():
+            columns = LISTING_COLUMNS[target]
+            entries = pd.DataFrame.from_dict(listing, orient="index")
+            entries = entries.reindex(columns=list(columns))
+            df = df.join(entries.rename(columns=columns))
+            changed_at = pd.to_datetime(df[f"{target}_changed_at"], utc=True)
+            df[f"{target}_changed_at"] = changed_at
+            df[f"{target}_status"] = STATUS_CURRENT
+            df.loc[changed_at < reference, f"{target}_status"] = STATUS_BEHIND
+            df.loc[changed_at.isna(), f"{target}_status"] = STATUS_MISSING
+        return df
+
+    def get_pending_uploads(self, target: str) -> pd.DataFrame:
+        """
+        Returns the rows of get_status() whose local file is newer than the copy in a
+        target, or that are missing in it. Local files that are behind ODS themselves
+        are only included if they are newer than the target copy.
+        """
+        df = self.get_status((target,))
+        df = df[df["local_file"].notna()]
+        missing = df[f"{target}_status"] == STATUS_MISSING
+        older = df[f"{target}_changed_at"] < df["local_downloaded_at"]
+        return df[missing | older]
+
+
+@st.cache_resource
+def get_inventory() -> Inventory:
+    """
+    Returns the inventory shared by all sessions.
+    """
+    return Inventory()
@@ -0,0 +1,287 @@
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+
+import catalog
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+METRICS_RETENTION_DAYS = 30  # operations older than this are removed by prune()
+PROMETHEUS_PREFIX = "ods_booster"
+
+_current = threading.local()  # the operations recorded in the current thread
+
+logger = logging.getLogger(__name__)
+
+
+def get_peak_memory() -> int:
+    """
+    Returns the peak resident set size of the process in bytes, or None where the
+    resource module is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def record(operation: str, dataset_identifier: str = None) -> Iterator[dict]:
+    """
+    Records the wall time, peak memory and error of an operation in the metrics store.
+    The block sets the number of bytes and rows it processed in the yielded dict; stages
+    of the operation add their share of the time with add(). Errors are recorded and
+    raised again.
+
+    The peak memory is the high-water mark of the whole process, since memory cannot be
+    attributed to a thread; memory_increase is how much the operation raised it.
+
+    Args:
+        operation (str): Name of the operation, e.g. "ods_download".
+        dataset_identifier (str): The dataset the operation works on, if any.
+
+    Yields:
+        dict: The keys "bytes", "rows" and "details" (stage times by name).
+    """
+    entry = {"bytes": None, "rows": None, "details": {}}
+    stack = getattr(_current, "stack", None)
+    if stack is None:
+        stack = _current.stack = []
+    stack.append(entry)
+    started_at = datetime.now(timezone.utc)
+    memory_before = get_peak_memory()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield entry
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        peak_memory = get_peak_memory()
+        _store(
+            operation,
+            None if dataset_identifier is None else str(dataset_identifier),
+            started_at,
+            seconds,
+            entry,
+            peak_memory,
+            None if peak_memory is None else peak_memory - memory_before,
+            error,
+        )
+
+
+def add(stage: str, seconds: float):
+    """
+    Adds time spent in a stage, e.g. reading the ODS export or writing parquet, to the
+    operation recorded in the current thread. Does nothing outside of record().
+    """
+    stack = getattr(_current, "stack", None)
+    if stack:
+        details = stack[-1]["details"]
+        details[stage] = details.get(stage, 0.0) + seconds
+
+
+def timed(iterable, stage: str) -> Iterator:
+    """
+    Yields the items of an iterable and adds the time spent producing them to a stage of
+    the current operation, e.g. the time spent waiting for chunks of a download.
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add(stage, time.perf_counter() - start)
+            return
+        add(stage, time.perf_counter() - start)
+        yield item
+
+
+def _store(
+    operation, dataset_identifier, started_at, seconds, entry, peak_memory, memory_increase, error
+):
+    # metrics must never break the operation they measure
+    try:
+        with catalog.connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO operations (
+                    operation, dataset_identifier, started_at, seconds, bytes, rows,
+                    peak_memory, memory_increase, error, details
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    operation,
+                    dataset_identifier,
+                    started_at.isoformat(timespec="milliseconds"),
+                    seconds,
+                    entry["bytes"],
+                    entry["rows"],
+                    peak_memory,
+                    memory_increase,
+                    error,
+                    json.dumps(entry["details"]) if entry["details"] else None,
+                ),
+            )
+    except sqlite3.Error as e:
+        logger.warning("Error recording metrics of %s: %s", operation, e)
+
+
+def get_operations(limit: int = 100, operation: str = None) -> pd.DataFrame:
+    """
+    Returns the most recent operations, newest first. The stage times in details are
+    returned as one column per stage.
+
+    Args:
+        limit (int): Maximum number of operations returned.
+        operation (str): Only return operations of this name.
+    """
+    query = "SELECT * FROM operations"
+    params = []
+    if operation:
+        query += " WHERE operation = ?"
+        params.append(operation)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    with catalog.connect() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    details = pd.DataFrame(
+        [json.loads(value) if value else {} for value in df["details"]], index=df.index
+    )
+    df["mb_per_s"] = df["bytes"] / 2**20 / df["seconds"].where(df["seconds"] > 0)
+    return pd.concat([df.drop(columns="details"), details.add_suffix(" (s)")], axis=1)
+
+
+def get_operation_summary() -> pd.DataFrame:
+    """
+    Returns the number of runs and errors, the mean, maximum and total duration and the
+    bytes and rows processed per operation.
+    """
+    with catalog.connect() as conn:
+        return pd.read_sql_query(
+            """
+            SELECT
+                operation,
+                COUNT(*) AS runs,
+                COUNT(error) AS errors,
+                AVG(seconds) AS mean_seconds,
+                MAX(seconds) AS max_seconds,
+                SUM(seconds) AS total_seconds,
+                SUM(bytes) AS bytes,
+                SUM(rows) AS rows,
+                MAX(peak_memory) AS peak_memory
+            FROM operations
+            GROUP BY operation
+            ORDER BY operation
+            """,
+            conn,
+        )
+
+
+def get_slowest_datasets(limit: int = 20) -> pd.DataFrame:
+    """
+    Returns the datasets with the longest mean duration of an operation, slowest first.
+    """
+    with catalog.connect() as conn:
+        return pd.read_sql_query(
+            """
+            SELECT
+                dataset_identifier,
+                operation,
+                COUNT(*) AS runs,
+                AVG(seconds) AS mean_seconds,
+                MAX(seconds) AS max_seconds,
+                MAX(bytes) AS bytes,
+                MAX(rows) AS rows,
+                COUNT(error) AS errors
+            FROM operations
+            WHERE dataset_identifier IS NOT NULL
+            GROUP BY dataset_identifier, operation
+            ORDER BY mean_seconds DESC
+            LIMIT ?
+            """,
+            conn,
+            params=[limit],
+        )
+
+
+def prune(days: int = METRICS_RETENTION_DAYS) -> int:
+    """
+    Removes the operations older than days and returns the number of removed operations.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    with catalog.connect() as conn:
+        cursor = conn.execute(
+            "DELETE FROM operations WHERE started_at < ?",
+            (cutoff.isoformat(timespec="milliseconds"),),
+        )
+        return cursor.rowcount
+
+
+def export_json_lines(since: str = None) -> str:
+    """
+    Returns the recorded operations as JSON lines, oldest first, e.g. to ship them to a
+    log collector.
+
+    Args:
+        since (str): Only export operations started after this ISO timestamp.
+    """
+    query = "SELECT * FROM operations"
+    params = []
+    if since:
+        query += " WHERE started_at > ?"
+        params.append(since)
+    lines = []
+    with catalog.connect() as conn:
+        conn.row_factory = sqlite3.Row
+        for row in conn.execute(query + " ORDER BY id", params):
+            row = dict(row)
+            row["details"] = json.loads(row["details"]) if row["details"] else {}
+            lines.append(json.dumps(row))
+    return "".join(line + "\n" for line in lines)
+
+
+def export_prometheus() -> str:
+    """
+    Returns totals per operation in the Prometheus text exposition format: the number of
+    runs and errors and the seconds, bytes and rows of all runs, plus the peak memory of
+    the process.
+    """
+    summary = get_operation_summary()
+    metrics = [
+        ("operations_total", "runs", "Number of recorded operations."),
+        ("operation_errors_total", "errors", "Number of failed operations."),
+        ("operation_seconds_total", "total_seconds", "Wall time of all operations."),
+        ("operation_bytes_total", "bytes", "Bytes processed by all operations."),
+        ("operation_rows_total", "rows", "Rows processed by all operations."),
+    ]
+    lines = []
+    for name, column, help_text in metrics:
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} counter")
+        for operation, value in zip(summary["operation"], summary[column].fillna(0)):
+            label = operation.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{operation="{label}"}} {float(value)}')
+    peak_memory = get_peak_memory()
+    if peak_memory is not None:
+        name = f"{PROMETHEUS_PREFIX}_peak_memory_bytes"
+        lines.append(f"# HELP {name} Peak resident set size of the process.")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {peak_memory}")
+    return "\n".join(lines) + "\n"
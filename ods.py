@@ -1,228 +1,2178 @@
+import time
+
+_import_start = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-from azure.storage.blob import BlobServiceClient
+import io
 import json
+import logging
+import queue
 import re
-import snowflake.connector
+import shutil
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import catalog
+import metrics
+
+# Azure Storage Account and Snowflake credentials are read from the Streamlit secrets
+# on first use, so pages working with local data only do not need any credentials.
+data_container_name = "data"
+data_folder = Path(data_container_name)
+cache_folder = Path("cache")
+snow_flake_database = "ogd"
+snowflake_stage = "OGD_STAGE"  # Internal Snowflake stage, one prefix per table
+snowflake_file_format = "my_parquet_format"
+snowflake_merge_keys = {}  # declared key columns by dataset identifier, e.g. {"100051": ["id"]}
+
+metadata = "100057" # ODS metadata dataset for data.bs.ch
+metadata_cache_file = cache_folder / f"{metadata}.parquet"
+url_ods_dataset = "https://data.bs.ch/api/explore/v2.1/catalog/datasets/{}?lang=de"
+url_ods_data = "https://data.bs.ch/api/explore/v2.1/catalog/datasets/{}/exports/csv?lang=de&timezone=Europe%2FBerlin&use_labels=false&delimiter=%3B"
+
+DOWNLOAD_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes a streaming download may hold in memory
+DEFAULT_ROW_SIZE = 512  # bytes per CSV row, used if ODS does not report a dataset size
+MIN_CHUNK_ROWS = 1000
+MAX_ROW_GROUP_ROWS = 1000000
+PARQUET_ZSTD_MIN_SIZE = 16 * 1024 * 1024  # datasets of this size or more are compressed with zstd
+DICTIONARY_MAX_RATIO = 0.1  # text columns with at most this share of distinct values are dictionary encoded
+PARTITION_MIN_SIZE = 256 * 1024 * 1024  # time series of this size or more are stored in monthly partitions
+ODS_FIELD_TYPES = {
+    "int": pa.int64(),
+    "double": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "datetime": pa.timestamp("us", tz="UTC"),
+}
+DOWNLOAD_WORKERS = 4  # datasets downloaded in parallel
+HOST_MAX_CONNECTIONS = 4  # concurrent requests to the same host
+HOST_MIN_INTERVAL = 0.2  # seconds between the start of two requests to the same host
+SNOWFLAKE_POOL_SIZE = 4
+SNOWFLAKE_HEALTH_CHECK_INTERVAL = 300  # seconds a connection may be idle before it is checked
+SNOWFLAKE_SESSION_EXPIRED_ERRORS = (390112, 390114)  # session / auth token expired
+SNOWFLAKE_PUT_WORKERS = 4  # files uploaded to the stage in parallel
+SNOWFLAKE_LOAD_MODES = ("auto", "append", "merge", "swap")
+COPY_MAX_FILES = 1000  # most files a COPY with a FILES list may name
+MERGE_KEY_PATTERN = r"id|.*_id|.*_nr|.*nummer"  # column names tried as merge key
+QUERY_PAGE_ROWS = 10000  # maximum rows fetched per page of a query result
+QUERY_PAGE_BYTES = 64 * 1024 * 1024  # maximum uncompressed bytes fetched per page
+LOCAL_QUERY_BATCH_ROWS = 100000  # rows per arrow batch streamed from a local query
+PREVIEW_PAGE_ROWS = 1000  # rows per page of a parquet preview
+PREVIEW_CACHE_ENTRIES = 32  # parquet previews kept open for all sessions
+METADATA_REVALIDATE_INTERVAL = 3600  # seconds between two checks for catalog changes
+METADATA_FULL_REFRESH_INTERVAL = 24 * 3600  # seconds after which the whole catalog is downloaded again
+AZURE_TRANSFER_WORKERS = 4  # blobs transferred in parallel
+# transfer settings, each can be overridden in the azure section of the secrets
+AZURE_DEFAULTS = {
+    "max_concurrency": 4,  # parallel block transfers per blob
+    "max_block_size": 8 * 1024 * 1024,
+    "max_single_put_size": 16 * 1024 * 1024,
+    "max_chunk_get_size": 8 * 1024 * 1024,
+}
+
+metadata_columns = [
+    "dataset_identifier",
+    "title",
+    "modified",
+    "data_processed",
+    "metadata_processed",
+    "size_of_records_in_the_dataset_in_bytes",
+    "number_of_records",
+]
+ods_metadata = None  # the ODS catalog, loaded on first use by get_ods_metadata()
+metadata_version = 0  # incremented whenever ods_metadata is replaced
+startup_timings = {}  # seconds per import and initialisation step
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def startup_step(step: str):
+    """
+    Measures the time of an import or initialisation step. Only the first run of each
+    step is recorded, since later runs find the module or client already initialised.
+    """
+    start = time.perf_counter()
+    yield
+    startup_timings.setdefault(step, time.perf_counter() - start)
+
+
+def get_startup_report() -> pd.DataFrame:
+    """
+    Returns the recorded import and initialisation steps with their duration in seconds.
+    """
+    return pd.DataFrame(
+        list(startup_timings.items()), columns=["step", "seconds"]
+    )
+
+
+def get_secret(section: str, key: str, default=None):
+    """
+    Returns a value from the Streamlit secrets, or default if the secrets file, the
+    section or the key does not exist.
+    """
+    try:
+        return st.secrets[section][key]
+    except (KeyError, FileNotFoundError):
+        return default
+
+
+def get_azure_setting(key: str):
+    return get_secret("azure", key, AZURE_DEFAULTS[key])
+
+
+@st.cache_resource
+def get_blob_service_client():
+    """
+    Creates the Azure Blob Storage client on first use. Blobs larger than
+    max_single_put_size are uploaded in blocks of max_block_size, and downloads are split
+    into chunks of max_chunk_get_size, max_concurrency at a time. A connection_string in
+    the azure secrets, e.g. "UseDevelopmentStorage=true" for the Azurite emulator, is
+    used instead of the account name and key.
+
+    Returns:
+        azure.storage.blob.BlobServiceClient: The client for the storage account.
+    """
+    with startup_step("import azure.storage.blob"):
+        from azure.storage.blob import BlobServiceClient
+
+    connection_string = get_secret("azure", "connection_string")
+    if connection_string is None:
+        azure_storage_account_name = st.secrets["azure"]["azure_storage_account_name"]
+        azure_storage_account_key = st.secrets["azure"]["azure_storage_account_key"]
+        connection_string = f"DefaultEndpointsProtocol=https;AccountName={azure_storage_account_name};AccountKey={azure_storage_account_key}"
+    with startup_step("create Azure client"):
+        return BlobServiceClient.from_connection_string(
+            connection_string,
+            max_block_size=get_azure_setting("max_block_size"),
+            max_single_put_size=get_azure_setting("max_single_put_size"),
+            max_single_get_size=get_azure_setting("max_chunk_get_size"),
+            max_chunk_get_size=get_azure_setting("max_chunk_get_size"),
+        )
+
+
+def get_connection():
+    """
+    Establishes a connection to a Snowflake database using credentials and connection details
+    stored in Streamlit secrets. The session is kept alive by the connector as long as the
+    connection is open.
+
+    Returns:
+        snowflake.connector.SnowflakeConnection: A connection object to interact with the Snowflake database.
+    """
+    import snowflake.connector
+
+    return snowflake.connector.connect(
+        user=st.secrets["snowflake"]["user"],
+        password=st.secrets["snowflake"]["password"],
+        account=st.secrets["snowflake"]["account"],  # e.g., xyz123.region.cloud
+        warehouse=st.secrets["snowflake"]["warehouse"],
+        database=st.secrets["snowflake"]["database"],
+        schema=st.secrets["snowflake"]["schema"],
+        client_session_keep_alive=True,
+    )
+
+
+class SnowflakePool:
+    """
+    A pool of open Snowflake connections. Each cursor checked out with cursor() gets a
+    connection of its own, so the pool can be used from several threads. Connections that
+    have been idle for longer than health_check_interval seconds are checked with a cheap
+    query before they are handed out, and closed or expired connections are replaced.
+    """
+
+    def __init__(self, size: int, health_check_interval: float):
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        import snowflake.connector
+
+        if conn.is_closed():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.cursor().execute("SELECT 1").close()
+            return True
+        except snowflake.connector.errors.Error:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return get_connection()
+            if self._is_healthy(conn, last_used):
+                return conn
+            _close_quietly(conn)
+
+    @contextmanager
+    def cursor(self):
+        """
+        Checks out a connection and yields a cursor on it. The connection is returned to
+        the pool when the block is left, unless its session has expired.
+        """
+        import snowflake.connector
+
+        with self._slots:
+            conn = self._checkout()
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+            except snowflake.connector.errors.Error as e:
+                if is_session_expired(e):
+                    _close_quietly(conn)
+                    conn = None
+                raise
+            finally:
+                if conn is not None:
+                    self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        while not self._idle.empty():
+            _close_quietly(self._idle.get_nowait()[0])
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def is_session_expired(error: Exception) -> bool:
+    """
+    Returns True if a Snowflake error was caused by an expired session or login token.
+    The connection is then useless and a new one must be opened.
+    """
+    return getattr(error, "errno", None) in SNOWFLAKE_SESSION_EXPIRED_ERRORS
+
+
+@st.cache_resource
+def get_snowflake_pool() -> SnowflakePool:
+    """
+    Returns the Snowflake connection pool, which is shared by all sessions of the app. The
+    pool size can be set with the pool_size key in the snowflake section of the secrets.
+    """
+    with startup_step("import snowflake.connector"):
+        import snowflake.connector  # noqa: F401
+
+    return SnowflakePool(
+        size=get_secret("snowflake", "pool_size", SNOWFLAKE_POOL_SIZE),
+        health_check_interval=SNOWFLAKE_HEALTH_CHECK_INTERVAL,
+    )
+
+
+def snowflake_cursor():
+    """
+    Checks out a cursor from the shared connection pool. Use as a context manager:
+
+        with snowflake_cursor() as cur:
+            cur.execute("SELECT 1")
+    """
+    return get_snowflake_pool().cursor()
+
+
+_host_semaphores = {}
+_host_last_request = {}
+_host_lock = threading.Lock()
+
+
+@contextmanager
+def host_slot(url: str):
+    """
+    Waits for a free connection slot to the host of the given url and keeps it until the
+    block is left. Requests to the same host are limited to HOST_MAX_CONNECTIONS at a time
+    and start at least HOST_MIN_INTERVAL seconds apart, so parallel downloads do not
+    overload the ODS portal.
+    """
+    host = urllib.parse.urlparse(url).netloc
+    with _host_lock:
+        semaphore = _host_semaphores.setdefault(
+            host, threading.BoundedSemaphore(HOST_MAX_CONNECTIONS)
+        )
+    with semaphore:
+        with _host_lock:
+            start = max(time.monotonic(), _host_last_request.get(host, 0) + HOST_MIN_INTERVAL)
+            _host_last_request[host] = start
+        time.sleep(max(0, start - time.monotonic()))
+        yield
+
+
+def get_chunk_rows(memory_budget: int, row_size: float = None) -> int:
+    """
+    Returns the number of CSV rows to parse per chunk so that a streaming download stays
+    within the given memory budget.
+
+    Args:
+        memory_budget (int): Maximum number of bytes a download may hold in memory.
+        row_size (float): Average size of a CSV row in bytes, if known from the ODS metadata.
+
+    Returns:
+        int: Number of rows per chunk (and per parquet row group).
+    """
+    row_size = row_size if row_size and row_size > 0 else DEFAULT_ROW_SIZE
+    # a parsed chunk is held twice (pandas and arrow) and pandas objects are larger than
+    # the raw CSV text, so only a quarter of the budget is spent on raw rows.
+    return max(MIN_CHUNK_ROWS, int(memory_budget / (row_size * 4)))
+
+
+def fetch_ods_metadata(where: str = None, etag: str = None, last_modified: str = None):
+    """
+    Downloads the ODS catalog, or only the catalog entries matching an ODSQL filter. If
+    the ETag or Last-Modified header of a previous download is given, the request is
+    conditional and returns None if the catalog has not changed since.
+
+    Returns:
+        tuple: The catalog as a DataFrame and the response headers, or None if unchanged.
+    """
+    url = url_ods_data.format(metadata)
+    if where:
+        url += "&where=" + urllib.parse.quote(where)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with host_slot(url), urllib.request.urlopen(request) as response:
+            df = pd.read_csv(response, sep=";")
+            response_headers = dict(response.headers)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    df["dataset_identifier"] = df["dataset_identifier"].astype(str)
+    return df, response_headers
+
+
+def _save_ods_metadata(df: pd.DataFrame, state: dict):
+    """
+    Writes the catalog to the cache file. The revalidation state (ETag, Last-Modified and
+    time of the last full download) is stored in the parquet metadata.
+    """
+    cache_folder.mkdir(exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, b"ods_booster": json.dumps(state).encode()}
+    )
+    tmp_file = metadata_cache_file.with_name(metadata_cache_file.name + ".tmp")
+    pq.write_table(table, tmp_file)
+    tmp_file.replace(metadata_cache_file)
+
+
+def _load_cached_ods_metadata() -> tuple:
+    table = pq.read_table(metadata_cache_file)
+    state = json.loads(table.schema.metadata.get(b"ods_booster", b"{}"))
+    return table.to_pandas(), state
+
+
+def load_ods_metadata() -> pd.DataFrame:
+    """
+    Returns the ODS catalog from the cache file, so the app starts without waiting for
+    the catalog download. The catalog is only downloaded if there is no cache file yet.
+    """
+    if metadata_cache_file.exists():
+        return _load_cached_ods_metadata()[0]
+    df, headers = fetch_ods_metadata()
+    _save_ods_metadata(df, _get_revalidation_state(headers))
+    return df
+
+
+def _get_revalidation_state(headers: dict) -> dict:
+    return {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "full_refresh": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def revalidate_ods_metadata() -> bool:
+    """
+    Updates the cached ODS catalog. Usually only the entries whose metadata_processed is
+    newer than the newest cached entry are downloaded and merged into the cache. Once per
+    METADATA_FULL_REFRESH_INTERVAL the whole catalog is requested, conditionally on the
+    ETag/Last-Modified of the last full download, which also removes deleted datasets.
+
+    Returns:
+        bool: True if the catalog changed.
+    """
+    if not metadata_cache_file.exists():
+        _set_ods_metadata(load_ods_metadata())
+        return True
+    df, state = _load_cached_ods_metadata()
+    full_refresh = datetime.fromisoformat(state.get("full_refresh", "1970-01-01T00:00:00+00:00"))
+    age = (datetime.now(timezone.utc) - full_refresh).total_seconds()
+    if age > METADATA_FULL_REFRESH_INTERVAL:
+        result = fetch_ods_metadata(
+            etag=state.get("etag"), last_modified=state.get("last_modified")
+        )
+        if result is None:
+            state["full_refresh"] = datetime.now(timezone.utc).isoformat()
+            _save_ods_metadata(df, state)
+            return False
+        df, headers = result
+        state = _get_revalidation_state(headers)
+    else:
+        last_processed = df["metadata_processed"].max()
+        delta, _ = fetch_ods_metadata(where=f"metadata_processed > date'{last_processed}'")
+        if delta.empty:
+            return False
+        updated = df["dataset_identifier"].isin(delta["dataset_identifier"])
+        for col in delta.columns.intersection(df.columns):
+            try:
+                delta[col] = delta[col].astype(df[col].dtype)
+            except (ValueError, TypeError):
+                pass
+        df = pd.concat([df[~updated], delta], ignore_index=True)
+    _save_ods_metadata(df, state)
+    _set_ods_metadata(df)
+    return True
+
+
+def _set_ods_metadata(df: pd.DataFrame):
+    global ods_metadata, metadata_version
+    ods_metadata = df
+    metadata_version += 1
+
+
+_metadata_checked_at = 0.0
+_metadata_lock = threading.Lock()
+_metadata_load_lock = threading.Lock()
+
+
+def _revalidate_ods_metadata_quietly():
+    try:
+        revalidate_ods_metadata()
+    except Exception as e:
+        logger.warning("Error revalidating the ODS catalog: %s", e)
+    finally:
+        _metadata_lock.release()
+
+
+def refresh_ods_metadata() -> bool:
+    """
+    Revalidates the ODS catalog and waits for the result, e.g. in the headless scheduler.
+    Waits for a background revalidation started by get_ods_metadata() instead of running
+    at the same time.
+
+    Returns:
+        bool: True if the catalog changed.
+    """
+    global _metadata_checked_at
+    with _metadata_lock:
+        _metadata_checked_at = time.monotonic()
+        return revalidate_ods_metadata()
+
+
+def get_ods_metadata() -> pd.DataFrame:
+    """
+    Returns the ODS catalog, which is loaded on first use. If the catalog has not been
+    revalidated for METADATA_REVALIDATE_INTERVAL seconds, a revalidation is started in a
+    background thread and the cached catalog is returned without waiting for it. Without
+    a cache file and network access an empty catalog is returned until the download
+    succeeds.
+    """
+    global _metadata_checked_at
+    if ods_metadata is None:
+        with _metadata_load_lock, startup_step("load ODS catalog"):
+            if ods_metadata is None:
+                try:
+                    _set_ods_metadata(load_ods_metadata())
+                    # the cache file was last revalidated when it was written
+                    age = time.time() - metadata_cache_file.stat().st_mtime
+                    _metadata_checked_at = time.monotonic() - age
+                except OSError as e:
+                    logger.error("Error loading the ODS catalog: %s", e)
+                    _set_ods_metadata(pd.DataFrame(columns=metadata_columns))
+                    _metadata_checked_at = time.monotonic()
+    if time.monotonic() - _metadata_checked_at > METADATA_REVALIDATE_INTERVAL:
+        if _metadata_lock.acquire(blocking=False):
+            _metadata_checked_at = time.monotonic()
+            threading.Thread(target=_revalidate_ods_metadata_quietly, daemon=True).start()
+    return ods_metadata
+
+
+def get_row_size(ds: dict) -> float:
+    """
+    Returns the average size of a row in bytes from the ODS metadata of a dataset, or None
+    if the metadata does not report a size.
+    """
+    size = ds.get("size_of_records_in_the_dataset_in_bytes")
+    records = ds.get("number_of_records")
+    if pd.isna(size) or pd.isna(records) or not records:
+        return None
+    return size / records
+
+
+def get_parquet_compression(ds: dict) -> str:
+    """
+    Returns the parquet compression codec for a dataset. Small datasets use snappy, which
+    is fast to decompress; larger ones use zstd, which produces clearly smaller files and
+    so speeds up transfers to Azure and Snowflake.
+    """
+    size = ds.get("size_of_records_in_the_dataset_in_bytes")
+    if pd.notna(size) and size >= PARQUET_ZSTD_MIN_SIZE:
+        return "zstd"
+    return "snappy"
+
+
+def get_partition_field(ds: dict) -> str:
+    """
+    Returns the date field by which a dataset is partitioned, or None if the dataset is
+    stored as a single parquet file. Time series of PARTITION_MIN_SIZE bytes or more are
+    stored in one folder per month (<id>/year=YYYY/month=MM/part-*.parquet), so an
+    incremental sync only adds files to the newest partitions instead of rewriting the
+    whole dataset, and readers can skip the months they do not need.
+    """
+    size = ds.get("size_of_records_in_the_dataset_in_bytes")
+    if pd.isna(size) or size < PARTITION_MIN_SIZE:
+        return None
+    return get_date_field(ds["dataset_identifier"])
+
+
+def get_local_path(ds_id: str) -> Path:
+    """
+    Returns the local storage of a dataset: its partition folder if the dataset is
+    partitioned, otherwise its parquet file.
+    """
+    folder = data_folder / str(ds_id)
+    return folder if folder.is_dir() else data_folder / f"{ds_id}.parquet"
+
+
+def get_part_files(path: Path) -> list:
+    """
+    Returns the parquet files of a dataset: the part files of a partition folder, sorted
+    by year and month, or the file itself.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return sorted(path.glob("year=*/month=*/*.parquet"))
+    return [path]
+
+
+def get_local_size(path: Path) -> int:
+    """
+    Returns the size in bytes of the local parquet file or partition folder of a dataset.
+    """
+    return sum(file.stat().st_size for file in get_part_files(path))
+
+
+def get_local_row_count(path: Path) -> int:
+    """
+    Returns the number of rows of the local parquet file or partition folder of a
+    dataset, read from the parquet footers.
+    """
+    return sum(pq.read_metadata(file).num_rows for file in get_part_files(path))
+
+
+def _remove_local_path(path: Path):
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _get_field_types(ds_id: str) -> dict:
+    """
+    Returns the ODS field types of a dataset by field name, or an empty dict if the
+    dataset schema cannot be fetched, in which case the types are inferred from the data.
+    """
+    try:
+        return {field["name"]: field["type"] for field in get_ods_fields(ds_id)}
+    except OSError:
+        return {}
+
+
+def _get_smallest_int_type(column: pd.Series) -> pa.DataType:
+    values = pd.to_numeric(column, errors="coerce").dropna()
+    for int_type, info in ((pa.int8(), np.iinfo(np.int8)), (pa.int16(), np.iinfo(np.int16)), (pa.int32(), np.iinfo(np.int32))):
+        if values.empty or (values.min() >= info.min and values.max() <= info.max):
+            return int_type
+    return pa.int64()
+
+
+def _infer_schema(chunk: pd.DataFrame, field_types: dict = None, complete: bool = False) -> pa.Schema:
+    """
+    Derives the parquet schema from the first chunk of a download. The ODS field types
+    are used where known, so dates and timestamps are stored as such and ints with
+    missing values do not become floats. Text columns with few distinct values are
+    dictionary encoded. If the chunk holds the complete dataset, ints are downcast to the
+    smallest type holding all values. Columns that are empty in the first chunk and have
+    no ODS type are stored as strings, since their type cannot be inferred yet.
+
+    Args:
+        chunk (pd.DataFrame): The first chunk of the CSV export.
+        field_types (dict): ODS field types by field name.
+        complete (bool): True if the chunk holds all rows of the dataset.
+    """
+    field_types = field_types or {}
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        column = chunk[field.name]
+        field_type = ODS_FIELD_TYPES.get(field_types.get(field.name))
+        if field_type is None and (field.name in field_types or column.isna().all()):
+            field_type = pa.string()
+        field_type = field_type or field.type
+        if pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+            if len(column) > 0 and column.nunique() <= DICTIONARY_MAX_RATIO * len(column):
+                field_type = pa.dictionary(pa.int32(), pa.string())
+        elif complete and pa.types.is_integer(field_type):
+            field_type = _get_smallest_int_type(column)
+        schema = schema.set(i, pa.field(field.name, field_type))
+    return schema
+
+
+class ColumnTypeError(ValueError):
+    """
+    Raised if values of a column do not fit the type of the column, e.g. text in an ODS
+    int field or a fraction in a column whose first chunk only held ints.
+    """
+
+    def __init__(self, field_name: str, field_type: pa.DataType, values: int):
+        super().__init__(f"{values} values of column {field_name} are not of type {field_type}")
+        self.field_name = field_name
+        self.field_type = field_type
+        self.values = values
+
+
+def _coerce(column: pd.Series, field_type: pa.DataType) -> pd.Series:
+    """
+    Converts a column of a CSV chunk to values of the given type. Values that do not
+    fit the type become missing.
+    """
+    if pa.types.is_timestamp(field_type):
+        return pd.to_datetime(column, utc=True, errors="coerce")
+    if pa.types.is_date32(field_type):
+        return pd.to_datetime(column, errors="coerce").dt.date
+    if pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+        return column.astype(str).where(column.notna(), None)
+    if pa.types.is_boolean(field_type):
+        return column.astype(str).str.lower().map({"true": True, "false": False})
+    numbers = pd.to_numeric(column, errors="coerce")
+    if pa.types.is_integer(field_type):
+        numbers = numbers.where(numbers % 1 == 0)
+    return numbers
+
+
+def _count_unfit(column: pd.Series, field_type: pa.DataType) -> int:
+    """
+    Returns the number of values of a column that do not fit the given type.
+    """
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    return int((_coerce(column, field_type).isna() & column.notna()).sum())
+
+
+def _to_arrow(column: pd.Series, field_type: pa.DataType) -> pa.Array:
+    """
+    Converts a column of a CSV chunk to an arrow array of the given type. pandas infers
+    the types of each chunk separately, e.g. an int column becomes float if a chunk
+    contains missing values, so columns that do not convert directly are coerced.
+    Values that do not fit the type raise a ColumnTypeError instead of becoming null.
+    """
+    if pa.types.is_dictionary(field_type):
+        return _to_arrow(column, field_type.value_type).dictionary_encode().cast(field_type)
+    if pa.types.is_timestamp(field_type) or pa.types.is_date32(field_type):
+        values = _coerce(column, field_type)
+    else:
+        try:
+            return pa.array(column, type=field_type, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            values = _coerce(column, field_type)
+    unfit = int((values.isna() & column.notna()).sum())
+    if unfit:
+        raise ColumnTypeError(column.name, field_type, unfit)
+    return pa.array(values, type=field_type, from_pandas=True)
+
+
+def _conform_chunk(chunk: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """
+    Converts a chunk to an arrow table with the schema of the first chunk.
+    """
+    arrays = [_to_arrow(chunk[field.name], field.type) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _read_ods_chunks(
+    ds_id: str,
+    chunk_rows: int,
+    where: str = None,
+    schema: pa.Schema = None,
+    order_by: str = None,
+    text_fields: dict = None,
+    coerced: dict = None,
+) -> Iterator[pa.Table]:
+    """
+    Streams the CSV export of an ODS dataset and yields it as arrow tables of at most
+    chunk_rows rows. All chunks are converted to the given schema, or to the schema
+    derived from the ODS field types and the first chunk if no schema is given.
+
+    Args:
+        ds_id (str): The dataset identifier of the dataset to be downloaded
+        chunk_rows (int): Number of rows per chunk.
+        where (str): Optional ODSQL filter, e.g. "datum > date'2024-01-01'".
+        schema (pa.Schema): Schema the chunks are converted to.
+        order_by (str): Optional field the export is sorted by.
+        text_fields (dict): Fields stored as text instead of their type, by field name.
+        coerced (dict): Counts the values of the text_fields that do not fit their type,
+            by field name.
+    """
+    text_fields = text_fields or {}
+    field_types = {**_get_field_types(ds_id), **{name: "text" for name in text_fields}}
+    # text, dates and geo fields are parsed as strings, so e.g. codes with leading
+    # zeros are kept; numbers are parsed by pandas and converted by _to_arrow.
+    dtype = {
+        name: str
+        for name, field_type in field_types.items()
+        if field_type not in ("int", "double", "boolean")
+    }
+    url = url_ods_data.format(ds_id)
+    if where:
+        url += "&where=" + urllib.parse.quote(where)
+    if order_by:
+        url += "&order_by=" + urllib.parse.quote(f"`{order_by}`")
+    with host_slot(url), urllib.request.urlopen(url) as response:
+        for chunk in pd.read_csv(response, sep=";", chunksize=chunk_rows, dtype=dtype):
+            if schema is None:
+                schema = _infer_schema(chunk, field_types, complete=len(chunk) < chunk_rows)
+            if coerced is not None:
+                for name, field_type in text_fields.items():
+                    if name in chunk:
+                        unfit = _count_unfit(chunk[name], field_type)
+                        coerced[name] = coerced.get(name, 0) + unfit
+            yield _conform_chunk(chunk, schema)
+
+
+def _write_parquet(
+    tables: Iterable[pa.Table],
+    filename: Path,
+    row_group_size: int,
+    compression: str = "snappy",
+) -> int:
+    """
+    Writes a stream of arrow tables to a parquet file, one or more row groups per table.
+    The file is written to a temporary file first and only replaces an existing file once
+    all tables have been written.
+
+    Returns:
+        int: The number of rows written.
+    """
+    filename = Path(filename)
+    tmp_file = filename.with_name(filename.name + ".tmp")
+    writer = None
+    rows = 0
+    try:
+        for table in tables:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_file, table.schema, compression=compression)
+            start = time.perf_counter()
+            writer.write_table(table, row_group_size=min(row_group_size, MAX_ROW_GROUP_ROWS))
+            metrics.add("write", time.perf_counter() - start)
+            rows += table.num_rows
+        if writer is None:
+            pq.write_table(pa.table({}), tmp_file)
+        else:
+            writer.close()
+            writer = None
+        tmp_file.replace(filename)
+    finally:
+        if writer is not None:
+            writer.close()
+        tmp_file.unlink(missing_ok=True)
+    return rows
+
+
+def _split_partitions(table: pa.Table, date_field: str) -> Iterator[tuple]:
+    """
+    Splits a table by the month of its date field and yields the partition path
+    (year=YYYY/month=MM) and the rows of every month. Rows without a date are put into
+    the partition year=0000/month=00.
+    """
+    dates = table[date_field]
+    keys = pc.add(pc.multiply(pc.year(dates), 100), pc.month(dates)).fill_null(0)
+    for key in sorted(pc.unique(keys).to_pylist()):
+        partition = f"year={key // 100:04d}/month={key % 100:02d}"
+        yield partition, table.filter(pc.equal(keys, key))
+
+
+def _write_partitions(
+    tables: Iterable[pa.Table],
+    folder: Path,
+    date_field: str,
+    row_group_size: int,
+    compression: str = "snappy",
+) -> int:
+    """
+    Writes a stream of arrow tables to a partition folder, one new part file per month.
+    Part files are named after the time of the write, so existing part files are never
+    overwritten and part files that were uploaded before do not change. The part files
+    are written to temporary files first and only renamed once all tables have been
+    written.
+
+    Returns:
+        int: The number of rows written.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    part_name = f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.parquet"
+    writers = {}
+    rows = 0
+    try:
+        for table in tables:
+            for partition, part in _split_partitions(table, date_field):
+                if partition not in writers:
+                    tmp_file = folder / partition / (part_name + ".tmp")
+                    tmp_file.parent.mkdir(parents=True, exist_ok=True)
+                    writers[partition] = pq.ParquetWriter(
+                        tmp_file, part.schema, compression=compression
+                    )
+                start = time.perf_counter()
+                writers[partition].write_table(
+                    part, row_group_size=min(row_group_size, MAX_ROW_GROUP_ROWS)
+                )
+                metrics.add("write", time.perf_counter() - start)
+                rows += part.num_rows
+        for writer in writers.values():
+            writer.close()
+        for partition in writers:
+            tmp_file = folder / partition / (part_name + ".tmp")
+            tmp_file.replace(tmp_file.with_name(part_name))
+        writers = {}
+    finally:
+        for writer in writers.values():
+            writer.close()
+        for tmp_file in folder.glob(f"year=*/month=*/{part_name}.tmp"):
+            tmp_file.unlink()
+    return rows
+
+
+def download_ods_table(
+    ds_id: str,
+    filename: Path,
+    memory_budget: int = DOWNLOAD_MEMORY_BUDGET,
+    row_size: float = None,
+    compression: str = "snappy",
+    date_field: str = None,
+    coerced: dict = None,
+) -> int:
+    """
+    Streams the CSV export of an ODS dataset into a parquet file. The export is parsed in
+    chunks and every chunk is written as a parquet row group as soon as it arrives, so the
+    memory used does not depend on the size of the dataset. Columns are typed according
+    to the ODS field schema. The schema is fixed by the first chunk, so if a later chunk
+    holds values that do not fit the type of a column, e.g. text in an ODS int field,
+    the download starts again with that column stored as text.
+
+    Args:
+        ds_id (str): The dataset identifier of the dataset to be downloaded
+        filename (Path): Target parquet file, or partition folder if date_field is given.
+        memory_budget (int): Maximum number of bytes the download may hold in memory.
+        row_size (float): Average size of a CSV row in bytes, if known from the ODS metadata.
+        compression (str): Parquet compression codec, see get_parquet_compression.
+        date_field (str): If given, the dataset is partitioned by the month of this field.
+            The export is sorted by the field, so the chunks fill one partition after the
+            other.
+        coerced (dict): Filled with the number of values that did not fit the type of
+            their column, by the name of the column, which is stored as text instead.
+
+    Returns:
+        int: The number of rows written.
+    """
+    chunk_rows = get_chunk_rows(memory_budget, row_size)
+    text_fields = {}  # field name -> type of the values that did not fit
+    while True:
+        counts = {}
+        try:
+            rows = _download_ods_table(
+                ds_id, filename, chunk_rows, compression, date_field, text_fields, counts
+            )
+        except ColumnTypeError as e:
+            if e.field_name in text_fields:
+                raise
+            logger.warning(
+                "Downloading %s again with %s stored as text: %s", ds_id, e.field_name, e
+            )
+            text_fields[e.field_name] = e.field_type
+            continue
+        if coerced is not None:
+            coerced.update(counts)
+        return rows
+
+
+def _download_ods_table(
+    ds_id: str,
+    filename: Path,
+    chunk_rows: int,
+    compression: str,
+    date_field: str,
+    text_fields: dict,
+    coerced: dict,
+) -> int:
+    with metrics.record("ods_download", ds_id) as m:
+        # time spent waiting for the export and parsing it, as opposed to writing parquet
+        chunks = metrics.timed(
+            _read_ods_chunks(
+                ds_id,
+                chunk_rows,
+                order_by=date_field,
+                text_fields=text_fields,
+                coerced=coerced,
+            ),
+            "export",
+        )
+        if date_field is None:
+            m["rows"] = _write_parquet(chunks, filename, chunk_rows, compression)
+            m["bytes"] = Path(filename).stat().st_size
+            return m["rows"]
+        # the new folder replaces the existing one once it is complete
+        folder = Path(filename)
+        tmp_folder = folder.with_name(folder.name + ".tmp")
+        old_folder = folder.with_name(folder.name + ".old")
+        _remove_local_path(tmp_folder)
+        try:
+            m["rows"] = _write_partitions(chunks, tmp_folder, date_field, chunk_rows, compression)
+            if folder.exists():
+                folder.replace(old_folder)
+            tmp_folder.replace(folder)
+            _remove_local_path(old_folder)
+        finally:
+            _remove_local_path(tmp_folder)
+        m["bytes"] = get_local_size(folder)
+        return m["rows"]
+
+
+def download_dataset(
+    ds: dict, memory_budget: int = DOWNLOAD_MEMORY_BUDGET, coerced: dict = None
+) -> int:
+    """
+    Downloads a dataset completely, as a single parquet file or as a partition folder
+    depending on get_partition_field. Local data of the other layout is removed. Values
+    that did not fit the type of their column are counted in coerced, see
+    download_ods_table.
+
+    Returns:
+        int: The number of rows written.
+    """
+    ds_id = ds["dataset_identifier"]
+    date_field = get_partition_field(ds)
+    filename = data_folder / f"{ds_id}.parquet"
+    folder = data_folder / str(ds_id)
+    rows = download_ods_table(
+        ds_id,
+        folder if date_field else filename,
+        memory_budget,
+        get_row_size(ds),
+        get_parquet_compression(ds),
+        date_field,
+        coerced,
+    )
+    _remove_local_path(filename if date_field else folder)
+    return rows
+
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def get_ods_fields(ds_id: str) -> list:
+    """
+    Fetches the field definitions of an ODS dataset.
+
+    Args:
+        ds_id (str): The dataset identifier.
+
+    Returns:
+        list: One dict per field with the keys "name", "label", "type" and "annotations".
+    """
+    url = url_ods_dataset.format(ds_id)
+    with host_slot(url), urllib.request.urlopen(url) as response:
+        return json.load(response).get("fields", [])
+
+
+def get_date_field(ds_id: str) -> str:
+    """
+    Returns the first date or datetime field of an ODS dataset, or None if the dataset has
+    no such field. Datasets with a date field are treated as time series and are synced
+    incrementally.
+    """
+    for field in get_ods_fields(ds_id):
+        if field["type"] in ("date", "datetime"):
+            return field["name"]
+    return None
+
+
+def _get_max_value(filename: Path, column: str):
+    """
+    Returns the maximum value of a column in a parquet file. The row group statistics are
+    used if they are available, so the data itself is not read.
+    """
+    with pq.ParquetFile(filename) as parquet_file:
+        if column not in parquet_file.schema_arrow.names:
+            return None
+        index = parquet_file.schema_arrow.get_field_index(column)
+        maxima = []
+        for i in range(parquet_file.metadata.num_row_groups):
+            statistics = parquet_file.metadata.row_group(i).column(index).statistics
+            if statistics is None or not statistics.has_min_max:
+                values = parquet_file.read(columns=[column])[column].drop_null()
+                return max(values.to_pylist(), default=None)
+            maxima.append(statistics.max)
+        return max(maxima, default=None)
+
+
+def append_ods_rows(
+    ds_id: str,
+    filename: Path,
+    date_field: str,
+    memory_budget: int = DOWNLOAD_MEMORY_BUDGET,
+    row_size: float = None,
+    compression: str = "snappy",
+    coerced: dict = None,
+) -> int:
+    """
+    Downloads only the rows of a time series dataset that are newer than the newest row in
+    the local parquet file and appends them. The existing row groups are copied to the new
+    file one by one, so memory use stays within the budget.
+
+    Args:
+        ds_id (str): The dataset identifier.
+        filename (Path): Existing local parquet file.
+        date_field (str): Date or datetime field used to select the new rows.
+        memory_budget (int): Maximum number of bytes the download may hold in memory.
+        row_size (float): Average size of a CSV row in bytes, if known from the ODS metadata.
+        compression (str): Parquet compression codec, see get_parquet_compression.
+        coerced (dict): See download_ods_table, used if the file has no rows to append to.
+
+    Returns:
+        int: The number of rows in the updated file.
+    """
+    chunk_rows = get_chunk_rows(memory_budget, row_size)
+    last_value = _get_max_value(filename, date_field)
+    if last_value is None:
+        return download_ods_table(
+            ds_id, filename, memory_budget, row_size, compression, coerced=coerced
+        )
+    if hasattr(last_value, "isoformat"):
+        last_value = last_value.isoformat()
+    parquet_file = pq.ParquetFile(filename)
+    schema = parquet_file.schema_arrow
+
+    def tables():
+        for i in range(parquet_file.metadata.num_row_groups):
+            yield parquet_file.read_row_group(i)
+        # the file is replaced once all rows are written, so it must be closed by then
+        parquet_file.close()
+        chunks = _read_ods_chunks(
+            ds_id, chunk_rows, where=f"`{date_field}` > date'{last_value}'", schema=schema
+        )
+        yield from metrics.timed(chunks, "export")
+
+    with metrics.record("ods_append", ds_id) as m:
+        m["rows"] = _write_parquet(tables(), filename, chunk_rows, compression)
+        m["bytes"] = Path(filename).stat().st_size
+        return m["rows"]
+
+
+def append_ods_partitions(
+    ds_id: str,
+    folder: Path,
+    date_field: str,
+    memory_budget: int = DOWNLOAD_MEMORY_BUDGET,
+    row_size: float = None,
+    compression: str = "snappy",
+    coerced: dict = None,
+) -> int:
+    """
+    Downloads only the rows of a partitioned dataset that are newer than the newest row in
+    the latest partition and writes them as new part files. Existing part files are not
+    read or rewritten.
+
+    Args:
+        ds_id (str): The dataset identifier.
+        folder (Path): Existing partition folder.
+        date_field (str): Date or datetime field the dataset is partitioned by.
+        memory_budget (int): Maximum number of bytes the download may hold in memory.
+        row_size (float): Average size of a CSV row in bytes, if known from the ODS metadata.
+        compression (str): Parquet compression codec, see get_parquet_compression.
+        coerced (dict): See download_ods_table, used if the folder has no rows to append to.
+
+    Returns:
+        int: The number of rows in the updated partition folder.
+    """
+    chunk_rows = get_chunk_rows(memory_budget, row_size)
+    part_files = get_part_files(folder)
+    latest_partition = part_files[-1].parent if part_files else None
+    maxima = [
+        _get_max_value(part_file, date_field)
+        for part_file in part_files
+        if part_file.parent == latest_partition
+    ]
+    last_value = max((value for value in maxima if value is not None), default=None)
+    if last_value is None:
+        return download_ods_table(
+            ds_id, folder, memory_budget, row_size, compression, date_field, coerced
+        )
+    if hasattr(last_value, "isoformat"):
+        last_value = last_value.isoformat()
+    chunks = _read_ods_chunks(
+        ds_id,
+        chunk_rows,
+        where=f"`{date_field}` > date'{last_value}'",
+        schema=pq.read_schema(part_files[-1]),
+        order_by=date_field,
+    )
+    with metrics.record("ods_append", ds_id) as m:
+        _write_partitions(metrics.timed(chunks, "export"), folder, date_field, chunk_rows, compression)
+        m["rows"] = get_local_row_count(folder)
+        m["bytes"] = get_local_size(folder)
+        return m["rows"]
+
+
+def get_stale_datasets() -> pd.DataFrame:
+    """
+    Compares the ODS catalog with the local metadata and returns the locally stored
+    datasets whose modification timestamps or record counts differ from the catalog.
+
+    Returns:
+        pd.DataFrame: The stale rows of get_merged_datasets(), shared like the view.
+    """
+    return _get_stale_datasets(*get_catalog_versions())
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _get_stale_datasets(metadata_version: int, catalog_version: int) -> pd.DataFrame:
+    df = _get_merged_datasets(metadata_version, catalog_version)
+    df = df[df["modified_local"].notna()]
+    changed = (
+        (df["modified_ods"] != df["modified_local"])
+        | (df["data_processed_ods"] != df["data_processed_local"])
+        | (
+            pd.to_numeric(df["number_of_records_ods"])
+            != pd.to_numeric(df["number_of_records_local"])
+        )
+    )
+    return df[changed]
+
+
+def sync_dataset(
+    ds: dict, memory_budget: int = DOWNLOAD_MEMORY_BUDGET, coerced: dict = None
+) -> tuple:
+    """
+    Brings the local parquet file of a dataset up to date. Time series datasets that only
+    grew are updated by appending the new rows, to the file or as new part files of a
+    partitioned dataset; all other datasets are downloaded again. If the appended data
+    does not have the number of records reported by ODS, e.g. because rows were corrected
+    in the past, or if the dataset has to change its layout, the dataset is downloaded
+    completely. Appended rows get the columns of the local file, so a dataset whose ODS
+    fields were added, removed or renamed is downloaded completely as well.
+
+    Args:
+        ds (dict): ODS metadata of the dataset.
+        memory_budget (int): Maximum number of bytes the download may hold in memory.
+        coerced (dict): See download_ods_table.
+
+    Returns:
+        tuple: The number of rows in the local file and the sync mode ("append" or "full").
+    """
+    ds_id = ds["dataset_identifier"]
+    path = get_local_path(ds_id)
+    records = ds["number_of_records"]
+    row_size = get_row_size(ds)
+    compression = get_parquet_compression(ds)
+    date_field = get_date_field(ds_id)
+    partitioned = get_partition_field(ds) is not None
+    if date_field and path.exists() and path.is_dir() == partitioned:
+        local_records = get_local_row_count(path)
+        part_files = get_part_files(path)
+        same_fields = bool(part_files) and (
+            set(_get_field_types(ds_id)) == set(pq.read_schema(part_files[-1]).names)
+        )
+        if same_fields and records >= local_records:
+            append = append_ods_partitions if partitioned else append_ods_rows
+            try:
+                rows = append(
+                    ds_id, path, date_field, memory_budget, row_size, compression, coerced
+                )
+                if rows == records:
+                    return rows, "append"
+            except (pa.ArrowException, ColumnTypeError):
+                # new values do not fit the column types of the local file, e.g. an int
+                # column that was downcast when the dataset was small or text in an int
+                # field, which the full download stores as text
+                pass
+    return download_dataset(ds, memory_budget, coerced), "full"
+
+
+def download_datasets(
+    datasets: list,
+    memory_budget: int = DOWNLOAD_MEMORY_BUDGET,
+    workers: int = DOWNLOAD_WORKERS,
+    incremental: bool = False,
+) -> Iterator[dict]:
+    """
+    Downloads several datasets in parallel and yields one result per dataset as soon as it
+    is finished. A failing download does not stop the others; its error is reported in the
+    result. The memory budget is shared by all workers.
+
+    Args:
+        datasets (list): ODS metadata dicts of the datasets to download.
+        memory_budget (int): Maximum number of bytes all downloads together may hold in memory.
+        workers (int): Number of datasets downloaded in parallel.
+        incremental (bool): If True, datasets are updated with sync_dataset, otherwise they
+            are downloaded completely.
+
+    Yields:
+        dict: The keys "ds", "rows", "bytes", "seconds", "content_hash", "error" (None
+            on success) and "coerced", the number of values per column that did not fit
+            the type of the column, which is stored as text instead.
+    """
+    workers = max(1, min(workers, len(datasets)))
+    worker_budget = memory_budget // workers
+
+    def download(ds, coerced):
+        start = time.perf_counter()
+        if incremental:
+            rows, _ = sync_dataset(ds, worker_budget, coerced)
+        else:
+            rows = download_dataset(ds, worker_budget, coerced)
+        seconds = time.perf_counter() - start
+        path = get_local_path(ds["dataset_identifier"])
+        return rows, seconds, catalog.get_file_hash(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        coerced = {ds["dataset_identifier"]: {} for ds in datasets}
+        futures = {
+            executor.submit(download, ds, coerced[ds["dataset_identifier"]]): ds
+            for ds in datasets
+        }
+        for future in as_completed(futures):
+            ds = futures[future]
+            result = {"ds": ds, "rows": 0, "bytes": 0, "seconds": 0.0, "error": None}
+            result["coerced"] = coerced[ds["dataset_identifier"]]
+            try:
+                result["rows"], result["seconds"], result["content_hash"] = future.result()
+                result["bytes"] = get_local_size(get_local_path(ds["dataset_identifier"]))
+            except Exception as e:
+                result["error"] = e
+            yield result
+
+
+class TableBatch:
+    """
+    A query result held as an arrow table, with the attributes of a Snowflake ResultBatch
+    that fetch_result_page uses, so it is paged like the batches stored by Snowflake.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.rowcount = table.num_rows
+        self.uncompressed_size = table.nbytes
+
+    def to_arrow(self) -> pa.Table:
+        return self.table
+
+
+def get_query_result_batches(query: str) -> list:
+    """
+    Executes a query and returns its result batches. A result batch is a reference to a
+    chunk of the result stored by Snowflake; it can be downloaded later with
+    fetch_result_page, without holding a connection. Statements without an arrow result,
+    e.g. SHOW or DESCRIBE, are fetched as rows at once and returned as a TableBatch.
+
+    Returns:
+        list: The ResultBatch objects of the query, empty if the query failed.
+    """
+    from snowflake.connector.result_batch import JSONResultBatch
+
+    try:
+        with snowflake_cursor() as cur:
+            cur.execute(query)
+            batches = cur.get_result_batches()
+            if not any(isinstance(batch, JSONResultBatch) for batch in batches):
+                return batches
+            column_names = [desc[0] for desc in cur.description]
+            df = pd.DataFrame(cur.fetchall(), columns=column_names)
+            if df.empty:
+                return []
+            return [TableBatch(pa.Table.from_pandas(df, preserve_index=False))]
+    except Exception as e:
+        st.error(f"Error executing query: {e}")
+        return []
+
+
+def fetch_result_page(
+    batches: list,
+    start: tuple = (0, 0),
+    max_rows: int = QUERY_PAGE_ROWS,
+    max_bytes: int = QUERY_PAGE_BYTES,
+    cache: dict = None,
+) -> tuple:
+    """
+    Downloads one page of a query result. Result batches are added to the page until
+    max_rows or max_bytes would be exceeded; a batch that does not fit completely is
+    split, so a page never holds more than max_rows rows or, unless a single row is
+    larger, max_bytes bytes. A batch is downloaded completely, so the last downloaded
+    batch is kept in cache and the next pages within that batch do not download it
+    again.
+
+    Args:
+        batches (list): ResultBatch objects returned by get_query_result_batches.
+        start (tuple): Index of the first batch and the first row in that batch.
+        max_rows (int): Maximum number of rows in the page.
+        max_bytes (int): Maximum uncompressed size of the page in bytes.
+        cache (dict): Holds the last downloaded batch between calls, e.g. in the session
+            state.
+
+    Returns:
+        tuple: The page as an arrow table (None if there are no more rows) and the start
+            of the next page (None if this is the last page).
+    """
+    batch_index, offset = start
+    cache = {} if cache is None else cache
+    tables = []
+    rows = 0
+    size = 0
+    with metrics.record("snowflake_fetch") as m:
+        while batch_index < len(batches) and rows < max_rows:
+            batch = batches[batch_index]
+            if tables and size + (batch.uncompressed_size or 0) > max_bytes:
+                break
+            if cache.get("batch") is not batch:
+                cache.update(batch=batch, table=batch.to_arrow())
+            table = cache["table"]
+            row_size = table.nbytes / max(table.num_rows, 1)
+            # rows that fit into the page, at least one
+            fit = max_rows - rows
+            if row_size:
+                fit = min(fit, int((max_bytes - size) // row_size))
+            if tables and fit <= 0:
+                break
+            table = table.slice(offset, max(fit, 1))
+            tables.append(table)
+            rows += table.num_rows
+            size += int(table.num_rows * row_size)
+            offset += table.num_rows
+            if offset >= batch.rowcount:
+                batch_index, offset = batch_index + 1, 0
+        m["rows"], m["bytes"] = rows, size
+    next_start = (batch_index, offset) if batch_index < len(batches) else None
+    page = pa.concat_tables(tables) if tables else None
+    return page, next_start
+
+
+def get_dataset_metadata(identifier: str) -> dict:
+    """
+    Returns the ODS catalog entry of a dataset as a JSON serialisable dict. Raises a
+    KeyError if the dataset is not in the catalog.
+    """
+    row = get_metadata_view().loc[str(identifier)]
+    return {"dataset_identifier": str(identifier), **json.loads(row.to_json())}
 
-# Azure Storage Account details
-azure_storage_account_name = st.secrets["azure"]["azure_storage_account_name"]
-azure_storage_account_key = st.secrets["azure"]["azure_storage_account_key"]
-data_container_name = "data"
-data_folder = Path(data_container_name)
-snow_flake_database = "ogd"
 
-metadata = "100057" # ODS metadata dataset for data.bs.ch
-config_file = "log.json"
-url_ods_data = "https://data.bs.ch/api/explore/v2.1/catalog/datasets/{}/exports/csv?lang=de&timezone=Europe%2FBerlin&use_labels=false&delimiter=%3B"
+def register_download(ds: dict, rows: int, content_hash: str = None):
+    """
+    Records a downloaded dataset in the local catalog. Existing entries are replaced, so
+    the local modification timestamp always reflects the last download.
+    """
+    path = get_local_path(ds["dataset_identifier"])
+    if content_hash is None:
+        content_hash = catalog.get_file_hash(path)
+    catalog.upsert_dataset(ds, rows, get_local_size(path), content_hash)
 
-blob_service_client = BlobServiceClient.from_connection_string(
-    f"DefaultEndpointsProtocol=https;AccountName={azure_storage_account_name};AccountKey={azure_storage_account_key}"
-)
-containers = blob_service_client.list_containers()
 
+def get_snowflake_table_name(file_path: str) -> str:
+    match = re.search(r"(\d+)", Path(file_path).name)
+    number_part = match.group(1) if match else None
+    return f"DS_{number_part}"
 
-# @st.cache_resource
-def get_connection():
+
+def get_query_dataset(query: str) -> str:
     """
-    Establishes a connection to a Snowflake database using credentials and connection details
-    stored in Streamlit secrets.
+    Returns the identifier of the first dataset table (DS_<identifier>) a query refers
+    to, or None.
+    """
+    match = re.search(r"\bDS_(\d+)\b", query, re.IGNORECASE)
+    return match.group(1) if match else None
 
-    Returns:
-        snowflake.connector.SnowflakeConnection: A connection object to interact with the Snowflake database.
+
+def get_file_dataset(name: str) -> str:
     """
-    return snowflake.connector.connect(
-        user=st.secrets["snowflake"]["user"],
-        password=st.secrets["snowflake"]["password"],
-        account=st.secrets["snowflake"]["account"],  # e.g., xyz123.region.cloud
-        warehouse=st.secrets["snowflake"]["warehouse"],
-        database=st.secrets["snowflake"]["database"],
-        schema=st.secrets["snowflake"]["schema"],
-    )
+    Returns the dataset identifier a file, partition folder or blob name starts with,
+    e.g. "100233" for "100233.parquet" or "100233/year=2024/month=01/part.parquet".
+    """
+    match = re.match(r"\d+", name)
+    return match.group() if match else None
 
 
-def get_cursor():
+def get_stage_path(table_name: str) -> str:
     """
-    Establishes a connection to the database and returns a cursor object.
+    Returns the location in the Snowflake stage where the files of a table are uploaded.
+    Every table has a prefix of its own, so loads of different tables do not interfere.
+    """
+    return f"@{snowflake_stage}/{table_name}/"
 
-    Returns:
-        cursor: A cursor object to interact with the database.
 
-    Raises:
-        Exception: If there is an error connecting to the database, an error message is displayed.
+def get_snowflake_type(arrow_type: pa.DataType) -> str:
     """
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        return cur
-    except Exception as e:
-        st.error(f"Error connecting to Snowflake: {e}")
+    Returns the Snowflake column type for an arrow type of a parquet column. All integer
+    widths map to NUMBER(38,0), so a column downcast in one file and not in another
+    keeps its type.
+    """
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_integer(arrow_type):
+        return "NUMBER(38,0)"
+    if pa.types.is_decimal(arrow_type):
+        return f"NUMBER({arrow_type.precision},{arrow_type.scale})"
+    if pa.types.is_floating(arrow_type):
+        return "FLOAT"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOLEAN"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "VARCHAR"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP_TZ" if arrow_type.tz else "TIMESTAMP_NTZ"
+    if pa.types.is_time(arrow_type):
+        return "TIME"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "BINARY"
+    return "VARIANT"
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def get_ods_table(ds_id: str) -> pd.DataFrame:
+def get_file_columns(file_path: Path) -> dict:
     """
-    Fetches and returns a DataFrame from a CSV file located at a URL, referenced by the given dataset identifier.
+    Returns the Snowflake column types of a local parquet file or partition folder, read
+    from the parquet footer of its first file.
+    """
+    schema = pq.read_schema(get_part_files(file_path)[0])
+    return {field.name: get_snowflake_type(field.type) for field in schema}
 
-    Args:
-        ds_id (str): The dataset identifier to of the dataset to be downloaded
 
-    Returns:
-        pd.DataFrame: A DataFrame containing the data from the CSV file. If the column 'dataset_identifier' exists, 
-                      it is converted to a string type.
+def _get_number_type(data_type: str) -> tuple:
+    match = re.fullmatch(r"NUMBER\((\d+),(\d+)\)", data_type)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def _widen_type(current: str, new: str) -> str:
     """
-    df = pd.read_csv(url_ods_data.format(ds_id), sep=";")
-    if "dataset_identifier" in df.columns:
-        df["dataset_identifier"] = df["dataset_identifier"].astype(str)
-    return df
+    Returns the type a column of type current has to be changed to so it takes values of
+    type new: current if they fit already, a wider NUMBER or VARCHAR if Snowflake can
+    widen the column in place, or None if the table has to be rebuilt.
+    """
+    if current == new or current in ("VARCHAR", "VARIANT"):
+        return current
+    if current.startswith("VARCHAR(") and new == "VARCHAR":
+        return "VARCHAR"
+    if current == "FLOAT" and _get_number_type(new):
+        return current
+    current_number, new_number = _get_number_type(current), _get_number_type(new)
+    if current_number and new_number and current_number[1] == new_number[1]:
+        return current if current_number[0] >= new_number[0] else new
+    return None
+
+
+def _load_table_schemas(cur, table_names: list) -> dict:
+    """
+    Returns the column types of tables from the schema registry. Tables that are not
+    registered yet are read once from INFORMATION_SCHEMA.COLUMNS and registered; tables
+    that do not exist in Snowflake are left out.
+    """
+    schemas = catalog.get_table_schemas(table_names)
+    missing = [name.upper() for name in table_names if name.upper() not in schemas]
+    if missing:
+        cur.execute(
+            f"""
+            SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, NUMERIC_PRECISION, NUMERIC_SCALE
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = CURRENT_SCHEMA()
+            AND TABLE_NAME IN ({", ".join(["%s"] * len(missing))})
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """,
+            missing,
+        )
+        for table_name, column, data_type, precision, scale in cur.fetchall():
+            if data_type == "NUMBER":
+                data_type = f"NUMBER({precision},{scale})"
+            elif data_type == "TEXT":
+                data_type = "VARCHAR"
+            schemas.setdefault(table_name, {})[column] = data_type
+        for table_name in missing:
+            if table_name in schemas:
+                catalog.set_table_schema(table_name, schemas[table_name])
+    return schemas
+
+
+def _create_table(cur, table_name: str, columns: dict, replace: bool = False):
+    """
+    Creates a table with the given column types, e.g. those of get_file_columns().
+    """
+    columns_sql = ", ".join(
+        f"{_quote(column)} {data_type}" for column, data_type in columns.items()
+    )
+    create_sql = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    cur.execute(f"{create_sql} {table_name} ({columns_sql})")
 
 
-def run_snowflake_query(query: str) -> pd.DataFrame:
+def _evolve_table(cur, table_name: str, current: dict, columns: dict) -> dict:
     """
-    Executes a given SQL query on a Snowflake database and returns the result as a pandas DataFrame.
+    Adds the columns of a file that a table lacks and widens the columns whose type is
+    too narrow for the file, comparing the registered schema with the file schema so
+    unchanged tables cost no query. Columns missing in the file are kept; COPY leaves
+    them empty.
 
     Args:
-        query (str): The SQL query to be executed.
+        current (dict): The registered column types of the table.
+        columns (dict): The column types of the file.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the query results, with column names derived from the query.
+        dict: The column types of the table afterwards, or None if a column cannot be
+            widened in place and the table has to be rebuilt.
     """
-    try:
-        cur = get_cursor()
-        cur.execute(query)
-        rows = cur.fetchall()
-        # Get column names
-        column_names = [desc[0] for desc in cur.description]
-        return pd.DataFrame(rows, columns=column_names)
-    except Exception as e:
-        st.error(f"Error executing query: {e}")
-        return pd.DataFrame()
+    # COPY matches the columns case-insensitively
+    current_by_name = {column.upper(): column for column in current}
+    evolved = dict(current)
+    added = {}
+    for column, data_type in columns.items():
+        existing = current_by_name.get(column.upper())
+        if existing is None:
+            added[column] = data_type
+            continue
+        widened = _widen_type(current[existing], data_type)
+        if widened is None:
+            return None
+        if widened != current[existing]:
+            cur.execute(
+                f"ALTER TABLE {table_name} ALTER COLUMN {_quote(existing)} "
+                f"SET DATA TYPE {widened}"
+            )
+            evolved[existing] = widened
+    if added:
+        added_sql = ", ".join(
+            f"{_quote(column)} {data_type}" for column, data_type in added.items()
+        )
+        cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {added_sql}")
+        evolved.update(added)
+    if evolved != current:
+        catalog.set_table_schema(table_name, evolved)
+    return evolved
+
 
+def _get_stage_files(file_path: Path) -> dict:
+    """
+    Returns the files to upload for a local dataset by their path in the stage prefix of
+    its table: the file itself, or all part files of a partition folder with their
+    year=YYYY/month=MM path.
+    """
+    if file_path.is_dir():
+        return {
+            part_file.relative_to(file_path).as_posix(): part_file
+            for part_file in get_part_files(file_path)
+        }
+    return {file_path.name: file_path}
 
-def save_config(log):
-    with open(config_file, "w") as file:
-        json.dump(log, file)
 
+def _get_stage_name(name: str, table_name: str) -> str:
+    """
+    Returns the path of a staged file relative to the stage prefix of its table, given
+    its name as reported by LIST or COPY, e.g. ogd_stage/DS_1/year=2024/month=01/part.parquet.
+    """
+    return re.split(f"/{table_name}/", name, maxsplit=1, flags=re.IGNORECASE)[-1]
 
-def load_config():
-    with open(config_file, "r") as file:
-        log = json.load(file)
-    return log
 
+def _is_unique(files: list, column: str) -> bool:
+    """
+    Returns True if a column has no nulls and no repeated values in the given files.
+    Only this column is read.
+    """
+    chunks = []
+    for file in files:
+        values = pq.read_table(file, columns=[column]).column(0)
+        if values.null_count:
+            return False
+        if pa.types.is_dictionary(values.type):
+            values = values.cast(values.type.value_type)
+        chunks.append(pc.unique(values))
+    rows = sum(pq.ParquetFile(file).metadata.num_rows for file in files)
+    values = pa.chunked_array(chunks, type=chunks[0].type if chunks else pa.null())
+    return len(pc.unique(values)) == rows
 
-def get_snowflake_tables() -> pd.DataFrame:
-    cur = get_cursor()
 
-    # Step 1: Fetch List of Tables
-    cur.execute("SHOW TABLES;")
-    tables = cur.fetchall()
-    tables = [table[1] for table in tables]
-    df = pd.DataFrame(tables, columns=["table_name"])
-    df["dataset_identifier"] = df["table_name"].str.extract(r"(\d+)$")
-    return df
+def get_merge_key(ds_id: str, path: Path) -> list:
+    """
+    Returns the columns that identify a row of a dataset: the key declared in
+    snowflake_merge_keys or, inferred from the data, the first column named like an
+    identifier (MERGE_KEY_PATTERN) or else the date field of a time series whose values
+    are unique and never null in the local file. None if there is no such column.
+    """
+    declared = snowflake_merge_keys.get(str(ds_id))
+    if declared:
+        return list(declared)
+    files = get_part_files(path)
+    if not files:
+        return None
+    names = pq.read_schema(files[0]).names
+    candidates = [
+        name for name in names if re.fullmatch(MERGE_KEY_PATTERN, name, re.IGNORECASE)
+    ]
+    try:
+        date_field = get_date_field(ds_id)
+    except OSError:
+        date_field = None
+    if date_field in names and date_field not in candidates:
+        candidates.append(date_field)
+    for column in candidates:
+        if _is_unique(files, column):
+            return [column]
+    return None
 
 
-def upload_to_snowflake_storage(file_path: str):
-    def check_if_table_exists():
-        # Check if table exists
-        file_format = "my_parquet_format"
+def _copy_staged_files(cur, target_table: str, table_name: str, names: list = None) -> dict:
+    """
+    Copies files from the stage prefix of table_name into target_table, all of them or
+    only the named ones, and returns the COPY output per staged file.
+    """
+    copy_results = {}
+    if names is None:
+        batches = [None]
+    else:
+        batches = [names[i : i + COPY_MAX_FILES] for i in range(0, len(names), COPY_MAX_FILES)]
+    for batch in batches:
+        files_sql = ""
+        if batch is not None:
+            files_sql = "FILES = (" + ", ".join(f"'{name}'" for name in batch) + ")"
         cur.execute(
             f"""
-            SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_NAME = '{table_name.upper()}' AND TABLE_SCHEMA = CURRENT_SCHEMA();
+            COPY INTO {target_table}
+            FROM {get_stage_path(table_name)}
+            {files_sql}
+            FILE_FORMAT = (TYPE = PARQUET)
+            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE;
         """
         )
+        column_names = [desc[0].lower() for desc in cur.description]
+        for row in cur.fetchall():
+            row = dict(zip(column_names, row))
+            if "file" in row:
+                copy_results[_get_stage_name(row["file"], table_name)] = row
+    return copy_results
+
+
+def _quote(column: str) -> str:
+    # columns are created with the case of the parquet schema
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _get_merge_sql(table_name: str, staging_table: str, key: list, columns: list) -> str:
+    """
+    Returns a MERGE that inserts the new rows of the staging table and updates only the
+    rows of which a column changed.
+    """
+    values = [column for column in columns if column not in key]
+    on_sql = " AND ".join(f"t.{_quote(column)} = s.{_quote(column)}" for column in key)
+    sql = f"MERGE INTO {table_name} t USING {staging_table} s ON {on_sql}"
+    if values:
+        changed_sql = " OR ".join(
+            f"t.{_quote(column)} IS DISTINCT FROM s.{_quote(column)}" for column in values
+        )
+        set_sql = ", ".join(f"t.{_quote(column)} = s.{_quote(column)}" for column in values)
+        sql += f" WHEN MATCHED AND ({changed_sql}) THEN UPDATE SET {set_sql}"
+    insert_sql = ", ".join(_quote(column) for column in columns)
+    values_sql = ", ".join(f"s.{_quote(column)}" for column in columns)
+    return sql + f" WHEN NOT MATCHED THEN INSERT ({insert_sql}) VALUES ({values_sql})"
+
+
+def _merge_staged_files(
+    cur, table_name: str, names: list, key: list, columns: list, full: bool
+) -> tuple:
+    """
+    Copies staged files into a transient staging table and merges it into the table on
+    key. If the files hold the whole dataset (full), rows whose key is no longer in the
+    dataset are deleted. MERGE and DELETE run in one transaction.
+
+    Returns:
+        tuple: The COPY output per staged file and the numbers of inserted, updated and
+            deleted rows.
+    """
+    staging_table = f"{table_name}_STAGING"
+    cur.execute(f"CREATE OR REPLACE TRANSIENT TABLE {staging_table} LIKE {table_name}")
+    try:
+        copy_results = _copy_staged_files(cur, staging_table, table_name, names)
+        cur.execute("BEGIN")
+        try:
+            cur.execute(_get_merge_sql(table_name, staging_table, key, columns))
+            counts = dict(zip([desc[0].lower() for desc in cur.description], cur.fetchone()))
+            deleted = 0
+            if full:
+                key_sql = " AND ".join(f"s.{_quote(column)} = t.{_quote(column)}" for column in key)
+                cur.execute(
+                    f"DELETE FROM {table_name} t WHERE NOT EXISTS "
+                    f"(SELECT 1 FROM {staging_table} s WHERE {key_sql})"
+                )
+                deleted = cur.fetchone()[0]
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    inserted = counts.get("number of rows inserted", 0)
+    updated = counts.get("number of rows updated", 0)
+    return copy_results, (inserted, updated, deleted)
+
+
+def _swap_staged_files(cur, table_name: str, columns: dict = None) -> dict:
+    """
+    Copies all staged files of a table into a new table and swaps it with the table in
+    one atomic step, for datasets without a key. The new table has the columns of the
+    table, or the given column types if the table is rebuilt with a changed schema.
+    Returns the COPY output per file.
+    """
+    swap_table = f"{table_name}_SWAP"
+    if columns:
+        _create_table(cur, swap_table, columns, replace=True)
+    else:
+        cur.execute(f"CREATE OR REPLACE TABLE {swap_table} LIKE {table_name}")
+    try:
+        copy_results = _copy_staged_files(cur, swap_table, table_name)
+        cur.execute(f"ALTER TABLE {table_name} SWAP WITH {swap_table}")
+    finally:
+        cur.execute(f"DROP TABLE IF EXISTS {swap_table}")
+    return copy_results
+
+
+def load_files_to_snowflake(
+    file_paths: list, workers: int = SNOWFLAKE_PUT_WORKERS, mode: str = "auto"
+) -> list:
+    """
+    Loads parquet files into Snowflake tables, one table per dataset. The files are
+    uploaded in parallel, each into the stage prefix of its table, and then every table
+    is loaded with a single COPY over its prefix. Missing tables are created with the
+    schema of the local files.
 
-        table_exists = cur.fetchone()[0] > 0
-        # If the table doesn't exist, create it using the Parquet schema
-        if not table_exists:
+    The column types of the tables are kept in the schema registry of the local catalog,
+    so loads need no metadata queries. Columns a file adds are added to the table and
+    columns whose type got wider are widened; if a type cannot be widened in place, the
+    table is rebuilt with swap.
+
+    Partition folders are staged with their year=YYYY/month=MM paths. Their part files
+    are never rewritten, so only the part files missing in the stage are uploaded.
+
+    Existing tables are loaded in one of these modes:
+
+    - "append": COPY into the table. COPY skips the files it has loaded before, so this
+      only suits new part files of a partitioned dataset.
+    - "merge": COPY the uploaded files into a transient staging table and MERGE it into
+      the table on the merge key (get_merge_key), inserting new and updating changed rows
+      only. If the files hold the whole dataset, rows no longer in it are deleted.
+    - "swap": COPY all staged files into a new table and swap it with the table
+      (ALTER TABLE ... SWAP WITH), replacing the table in one atomic step.
+    - "auto": merge if the dataset has a merge key, append if only new part files were
+      uploaded, swap otherwise.
+
+    Args:
+        file_paths (list): Local parquet files or partition folders. The table name is
+            derived from the dataset identifier in the path.
+        workers (int): Number of files uploaded in parallel.
+        mode (str): One of SNOWFLAKE_LOAD_MODES.
+
+    Returns:
+        list: One dict per file with the keys "file_path", "table_name", "mode",
+            "status", "rows_loaded", "rows_inserted", "rows_updated", "rows_deleted" and
+            "error", taken from the output of COPY and MERGE.
+    """
+    if mode not in SNOWFLAKE_LOAD_MODES:
+        raise ValueError(f"Unknown load mode: {mode}")
+    tables = {}
+    stage_files = {}
+    for file_path in file_paths:
+        file_path = Path(file_path)
+        tables.setdefault(get_snowflake_table_name(file_path), []).append(file_path)
+        stage_files[file_path] = _get_stage_files(file_path)
+    errors = {}
+    puts = []
+    replaced = set()  # tables whose staged files were removed or rewritten
+
+    # Step 1: Clear the stage prefixes and upload the files
+    with snowflake_cursor() as cur:
+        for table_name, files in tables.items():
+            if not any(file_path.is_dir() for file_path in files):
+                cur.execute(f"REMOVE {get_stage_path(table_name)};")
+                staged = set()
+                replaced.add(table_name)
+            else:
+                cur.execute(f"LIST {get_stage_path(table_name)};")
+                staged = {_get_stage_name(row[0], table_name) for row in cur.fetchall()}
+                local = {name for file_path in files for name in stage_files[file_path]}
+                for name in sorted(staged - local):
+                    cur.execute(f"REMOVE {get_stage_path(table_name)}{name};")
+                    replaced.add(table_name)
+            for file_path in files:
+                for name, local_file in stage_files[file_path].items():
+                    if name not in staged:
+                        puts.append((table_name, file_path, name, local_file))
+        schemas = _load_table_schemas(cur, list(tables))
+
+    def put(table_name, name, local_file):
+        folder = name.rpartition("/")[0]
+        stage_path = get_stage_path(table_name) + (f"{folder}/" if folder else "")
+        with metrics.record("snowflake_put", table_name[3:]) as m, snowflake_cursor() as cur:
             cur.execute(
-                f"""
-                SELECT COLUMN_NAME, TYPE 
-                FROM TABLE(
-                    INFER_SCHEMA(
-                        LOCATION=>'@{stage_name}',
-                        FILE_FORMAT=>'{file_format}'
-                    )
-                );
-            """
+                f"PUT 'file://{local_file.resolve().as_posix()}' {stage_path} AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
             )
-            columns = cur.fetchall()
-            if not columns:
-                raise Exception(
-                    "No columns found. Ensure the files exist in the stage and are readable."
+            m["bytes"] = local_file.stat().st_size
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(put, table_name, name, local_file): (table_name, file_path)
+            for table_name, file_path, name, local_file in puts
+        }
+        for future in as_completed(futures):
+            table_name, file_path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                errors.setdefault(file_path, e)
+                errors.setdefault(table_name, e)
+
+    # Step 2: One load per table
+    results = []
+    with snowflake_cursor() as cur:
+        for table_name, files in tables.items():
+            copy_results = {}
+            counts = (None, None, None)
+            current = schemas.get(table_name.upper())
+            table_mode = mode if current else "create"
+            if table_name not in errors:
+                try:
+                    with metrics.record("snowflake_copy", table_name[3:]) as m:
+                        names = [name for table, _, name, _ in puts if table == table_name]
+                        columns = get_file_columns(files[0])
+                        if table_mode == "create":
+                            _create_table(cur, table_name, columns)
+                            catalog.set_table_schema(table_name, columns)
+                            copy_results = _copy_staged_files(cur, table_name, table_name)
+                        elif _evolve_table(cur, table_name, current, columns) is None:
+                            # a column type changed beyond what ALTER TABLE can widen
+                            file_names = {column.upper() for column in columns}
+                            rebuilt = dict(columns)
+                            for column, data_type in current.items():
+                                if column.upper() not in file_names:
+                                    rebuilt[column] = data_type
+                            table_mode = "swap"
+                            copy_results = _swap_staged_files(cur, table_name, rebuilt)
+                            catalog.set_table_schema(table_name, rebuilt)
+                        else:
+                            key = None
+                            if table_mode in ("auto", "merge"):
+                                key = get_merge_key(table_name[3:], files[0])
+                            if table_mode == "auto" and key:
+                                table_mode = "merge"
+                            elif table_mode == "auto":
+                                # part files are never rewritten, new ones only hold new rows
+                                table_mode = "swap" if table_name in replaced else "append"
+                            if table_mode == "append":
+                                copy_results = _copy_staged_files(cur, table_name, table_name)
+                            elif table_mode == "swap":
+                                copy_results = _swap_staged_files(cur, table_name)
+                            elif not key:
+                                raise ValueError(f"No merge key found for {table_name}")
+                            elif names:
+                                # the uploaded files hold the whole dataset unless only
+                                # new part files were added
+                                full = len(names) == sum(len(stage_files[f]) for f in files)
+                                copy_results, counts = _merge_staged_files(
+                                    cur, table_name, names, key, list(columns), full
+                                )
+                        m["rows"] = sum(
+                            row.get("rows_loaded") or 0 for row in copy_results.values()
+                        )
+                except Exception as e:
+                    errors[table_name] = e
+                    # the table may have been changed or dropped outside of the app
+                    catalog.delete_table_schema(table_name)
+            for file_path in files:
+                rows = [
+                    copy_results[name] for name in stage_files[file_path] if name in copy_results
+                ]
+                error = errors.get(file_path, errors.get(table_name)) or next(
+                    (row["first_error"] for row in rows if row.get("first_error")), None
+                )
+                statuses = sorted({row["status"] for row in rows if "status" in row})
+                results.append(
+                    {
+                        "file_path": str(file_path),
+                        "table_name": table_name,
+                        "mode": table_mode,
+                        "status": ", ".join(statuses) or ("LOAD_FAILED" if error else "SKIPPED"),
+                        "rows_loaded": sum(row.get("rows_loaded", 0) for row in rows),
+                        "rows_inserted": counts[0],
+                        "rows_updated": counts[1],
+                        "rows_deleted": counts[2],
+                        "error": str(error) if error else None,
+                    }
                 )
+    return results
 
-            # Step 2: Generate CREATE TABLE statement dynamically
-            columns_sql = ", ".join([f'"{col[0]}" {col[1]}' for col in columns])
-            create_table_sql = (
-                f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_sql})"
+
+def _transfer_result(file_path, size: int, start: float) -> dict:
+    seconds = time.perf_counter() - start
+    return {
+        "file_path": str(file_path),
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_s": size / 2**20 / max(seconds, 1e-6),
+    }
+
+
+def upload_to_azure_storage(file_path: str, max_concurrency: int = None) -> dict:
+    """
+    Uploads a local file to the data container. Files larger than the single put size are
+    uploaded in blocks, max_concurrency blocks at a time.
+
+    A partition folder is uploaded as one blob per part file (<id>/year=YYYY/month=MM/
+    part-*.parquet). Part files are never rewritten, so only the part files missing in the
+    container are uploaded, and blobs of part files that no longer exist locally are
+    deleted. Blobs of the other layout of the dataset are deleted as well.
+
+    Returns:
+        dict: The keys "file_path", "bytes", "seconds" and "mb_per_s", where bytes is the
+            number of bytes uploaded.
+    """
+    file_path = Path(file_path)
+    max_concurrency = max_concurrency or get_azure_setting("max_concurrency")
+    container_client = get_blob_service_client().get_container_client(data_container_name)
+    with metrics.record("azure_upload", get_file_dataset(file_path.name)) as m:
+        result = _upload_dataset(container_client, file_path, max_concurrency)
+        m["bytes"] = result["bytes"]
+    return result
+
+
+def _upload_dataset(container_client, file_path: Path, max_concurrency: int) -> dict:
+    start = time.perf_counter()
+    if file_path.is_dir():
+        prefix = f"{file_path.name}/"
+        blobs = {
+            blob.name
+            for blob in container_client.list_blobs(name_starts_with=file_path.name)
+            if blob.name.startswith(prefix) or blob.name == f"{file_path.name}.parquet"
+        }
+        files = {
+            prefix + part_file.relative_to(file_path).as_posix(): part_file
+            for part_file in get_part_files(file_path)
+        }
+        uploads = {name: part_file for name, part_file in files.items() if name not in blobs}
+    else:
+        prefix = f"{file_path.stem}/"
+        blobs = {blob.name for blob in container_client.list_blobs(name_starts_with=prefix)}
+        files = uploads = {file_path.name: file_path}
+    size = 0
+    for name, local_file in uploads.items():
+        with open(local_file, "rb") as data:
+            container_client.get_blob_client(name).upload_blob(
+                data, overwrite=True, max_concurrency=max_concurrency
             )
+        size += local_file.stat().st_size
+    for name in sorted(blobs - files.keys()):
+        container_client.delete_blob(name)
+    return _transfer_result(file_path, size, start)
+
 
-            # Execute the table creation query
+def upload_files_to_azure(
+    file_paths: list,
+    workers: int = AZURE_TRANSFER_WORKERS,
+    max_concurrency: int = None,
+) -> Iterator[dict]:
+    """
+    Uploads several files to the data container in parallel and yields one result per
+    file as soon as it is uploaded. A failing upload does not stop the others.
+
+    Yields:
+        dict: The result of upload_to_azure_storage and the key "error" (None on success).
+    """
+    workers = max(1, min(workers, len(file_paths)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(upload_to_azure_storage, file_path, max_concurrency): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
             try:
-                cur.execute(create_table_sql)
-                return True
+                result = future.result()
+                result["error"] = None
             except Exception as e:
-                st.error(f"Error creating table: {e}")
-                return False
-        return True
+                result = {"file_path": str(futures[future]), "bytes": 0, "seconds": 0.0}
+                result.update({"mb_per_s": 0.0, "error": e})
+            yield result
 
-    def get_snowflake_table_name():
-        match = re.search(r"(\d+)", file_path)
-        number_part = match.group(1) if match else None
-        return f"DS_{number_part}"
 
-    stage_name = "OGD_STAGE"  # Internal Snl file and Snowflake destinationowflake stage
-    table_name = get_snowflake_table_name()
-    cur = get_cursor()
+def download_from_azure_storage(blob: str, file_path: str, max_concurrency: int = None) -> dict:
+    """
+    Downloads a blob of the data container to a local file, max_concurrency chunks at a
+    time.
+
+    Returns:
+        dict: The keys "file_path", "bytes", "seconds" and "mb_per_s".
+    """
+    max_concurrency = max_concurrency or get_azure_setting("max_concurrency")
+    blob_client = get_blob_service_client().get_blob_client(
+        container=data_container_name, blob=blob
+    )
+    start = time.perf_counter()
+    with metrics.record("azure_download", get_file_dataset(blob)) as m:
+        with open(file_path, "wb") as data:
+            size = blob_client.download_blob(max_concurrency=max_concurrency).readinto(data)
+        m["bytes"] = size
+    return _transfer_result(file_path, size, start)
+
+
+def get_local_connection(tables: dict = None) -> "duckdb.DuckDBPyConnection":
+    """
+    Returns an in-memory DuckDB connection with one view per local dataset, named
+    like the Snowflake tables (DS_<dataset_identifier>). The views read the parquet files
+    directly, so DuckDB pushes filters and column selections down into the parquet scan
+    and only reads the row groups and columns a query needs.
+
+    Args:
+        tables (dict): Arrow tables by table name, e.g. from the shared dataset cache,
+            registered instead of the parquet views. DuckDB scans them without a copy.
+    """
+    with startup_step("import duckdb"):
+        import duckdb
+
+    tables = tables or {}
+    conn = duckdb.connect()
+    for table_name, table in tables.items():
+        conn.register(table_name, table)
+    for file in get_local_files()["file_name"]:
+        table_name = get_snowflake_table_name(file.name)
+        if table_name in tables:
+            continue
+        path = file.resolve().as_posix().replace("'", "''")
+        if file.is_dir():
+            # the year and month of the partitions are added as columns; filters on them
+            # skip the part files of all other months
+            source = (
+                f"read_parquet('{path}/year=*/month=*/*.parquet', hive_partitioning = true, "
+                "hive_types = {'year': BIGINT, 'month': BIGINT})"
+            )
+        else:
+            source = f"read_parquet('{path}')"
+        conn.execute(f"CREATE VIEW {table_name} AS SELECT * FROM {source}")
+    return conn
 
-    try:
-        # Step 1: Upload file to Snowflake stage
-        cur.execute(f"REMOVE @{stage_name};")
-        cur.execute(f"PUT file://{file_path} @{stage_name} AUTO_COMPRESS=TRUE")
-        ok = check_if_table_exists()
-        cur.execute(
-            f"""
-            COPY INTO {table_name}
-            FROM @{stage_name}
-            FILE_FORMAT = (TYPE = PARQUET)
-            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE;
-        """
-        )
 
+def iter_local_query(
+    query: str, batch_rows: int = LOCAL_QUERY_BATCH_ROWS, tables: dict = None
+) -> Iterator[pa.RecordBatch]:
+    """
+    Executes a SQL query on the local parquet files and yields the result as arrow record
+    batches, so results larger than the memory can be processed. tables are passed to
+    get_local_connection.
+    """
+    conn = get_local_connection(tables)
+    try:
+        yield from conn.execute(query).to_arrow_reader(batch_rows)
     finally:
-        cur.close()
+        conn.close()
 
 
-def upload_to_azure_storage(file_path: str):
-    file_path = Path(file_path)
-    blob_client = blob_service_client.get_blob_client(
-        container=data_container_name, blob=file_path.name
-    )
-    with open(file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True)
+def run_local_query(query: str, max_rows: int = QUERY_PAGE_ROWS, tables: dict = None) -> pa.Table:
+    """
+    Executes a SQL query on the local parquet files and returns at most max_rows rows of
+    the result. Only the batches needed for these rows are computed.
+
+    Args:
+        query (str): The SQL query, referencing datasets as DS_<dataset_identifier>.
+        max_rows (int): Maximum number of rows returned.
+        tables (dict): Arrow tables by table name queried instead of the parquet files,
+            see get_local_connection.
+
+    Returns:
+        pa.Table: The first max_rows rows of the result.
+    """
+    conn = get_local_connection(tables)
+    try:
+        with metrics.record("local_query", get_query_dataset(query)) as m:
+            reader = conn.execute(query).to_arrow_reader(min(max_rows, LOCAL_QUERY_BATCH_ROWS))
+            batches = []
+            rows = 0
+            for batch in reader:
+                batches.append(batch.slice(0, max_rows - rows))
+                rows += batches[-1].num_rows
+                if rows >= max_rows:
+                    break
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+            m["rows"], m["bytes"] = table.num_rows, table.nbytes
+            return table
+    finally:
+        conn.close()
 
 
 def get_local_files() -> pd.DataFrame:
     """
-    Get all local parquet files in the data folder
+    Get all local parquet files and partition folders in the data folder. The listing is
+    cached until a file or folder is added, renamed or removed in the data folder.
+
+    Returns:
+        pd.DataFrame: The columns "file_name" (Path), "file_path" (str) and "identifier".
+            The frame is shared and must not be modified.
     """
-    file_list = list(data_folder.glob("*.parquet"))  # Get all files
-    df_files = pd.DataFrame(file_list, columns=["file_name"])
+    try:
+        mtime = data_folder.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    return _list_local_files(str(data_folder), mtime)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _list_local_files(folder: str, mtime: int) -> pd.DataFrame:
+    folder = Path(folder)
+    file_list = sorted(folder.glob("*.parquet")) + sorted(
+        path for path in folder.glob("*") if path.is_dir() and path.name.isdigit()
+    )
+    df_files = pd.DataFrame({"file_name": pd.Series(file_list, dtype=object)})
+    df_files["file_path"] = [str(path) for path in file_list]
+    df_files["identifier"] = [get_file_dataset(path.name) for path in file_list]
     return df_files
 
 
-def get_remote_files(container: str) -> pd.DataFrame:
+def get_remote_partitions(prefix: str) -> dict:
     """
-    Get all remote parquet files in the data folder
+    Lists the part files of a partitioned dataset in the data container.
+
+    Args:
+        prefix (str): The prefix of the dataset, e.g. "100233/".
+
+    Returns:
+        dict: The blob names of the part files by partition (year=YYYY/month=MM), sorted
+            by partition.
     """
-    file_list = []
-    for blob in blob_service_client.get_container_client(container).list_blobs():
-        file_list.append(blob.name)
-    df_files = pd.DataFrame(file_list, columns=["file_name"])
-    return df_files
+    container_client = get_blob_service_client().get_container_client(data_container_name)
+    partitions = {}
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        if blob.name.endswith(".parquet"):
+            partition = blob.name[len(prefix) :].rpartition("/")[0]
+            partitions.setdefault(partition, []).append(blob.name)
+    return dict(sorted(partitions.items()))
 
 
 def select_files(
@@ -249,62 +2199,320 @@ def select_files(
     return selected_rows
 
 
-def load_remote_data(file: str) -> pd.DataFrame:
+class BlobFile(io.RawIOBase):
+    """
+    A read-only, seekable file object over a blob. Every read fetches only the requested
+    byte range, so pyarrow can read the parquet footer and selected column chunks of a
+    remote file without downloading all of it.
+    """
+
+    def __init__(self, blob_client, size: int = None):
+        self.blob_client = blob_client
+        self.size = size if size is not None else blob_client.get_blob_properties().size
+        self.position = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = self.blob_client.download_blob(offset=self.position, length=length).readall()
+        buffer[: len(data)] = data
+        self.position += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def get_remote_parquet_file(file: str) -> pq.ParquetFile:
     """
-    Load parquet file from Azure Storage
+    Opens a parquet blob of the data container. Only the footer is downloaded, which
+    holds the schema, the number of rows and the row groups.
     """
-    blob_client = blob_service_client.get_blob_client(
+    blob_client = get_blob_service_client().get_blob_client(
         container=data_container_name, blob=file
     )
-    with st.spinner(f"Downloading {file}..."):
-        with open(file, "wb") as data:
-            blob_client.download_blob().readinto(data)
-    df = pd.read_parquet(file)
-    return df
+    return pq.ParquetFile(BlobFile(blob_client), pre_buffer=True)
+
+
+def _read_remote_partitions(prefix: str, columns: list = None, partitions: list = None) -> pa.Table:
+    """
+    Reads the part files of the given partitions of a partitioned dataset in parallel and
+    adds the year and month of the partitions as columns, like the local DuckDB views.
+    """
+    part_files = get_remote_partitions(prefix)
+    if partitions is not None:
+        part_files = {partition: part_files[partition] for partition in partitions}
+
+    def read(partition, blob):
+        table = read_remote_table(blob, columns)
+        for key, value in (item.split("=") for item in partition.split("/")):
+            table = table.append_column(key, pa.array(np.full(table.num_rows, int(value))))
+        return table
+
+    with ThreadPoolExecutor(max_workers=AZURE_TRANSFER_WORKERS) as executor:
+        tables = list(
+            executor.map(
+                lambda item: read(*item),
+                [(partition, blob) for partition, blobs in part_files.items() for blob in blobs],
+            )
+        )
+    return pa.concat_tables(tables) if tables else pa.table({})
+
+
+def read_remote_table(
+    file: str, columns: list = None, row_groups: list = None, partitions: list = None
+) -> pa.Table:
+    """
+    Reads a parquet blob from Azure Storage into an arrow table without writing it to the
+    local disk. If columns or row groups are given, only their byte ranges are downloaded;
+    otherwise the whole blob is downloaded in parallel chunks.
+
+    Args:
+        file (str): Name of the blob in the data container, or the prefix of a
+            partitioned dataset (<id>/).
+        columns (list): Columns to read, all columns if None.
+        row_groups (list): Indices of the row groups to read, all row groups if None.
+            Not supported for partitioned datasets.
+        partitions (list): Partitions (year=YYYY/month=MM) of a partitioned dataset to
+            read, all partitions if None. The part files of other partitions are not
+            downloaded.
+
+    Returns:
+        pa.Table: The data read.
+    """
+    if file.endswith("/"):
+        return _read_remote_partitions(file, columns, partitions)
+    if columns is None and row_groups is None:
+        blob_client = get_blob_service_client().get_blob_client(
+            container=data_container_name, blob=file
+        )
+        data = blob_client.download_blob(
+            max_concurrency=get_azure_setting("max_concurrency")
+        ).readall()
+        return pq.read_table(pa.BufferReader(data))
+    parquet_file = get_remote_parquet_file(file)
+    if row_groups is None:
+        return parquet_file.read(columns=columns)
+    return parquet_file.read_row_groups(row_groups, columns=columns)
+
+
+class ParquetPreview:
+    """
+    Pages through the rows of parquet files without reading them completely. The number
+    of rows and the row groups are taken from the parquet footers; a page reads only the
+    row groups it overlaps, and of them only the selected columns.
+
+    Local files are given as paths and opened for each page with their footer, so no file
+    stays open between reads. Remote files are given as opened pq.ParquetFile objects.
+    """
+
+    def __init__(self, files: list):
+        self.files = files
+        self.metadata = [
+            file.metadata if isinstance(file, pq.ParquetFile) else pq.read_metadata(file)
+            for file in files
+        ]
+        self.schema = self.metadata[0].schema.to_arrow_schema() if files else pa.schema([])
+        self.row_groups = []  # (file index, row group index) in row order
+        self.offsets = [0]  # first row of every row group, followed by the number of rows
+        for i, metadata in enumerate(self.metadata):
+            for j in range(metadata.num_row_groups):
+                self.row_groups.append((i, j))
+                self.offsets.append(self.offsets[-1] + metadata.row_group(j).num_rows)
+        # remote files are file objects with a position, shared by all sessions
+        self.lock = threading.Lock()
+
+    @property
+    def num_rows(self) -> int:
+        return self.offsets[-1]
+
+    def get_page_count(self, page_rows: int = PREVIEW_PAGE_ROWS) -> int:
+        return max(1, -(-self.num_rows // page_rows))
+
+    def read_page(
+        self, page: int, page_rows: int = PREVIEW_PAGE_ROWS, columns: list = None
+    ) -> pa.Table:
+        """
+        Reads a page of rows.
+
+        Args:
+            page (int): Index of the page, starting with 0.
+            page_rows (int): Rows per page.
+            columns (list): Columns to read, all columns if None.
+
+        Returns:
+            pa.Table: The rows page * page_rows to (page + 1) * page_rows, fewer on the
+                last page and none after it.
+        """
+        start = page * page_rows
+        end = min(start + page_rows, self.num_rows)
+        if start >= end:
+            table = self.schema.empty_table()
+            return table.select(columns) if columns is not None else table
+        first = bisect_right(self.offsets, start) - 1
+        last = bisect_left(self.offsets, end)
+        tables = []
+        with metrics.record("parquet_preview") as m, self.lock:
+            for i, j in self.row_groups[first:last]:
+                file = self.files[i]
+                if not isinstance(file, pq.ParquetFile):
+                    file = pq.ParquetFile(file, metadata=self.metadata[i])
+                tables.append(file.read_row_group(j, columns=columns))
+            table = pa.concat_tables(tables, promote_options="default")
+            m["rows"], m["bytes"] = end - start, table.nbytes
+        return table.slice(start - self.offsets[first], end - start)
+
+
+class TablePreview:
+    """
+    Pages through an arrow table that is already in memory, e.g. a dataset from the shared
+    dataset cache, with the interface of ParquetPreview.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.schema = table.schema
+        self.num_rows = table.num_rows
+
+    def get_page_count(self, page_rows: int = PREVIEW_PAGE_ROWS) -> int:
+        return max(1, -(-self.num_rows // page_rows))
+
+    def read_page(
+        self, page: int, page_rows: int = PREVIEW_PAGE_ROWS, columns: list = None
+    ) -> pa.Table:
+        table = self.table.slice(page * page_rows, page_rows)
+        return table.select(columns) if columns is not None else table
+
+
+@st.cache_resource(max_entries=PREVIEW_CACHE_ENTRIES)
+def _open_preview(files: tuple, remote: bool, signature) -> ParquetPreview:
+    if not remote:
+        return ParquetPreview(list(files))
+    with ThreadPoolExecutor(max_workers=AZURE_TRANSFER_WORKERS) as executor:
+        return ParquetPreview(list(executor.map(get_remote_parquet_file, files)))
+
+
+def get_local_preview(path: Path) -> ParquetPreview:
+    """
+    Returns a preview of a local parquet file or partition folder, shared by all sessions
+    until one of its files changes.
+    """
+    files = get_part_files(path)
+    signature = tuple((file.stat().st_mtime_ns, file.stat().st_size) for file in files)
+    return _open_preview(tuple(map(str, files)), False, signature)
+
+
+def get_remote_preview(blobs: list, last_modified) -> ParquetPreview:
+    """
+    Returns a preview of parquet blobs, e.g. the part files of some partitions, shared by
+    all sessions. Only the footers of the blobs are downloaded, in parallel.
+
+    Args:
+        blobs (list): Names of the blobs in the data container.
+        last_modified: Time of the last change of the blobs from the listing, so blobs
+            uploaded again are opened again.
+    """
+    return _open_preview(tuple(blobs), True, str(last_modified))
 
 
 def extend_columns(
     files_df: pd.DataFrame, identifier: str, columns: list
 ) -> pd.DataFrame:
-    files_df["identifier"] = files_df["identifier"].astype(str)
-    ods_metadata["dataset_identifier"] = ods_metadata["dataset_identifier"].astype(str)
-    df = files_df.merge(
-        ods_metadata, left_on=identifier, right_on="dataset_identifier", how="left"
-    )
-    all_columns = files_df.columns.tolist() + [
-        col for col in columns if col in df.columns
-    ]
+    """
+    Returns files_df with ODS catalog columns of the dataset in its identifier column.
+    Neither files_df nor the catalog are modified.
+    """
+    view = get_metadata_view()
+    columns = [col for col in columns if col in view.columns]
+    df = view[columns].reindex(files_df[identifier].astype(str))
+    df.index = files_df.index
+    return pd.concat([files_df, df], axis=1)
+
+
+def get_catalog_versions() -> tuple:
+    """
+    Returns the versions of the ODS catalog and of the local catalog, which the views
+    derived from both are cached by.
+    """
+    get_ods_metadata()  # loaded on first use, which increments its version
+    return metadata_version, catalog.get_version()
+
+
+def get_metadata_view() -> pd.DataFrame:
+    """
+    Returns the ODS catalog indexed by dataset_identifier, for lookups with .loc instead
+    of scanning the catalog. The view is computed once per catalog version and shared by
+    all sessions, so it must not be modified.
+    """
+    get_ods_metadata()
+    return _get_metadata_view(metadata_version)
 
-    return df[all_columns]
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _get_metadata_view(version: int) -> pd.DataFrame:
+    # the catalog may be newer than version, never older
+    df = ods_metadata.drop_duplicates("dataset_identifier")
+    df = df.set_index(df["dataset_identifier"].astype(str).to_numpy())
+    return df.drop(columns="dataset_identifier")
 
 
 def get_merged_datasets() -> pd.DataFrame:
+    """
+    Returns the ODS catalog joined with the local catalog. The columns found in both have
+    the suffixes "_ods" and "_local"; the index is the dataset identifier. The view is
+    computed once per version of the two catalogs and shared by all sessions, so it must
+    not be modified.
+    """
+    return _get_merged_datasets(*get_catalog_versions())
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _get_merged_datasets(metadata_version: int, catalog_version: int) -> pd.DataFrame:
     remote_fields = [
-        "dataset_identifier",
         "title",
         "modified",
+        "data_processed",
         "size_of_records_in_the_dataset_in_bytes",
         "number_of_records",
     ]
-    local_fields = ["dataset_identifier", "modified", "number_of_records"]
-    df = ods_metadata[remote_fields].merge(
-        get_local_metadata()[local_fields], on="dataset_identifier", how="left"
+    local_fields = ["dataset_identifier", "modified", "data_processed", "number_of_records"]
+    df = (
+        get_metadata_view()[remote_fields]
+        .rename_axis("dataset_identifier")
+        .reset_index()
+        .merge(get_local_metadata()[local_fields], on="dataset_identifier", how="left")
     )
     # Rename columns by replacing postfix "_x" with "_ods" and "_y" with "_local"
     df.rename(
         columns=lambda col: col.replace("_x", "_ods").replace("_y", "_local"),
         inplace=True,
     )
-
+    df.index = pd.Index(df["dataset_identifier"].to_numpy())
     return df
 
 
-def get_local_metadata():
-    local_metadata = load_config()
-    df = pd.DataFrame.from_dict(local_metadata, orient="index")
-    df["dataset_identifier"] = df["dataset_identifier"].astype(str)
-    return df
+def get_local_metadata() -> pd.DataFrame:
+    """
+    Returns the entries of the local catalog, one row per downloaded dataset.
+    """
+    return catalog.get_datasets()
 
 
-ods_metadata = get_ods_table(metadata)
-local_metadata_df = get_local_metadata()
+startup_timings["import ods"] = time.perf_counter() - _import_start
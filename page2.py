@@ -1,12 +1,11 @@
 import streamlit as st
 import ods
+import search
 from texts import txt
 import time
 
 from utils import show_header, show_records
 
-MAX_DOWNLOAD_SIZE = 1000000
-
 column_configuration = {
     "dataset_identifier": st.column_config.TextColumn(
         "Identifier", help="Unique identifier for dataset", max_chars=100, width="small"
@@ -43,11 +42,26 @@ column_configuration = {
     ),
 }
 filter = st.sidebar.text_input("Search", "")
+memory_budget = st.sidebar.number_input(
+    "Memory budget (MB)",
+    min_value=8,
+    value=ods.DOWNLOAD_MEMORY_BUDGET // 2**20,
+    help="Maximum memory used by all downloads together. Datasets are streamed to the parquet file in chunks that fit into this budget.",
+)
+workers = st.sidebar.number_input(
+    "Parallel downloads",
+    min_value=1,
+    max_value=16,
+    value=ods.DOWNLOAD_WORKERS,
+    help="Number of datasets downloaded at the same time.",
+)
 merged_datasets_df = ods.get_merged_datasets()
 if filter:
+    # ranked search over title, description, keywords, themes and publisher
+    ranks = {ds_id: rank for rank, (ds_id, _) in enumerate(search.search_datasets(filter))}
     merged_datasets_df = merged_datasets_df[
-        merged_datasets_df["title"].str.contains(filter, case=False)
-    ]
+        merged_datasets_df["dataset_identifier"].isin(ranks)
+    ].sort_values("dataset_identifier", key=lambda ids: ids.map(ranks))
 show_header(
     title=txt["title_page2"],
     help_text=txt["info_page2"],
@@ -56,36 +70,68 @@ show_records('{} ODS records', len(merged_datasets_df))
 selected_row = ods.select_files(
     merged_datasets_df, column_configuration=column_configuration, multi_row=True
 )
-log = ods.load_config()
 if len(selected_row["selection"]["rows"]) == 1:
-    row = ods.ods_metadata.iloc[selected_row["selection"]["rows"][0]]
+    row = merged_datasets_df.iloc[selected_row["selection"]["rows"][0]]
     with st.expander("Show Metadata"):
-        st.write(row.to_dict())
+        st.write(ods.get_dataset_metadata(row["dataset_identifier"]))
+
+
+
+def download(datasets: list, incremental: bool):
+    progress = st.progress(0.0, text="Downloading data...")
+    failures = []
+    coerced = []
+    for i, result in enumerate(
+        ods.download_datasets(
+            datasets,
+            memory_budget=memory_budget * 2**20,
+            workers=workers,
+            incremental=incremental,
+        ),
+        start=1,
+    ):
+        ds = result["ds"]
+        if result["error"] is None:
+            ods.register_download(ds, result["rows"], result["content_hash"])
+            throughput = result["bytes"] / 2**20 / max(result["seconds"], 1e-6)
+            text = f"{i}/{len(datasets)}: {ds['title']} ({result['rows']} records, {result['seconds']:.1f}s, {throughput:.2f} MB/s)"
+            if result["coerced"]:
+                coerced.append(result)
+        else:
+            failures.append(result)
+            text = f"{i}/{len(datasets)}: {ds['title']} failed"
+        progress.progress(i / len(datasets), text=text)
+    if len(datasets) > len(failures):
+        st.success(f"{len(datasets) - len(failures)} tables downloaded successfully and stored as parquet files!")
+    for result in failures:
+        st.error(f"{result['ds']['dataset_identifier']} {result['ds']['title']}: {result['error']}")
+    for result in coerced:
+        columns = ", ".join(f"{column} ({values} values)" for column, values in result["coerced"].items())
+        st.warning(f"{result['ds']['dataset_identifier']} {result['ds']['title']}: values that do not fit the column type were stored as text in {columns}")
+    if not failures and not coerced:
+        time.sleep(5)
+        st.rerun()
+
+
+stale_datasets_df = ods.get_stale_datasets()
+if len(stale_datasets_df) > 0 and st.sidebar.button(
+    f"Sync {len(stale_datasets_df)} stale datasets",
+    help="Downloads all local datasets that changed on ODS. Time series datasets are updated by appending the new records only.",
+):
+    download(
+        [
+            ods.get_dataset_metadata(identifier)
+            for identifier in stale_datasets_df["dataset_identifier"]
+        ],
+        incremental=True,
+    )
 
 if selected_row["selection"]["rows"]:
     if st.button(f"Download {len(selected_row['selection']['rows'])} files"):
-        number_successful = 0
-        for row in selected_row["selection"]["rows"]:
-            ds = ods.ods_metadata.iloc[row].to_dict()
-            ds["modified_local"] = merged_datasets_df.iloc[row]["modified_ods"]
-            ds["number_of_records_local"] = int(
-                merged_datasets_df.iloc[row]["number_of_records_ods"]
-            )
-            with st.spinner("Downloading data...", show_time=True):
-                size = ds["size_of_records_in_the_dataset_in_bytes"]
-                if size < MAX_DOWNLOAD_SIZE:
-                    data = ods.get_ods_table(ds["dataset_identifier"])
-                    filename = ods.data_folder / f"{ds['dataset_identifier']}.parquet"
-                    data.to_parquet(filename)
-                    log.setdefault(ds["dataset_identifier"], ds)
-                    ods.save_config(log)
-                    ods.local_metadata = ods.load_config()
-                    number_successful += 1
-                else:
-                    st.warning(
-                        f"File size is {size} bytes. Downloading files larger than {MAX_DOWNLOAD_SIZE} bytes is not supported in this version. if you wish to synchronize larger ODS files, install the app on a system with suffienct RAM and diskspace."
-                    )
-        if number_successful > 0:
-            st.success(f"{number_successful} tables downloaded successfully and stored as parquet files!")
-            time.sleep(5)
-        st.rerun()
+        download(
+            [
+                ods.get_dataset_metadata(merged_datasets_df.iloc[row]["dataset_identifier"])
+                for row in selected_row["selection"]["rows"]
+            ],
+            incremental=False,
+        )
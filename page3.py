@@ -1,6 +1,7 @@
 import streamlit as st
-import pandas as pd
 import ods
+import catalog
+import inventory
 from utils import show_header, show_records
 from texts import txt
 
@@ -21,16 +22,32 @@ column_configuration = {
         max_chars=100,
         width="medium",
     ),
+    "azure_status": st.column_config.TextColumn(
+        "Azure",
+        help="missing, behind (older than the local file or the ODS dataset) or current",
+        width="small",
+    ),
+    "azure_changed_at": st.column_config.DatetimeColumn(
+        "Uploaded to Azure", help="Last modification of the blobs in Azure", width="medium"
+    ),
 }
 
 
-file_list = list(ods.data_folder.glob("*.parquet"))  # Get all files
-files_df = pd.DataFrame(file_list, columns=["file_path"])
-files_df["file_path"] = files_df["file_path"].astype(str)
-files_df["identifier"] = files_df["file_path"].str.extract(r"(\d+)")
-files_df = ods.extend_columns(
-    files_df, identifier="identifier", columns=["title", "modified"]
+files_df = ods.extend_columns(  # files and partition folders
+    ods.get_local_files(), identifier="identifier", columns=["title", "modified"]
 )
+azure_inventory = inventory.get_inventory()
+if st.sidebar.button("Refresh Azure listing"):
+    azure_inventory.get_listing("azure", refresh=True)
+try:
+    status_df = azure_inventory.get_status(("azure",))
+    files_df = files_df.join(status_df[["azure_status", "azure_changed_at"]], on="identifier")
+    pending_df = azure_inventory.get_pending_uploads("azure")
+except Exception as e:
+    st.error(f"Azure Storage could not be listed: {e}")
+    files_df["azure_status"] = None
+    files_df["azure_changed_at"] = None
+    pending_df = files_df.iloc[:0]
 
 show_header(
     title=txt["title_page3"],
@@ -46,11 +63,51 @@ selected_rows = st.dataframe(
     selection_mode="multi-row",
 )
 # st.write(selected_rows)
-if st.button("Upload Files to Azure Storage"):
+workers = st.sidebar.number_input(
+    "Parallel uploads",
+    min_value=1,
+    max_value=16,
+    value=ods.AZURE_TRANSFER_WORKERS,
+    help="Number of files uploaded at the same time.",
+)
+max_concurrency = st.sidebar.number_input(
+    "Connections per file",
+    min_value=1,
+    max_value=32,
+    value=ods.get_azure_setting("max_concurrency"),
+    help="Number of blocks of a large file uploaded at the same time.",
+)
+
+
+def upload(identifiers: dict):
+    progress = st.progress(0.0, text="Uploading files...")
     index = 0
-    for item in selected_rows["selection"]["rows"]:
-        file_path = files_df.iloc[item]["file_path"]
-        with st.spinner(f"Uploading {file_path}..."):
-            ods.upload_to_azure_storage(file_path)
-        index += 1
+    failures = []
+    for i, result in enumerate(
+        ods.upload_files_to_azure(
+            list(identifiers), workers=workers, max_concurrency=max_concurrency
+        ),
+        start=1,
+    ):
+        if result["error"] is None:
+            catalog.mark_synced(identifiers[result["file_path"]], "azure")
+            index += 1
+            text = f"{i}/{len(identifiers)}: {result['file_path']} ({result['bytes'] / 2**20:.1f} MB, {result['mb_per_s']:.2f} MB/s)"
+        else:
+            failures.append(result)
+            text = f"{i}/{len(identifiers)}: {result['file_path']} failed"
+        progress.progress(i / len(identifiers), text=text)
+    azure_inventory.refresh("azure", list(identifiers.values()))
     st.success(f"{index} files uploaded to Azure Storage!")
+    for result in failures:
+        st.error(f"{result['file_path']}: {result['error']}")
+
+
+if len(pending_df) > 0 and st.sidebar.button(
+    f"Upload {len(pending_df)} stale files",
+    help="Uploads the local files that are missing in Azure or newer than their copy there.",
+):
+    upload(dict(zip(pending_df["local_file"], pending_df.index)))
+if st.button("Upload Files to Azure Storage"):
+    selected_df = files_df.iloc[selected_rows["selection"]["rows"]]
+    upload(dict(zip(selected_df["file_path"], selected_df["identifier"])))
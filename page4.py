@@ -2,6 +2,8 @@ import streamlit as st
 
 import pandas as pd
 import ods
+import catalog
+import inventory
 from texts import txt
 from utils import show_header,show_records
 
@@ -21,16 +23,35 @@ column_configuration = {
         max_chars=100,
         width="medium",
     ),
+    "snowflake_status": st.column_config.TextColumn(
+        "Snowflake",
+        help="missing, behind (older than the local file or the ODS dataset) or current",
+        width="small",
+    ),
+    "snowflake_rows": st.column_config.NumberColumn(
+        "Rows (Snowflake)", help="Number of rows in the Snowflake table", width="small"
+    ),
+    "snowflake_changed_at": st.column_config.DatetimeColumn(
+        "Loaded into Snowflake", help="Last change of the Snowflake table", width="medium"
+    ),
 }
 
 filter = st.sidebar.text_input("Search", "")
-file_list = list(ods.data_folder.glob("*.parquet"))  # Get all files
-files_df = pd.DataFrame(file_list, columns=["file_path"])
-files_df["file_path"] = files_df["file_path"].astype(str)
-files_df["identifier"] = files_df["file_path"].str.extract(r"(\d+)")
-files_df = ods.extend_columns(
-    files_df, identifier="identifier", columns=["title", "modified"]
+files_df = ods.extend_columns(  # files and partition folders
+    ods.get_local_files(), identifier="identifier", columns=["title", "modified"]
 )
+snowflake_inventory = inventory.get_inventory()
+if st.sidebar.button("Refresh Snowflake listing"):
+    snowflake_inventory.get_listing("snowflake", refresh=True)
+status_columns = ["snowflake_status", "snowflake_rows", "snowflake_changed_at"]
+try:
+    status_df = snowflake_inventory.get_status(("snowflake",))
+    files_df = files_df.join(status_df[status_columns], on="identifier")
+    pending_df = snowflake_inventory.get_pending_uploads("snowflake")
+except Exception as e:
+    st.error(f"Snowflake tables could not be listed: {e}")
+    files_df[status_columns] = None
+    pending_df = files_df.iloc[:0]
 
 show_header(
     title=txt["title_page4"],
@@ -46,11 +67,34 @@ selected_rows = st.dataframe(
     selection_mode="multi-row",
 )
 # st.write(selected_rows)
-if st.button("Upload Files to Snowflake"):
-    index = 0
-    for item in selected_rows["selection"]["rows"]:
-        file_path = files_df.iloc[item]["file_path"]
-        with st.spinner(f"Uploading {file_path}..."):
-            ods.upload_to_snowflake_storage(file_path)
-        index += 1
+
+
+load_mode = st.sidebar.selectbox(
+    "Load mode",
+    ods.SNOWFLAKE_LOAD_MODES,
+    help="How existing tables are updated. merge: upsert the rows on the dataset key, updating changed rows only. swap: replace the whole table in one step. append: add the rows of new files, e.g. new partitions. auto: merge if the dataset has a key, otherwise append new partitions or swap.",
+)
+
+
+def upload(identifiers: dict):
+    with st.spinner(f"Uploading {len(identifiers)} files...", show_time=True):
+        results = ods.load_files_to_snowflake(list(identifiers), mode=load_mode)
+    for result in results:
+        if result["error"] is None:
+            catalog.mark_synced(identifiers[result["file_path"]], "snowflake")
+    snowflake_inventory.refresh("snowflake", list(identifiers.values()))
+    index = len([result for result in results if result["error"] is None])
     st.success(f"{index} files uploaded to Snowflake Storage!")
+    if index < len(results):
+        st.error(f"{len(results) - index} files could not be loaded.")
+    st.dataframe(pd.DataFrame(results), hide_index=True)
+
+
+if len(pending_df) > 0 and st.sidebar.button(
+    f"Upload {len(pending_df)} stale files",
+    help="Loads the local files whose table is missing in Snowflake or older than the file.",
+):
+    upload(dict(zip(pending_df["local_file"], pending_df.index)))
+if st.button("Upload Files to Snowflake"):
+    selected_df = files_df.iloc[selected_rows["selection"]["rows"]]
+    upload(dict(zip(selected_df["file_path"], selected_df["identifier"])))
@@ -1,15 +1,26 @@
 import streamlit as st
 import ods
+import inventory
+import dataset_cache
 from texts import txt
-from utils import show_header, show_records
+from utils import show_header, show_preview, show_records
 
 column_configuration = {
     "file_name": st.column_config.TextColumn(
         "Filename", help="parquet file name", max_chars=100, width="medium"
     ),
+    "bytes": st.column_config.NumberColumn(
+        "Size Bytes", help="Size of the blob or of all part files", width="small"
+    ),
+    "last_modified": st.column_config.DatetimeColumn(
+        "Modified", help="Last modification of the blobs in Azure", width="medium"
+    ),
 }
 
-df_files = ods.get_remote_files(ods.data_container_name)
+if st.sidebar.button("Refresh listing"):
+    inventory.get_inventory().get_listing("azure", refresh=True)
+df_files = inventory.get_inventory().get_listing_frame("azure")
+df_files = df_files.rename(columns={"name": "file_name"})
 show_header(
     title=txt["title_page4"],
     help_text=txt["info_page4"],
@@ -20,12 +31,45 @@ selected_rows = ods.select_files(
 )
 if selected_rows["selection"]["rows"]:
     rowid = selected_rows["selection"]["rows"][0]
-    identifier = df_files.iloc[rowid]["file_name"].split(".")[0]
-    ds = ods.ods_metadata[ods.ods_metadata["dataset_identifier"] == identifier].iloc[0]
+    identifier = df_files.iloc[rowid]["file_name"].split(".")[0].rstrip("/")
+    ds = ods.get_dataset_metadata(identifier)
     st.markdown(f"**Selected file:** {ds['title']}")
     with st.expander("Metadata", expanded=False):
         st.write(ds)
-    if st.button("Show Data", disabled=not (selected_rows["selection"]["rows"])):
-        file = df_files.iloc[rowid][0]
-        df = ods.load_remote_data(file)
-        st.write(df)
+    file = df_files.iloc[rowid]["file_name"]
+    partitions = None
+    last_modified = df_files.iloc[rowid]["last_modified"]
+    if file.endswith("/"):
+        # partitioned dataset: only the part files of the selected months are read
+        part_files = ods.get_remote_partitions(file)
+        partitions = st.multiselect(
+            "Partitions", list(part_files), default=list(part_files)[-1:]
+        )
+        if not partitions:
+            st.stop()
+        blobs = [blob for partition in partitions for blob in part_files[partition]]
+        st.markdown(f"{len(blobs)} part files in {len(partitions)} partitions")
+    else:
+        blobs = [file]
+    preview = ods.get_remote_preview(blobs, last_modified)
+    loaded_key = f"loaded_{file}_{partitions}"
+    if st.button(
+        "Load whole dataset",
+        help="Download the dataset once into memory shared by all users, so paging needs no more downloads.",
+    ):
+        st.session_state[loaded_key] = True
+    if st.session_state.get(loaded_key):
+        with st.spinner(f"Downloading {file}..."):
+            table = dataset_cache.get_dataset_cache().get_remote_table(
+                file, last_modified, partitions
+            )
+        if table is None:
+            st.warning("The dataset is too large to be loaded, it is previewed page by page.")
+        else:
+            preview = ods.TablePreview(table)
+    columns = st.multiselect("Columns", preview.schema.names, default=preview.schema.names)
+    page_rows = st.sidebar.number_input(
+        "Rows per page", min_value=100, max_value=10000, value=ods.PREVIEW_PAGE_ROWS, step=100
+    )
+    with st.spinner(f"Downloading {file}..."):
+        show_preview(preview, f"preview_{file}_{partitions}", columns, page_rows)
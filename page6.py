@@ -1,5 +1,7 @@
 import streamlit as st
 import ods
+import inventory
+import query_cache
 from texts import txt
 from utils import show_header, show_records
 
@@ -10,9 +12,27 @@ column_configuration = {
     "dataset_identifier": st.column_config.TextColumn(
         "Key", help="ODS Identifier", max_chars=100, width="medium"
     ),
+    "rows": st.column_config.NumberColumn("Rows", help="Rows in the table", width="small"),
+    "bytes": st.column_config.NumberColumn(
+        "Size Bytes", help="Bytes scanned by a full scan of the table", width="small"
+    ),
+    "last_altered": st.column_config.DatetimeColumn(
+        "Last altered", help="Last change of the table", width="medium"
+    ),
 }
 
-df_files = ods.get_snowflake_tables()
+stats = query_cache.get_query_cache().get_stats()
+with st.sidebar.expander("Query cache", expanded=False):
+    st.markdown(
+        f"{stats['hits']} hits, {stats['misses']} misses  \n"
+        f"{stats['bytes_saved'] / 1024 ** 2:.1f} MB served from the cache  \n"
+        f"{stats['entries']} results in memory ({stats['bytes'] / 1024 ** 2:.1f} MB), "
+        f"{stats['spilled']} on disk ({stats['disk_bytes'] / 1024 ** 2:.1f} MB)"
+    )
+
+if st.sidebar.button("Refresh listing"):
+    inventory.get_inventory().get_listing("snowflake", refresh=True)
+df_files = inventory.get_inventory().get_listing_frame("snowflake")
 
 show_header(
     title=txt["title_page6"],
@@ -26,13 +46,55 @@ if len(selected_rows["selection"]["rows"]) > 0:
     rowid = selected_rows["selection"]["rows"][0]
     identifier = df_files.iloc[rowid]["dataset_identifier"]
     selected_table = df_files.iloc[rowid]["table_name"]
-    ds = ods.ods_metadata[ods.ods_metadata["dataset_identifier"] == identifier].iloc[0]
+    if st.session_state.get("query_table") != selected_table:
+        # the results of the previous table are not shown for this one
+        for key in ("query_batches", "query_pages", "query_batch_cache"):
+            st.session_state.pop(key, None)
+        st.session_state["query_table"] = selected_table
+    ds = ods.get_dataset_metadata(identifier)
     st.markdown(f"**Selected file:** {ds['title']}")
     with st.expander("Metadata", expanded=False):
         st.write(ds)
 
     sql_query = st.text_area("SQL Query", f"SELECT * FROM {selected_table} LIMIT 10")
+    page_rows = st.sidebar.number_input(
+        "Rows per page",
+        min_value=100,
+        max_value=ods.QUERY_PAGE_ROWS,
+        value=1000,
+        step=100,
+        help="Maximum number of rows fetched from Snowflake per page.",
+    )
     if st.button("Run SQL Data", disabled=not (selected_rows["selection"]["rows"])):
-        df = ods.run_snowflake_query(sql_query)
-        st.markdown(f"**Query Result:** {df.shape[0]} records")
-        st.dataframe(df)
+        st.session_state["query_batches"] = query_cache.get_query_cache().get_result_batches(
+            sql_query
+        )
+        st.session_state["query_pages"] = [(0, 0)]
+        # the downloaded batch of the current page, reused by the next pages
+        st.session_state["query_batch_cache"] = {}
+
+    if "query_batches" in st.session_state:
+        batches = st.session_state["query_batches"]
+        pages = st.session_state["query_pages"]
+        page, next_start = ods.fetch_result_page(
+            batches,
+            pages[-1],
+            max_rows=page_rows,
+            cache=st.session_state["query_batch_cache"],
+        )
+        if page is None:
+            st.markdown("**Query Result:** 0 records")
+            st.stop()
+        total_rows = sum(batch.rowcount for batch in batches)
+        first_row = sum(batch.rowcount for batch in batches[: pages[-1][0]]) + pages[-1][1]
+        st.markdown(
+            f"**Query Result:** {total_rows} records, showing {first_row + 1} to {first_row + page.num_rows}"
+        )
+        st.dataframe(page.to_pandas())
+        cols = st.columns([1, 1, 8])
+        if cols[0].button("Previous", disabled=len(pages) == 1):
+            pages.pop()
+            st.rerun()
+        if cols[1].button("Next", disabled=next_start is None):
+            pages.append(next_start)
+            st.rerun()
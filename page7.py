@@ -1,7 +1,7 @@
 import streamlit as st
-import pandas as pd
 import ods
-from utils import show_header, show_records
+import dataset_cache
+from utils import show_header, show_preview, show_records
 from texts import txt
 
 
@@ -24,12 +24,8 @@ column_configuration = {
 }
 
 
-file_list = list(ods.data_folder.glob("*.parquet"))  # Get all files
-files_df = pd.DataFrame(file_list, columns=["file_path"])
-files_df["file_path"] = files_df["file_path"].astype(str)
-files_df["identifier"] = files_df["file_path"].str.extract(r"(\d+)")
-files_df = ods.extend_columns(
-    files_df, identifier="identifier", columns=["title", "modified"]
+files_df = ods.extend_columns(  # files and partition folders
+    ods.get_local_files(), identifier="identifier", columns=["title", "modified"]
 )
 
 show_header(
@@ -45,11 +41,31 @@ selected_rows = st.dataframe(
     on_select="rerun",
     selection_mode="single-row",
 )
-# st.write(selected_rows)
-if st.button("Preview"):
+if selected_rows["selection"]["rows"] and st.toggle("Preview"):
     row = selected_rows["selection"]["rows"][0]
     file_path = files_df.iloc[row]["file_path"]
-    df = pd.read_parquet(file_path)
-    st.write(f"{files_df.iloc[row]['title']} ({len(df)} records)")
-    st.dataframe(df.head(5000))
-    
\ No newline at end of file
+    preview = ods.get_local_preview(file_path)
+    st.write(files_df.iloc[row]["title"])
+    columns = st.multiselect("Columns", preview.schema.names, default=preview.schema.names)
+    page_rows = st.sidebar.number_input(
+        "Rows per page", min_value=100, max_value=10000, value=ods.PREVIEW_PAGE_ROWS, step=100
+    )
+    show_preview(preview, f"preview_{file_path}", columns, page_rows)
+
+if selected_rows["selection"]["rows"]:
+    row = selected_rows["selection"]["rows"][0]
+    table_name = f"DS_{files_df.iloc[row]['identifier']}"
+    sql_query = st.text_area(
+        "SQL Query",
+        f"SELECT * FROM {table_name} LIMIT 10",
+        help="Every local parquet file can be queried as a table named DS_<identifier>, like the Snowflake tables.",
+    )
+    if st.button("Run SQL Data"):
+        try:
+            # datasets queried repeatedly are read from the arrow tables shared by all sessions
+            tables = dataset_cache.get_dataset_cache().get_query_tables(sql_query)
+            df = ods.run_local_query(sql_query, tables=tables).to_pandas()
+            st.markdown(f"**Query Result:** {df.shape[0]} records")
+            st.dataframe(df)
+        except Exception as e:
+            st.error(f"Error executing query: {e}")
@@ -0,0 +1,46 @@
+import streamlit as st
+import pandas as pd
+import metrics
+import dataset_cache
+import query_cache
+from texts import txt
+from utils import show_header, show_records
+
+show_header(
+    title=txt["title_page8"],
+    help_text=txt["info_page8"],
+)
+metrics.prune()
+summary = metrics.get_operation_summary()
+show_records("{} operations recorded", int(summary["runs"].sum()))
+st.markdown("**Operations**")
+st.dataframe(summary, hide_index=True)
+
+operation = st.sidebar.selectbox("Operation", ["All"] + summary["operation"].tolist())
+limit = st.sidebar.number_input(
+    "Recent operations", min_value=10, max_value=10000, value=100, step=10
+)
+st.markdown("**Recent operations**")
+st.dataframe(
+    metrics.get_operations(limit, None if operation == "All" else operation),
+    hide_index=True,
+)
+st.markdown("**Shared caches**")
+st.dataframe(
+    pd.DataFrame(
+        {
+            "Query results": query_cache.get_query_cache().get_stats(),
+            "Datasets": dataset_cache.get_dataset_cache().get_stats(),
+        }
+    ).T,
+)
+st.markdown("**Slowest datasets**")
+st.dataframe(metrics.get_slowest_datasets(), hide_index=True)
+
+col1, col2 = st.columns(2)
+col1.download_button(
+    "Export JSON lines", metrics.export_json_lines(), "metrics.jsonl", mime="application/x-ndjson"
+)
+col2.download_button(
+    "Export Prometheus metrics", metrics.export_prometheus(), "metrics.prom", mime="text/plain"
+)
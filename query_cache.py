@@ -0,0 +1,285 @@
+import hashlib
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pyarrow as pa
+import streamlit as st
+
+import inventory
+import metrics
+import ods
+
+QUERY_CACHE_BYTES = 256 * 1024 * 1024  # bytes of results held in memory
+QUERY_CACHE_DISK_BYTES = 1024 * 1024 * 1024  # bytes of results spilled to disk
+QUERY_CACHE_MAX_ENTRY_BYTES = 64 * 1024 * 1024  # larger results are paged from Snowflake uncached
+QUERY_CACHE_LISTING_TTL = 60  # seconds table versions are taken from the listing, see info_page6
+SQL_TOKENS = re.compile(  # string literals and quoted identifiers, comments, whitespace
+    r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"]|"")*")|(--[^\n]*|//[^\n]*|/\*.*?\*/|\s+)""", re.DOTALL
+)
+SQL_WORDS = re.compile(  # literals, quoted identifiers, (qualified) names, other characters
+    r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"]|"")*"|[\w$]+(?:\.[\w$]+)*|\S"""
+)
+SQL_VOLATILE = re.compile(  # functions and clauses whose result changes without a table reload
+    r"\b(?:current_\w+|localtime|localtimestamp|sample|tablesample)\b"
+    r"|\b(?:sysdate|getdate|systimestamp|random|randstr|uniform|normal|zipf|uuid_string"
+    r"|seq[1248]|last_query_id|at|before|changes)\s*\("
+)
+
+spill_folder = ods.cache_folder / "queries"  # None keeps the results in memory only
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Returns a query in a normal form, so queries differing only in case, whitespace,
+    comments or a trailing semicolon share a cache entry. String literals and quoted
+    identifiers are kept as they are.
+    """
+    parts = []
+    for i, part in enumerate(SQL_TOKENS.split(query)):
+        if not part:
+            continue
+        kind = i % 3  # 0: unquoted text, 1: quoted, 2: comment or whitespace
+        if kind == 0:
+            parts.append(part.lower())
+        elif kind == 1:
+            parts.append(part)
+        elif parts and parts[-1] != " ":
+            parts.append(" ")
+    return "".join(parts).strip().rstrip("; ")
+
+
+def _skip_parentheses(tokens: list, start: int) -> int:
+    # returns the index after the parenthesis closing the one at start
+    depth = 0
+    for i in range(start, len(tokens)):
+        depth += {"(": 1, ")": -1}.get(tokens[i], 0)
+        if depth == 0:
+            return i + 1
+    return len(tokens)
+
+
+def get_query_tables(query: str) -> list:
+    """
+    Returns the names of the dataset tables (DS_<identifier>) a query reads, or None if
+    its result may change without one of them being reloaded: it reads another relation,
+    e.g. a table of another schema, a view or a table function, or it calls a volatile
+    function like CURRENT_TIMESTAMP or RANDOM or samples rows. Subqueries and the tables
+    defined by its WITH clause are allowed.
+    """
+    normalized = normalize_sql(query)
+    unquoted = " ".join(
+        part for i, part in enumerate(SQL_TOKENS.split(normalized)) if i % 3 == 0 and part
+    )
+    if SQL_VOLATILE.search(unquoted):
+        return None
+    tokens = SQL_WORDS.findall(normalized)
+    ctes = {
+        tokens[i]
+        for i in range(1, len(tokens) - 2)
+        if tokens[i - 1] in ("with", "recursive", ",") and tokens[i + 1 : i + 3] == ["as", "("]
+    }
+    tables = set()
+    for i, token in enumerate(tokens):
+        # EXTRACT(part FROM expression) does not read a relation
+        if token not in ("from", "join") or (i >= 3 and tokens[i - 3 : i - 1] == ["extract", "("]):
+            continue
+        j = i + 1
+        # the relations of a FROM list up to the next clause, with their aliases
+        while j < len(tokens):
+            if tokens[j] == "(":
+                j = _skip_parentheses(tokens, j)  # a subquery, whose FROM is checked itself
+            else:
+                name = tokens[j][1:-1] if tokens[j].startswith('"') else tokens[j].upper()
+                if re.fullmatch(r"DS_\d+", name) and tokens[j + 1 : j + 2] != ["."]:
+                    tables.add(name)
+                elif tokens[j] not in ctes:
+                    return None
+                j += 1
+            if tokens[j : j + 1] == ["as"]:
+                j += 1
+            if j < len(tokens) and re.fullmatch(r"[\w$]+", tokens[j]):
+                j += 1
+            if tokens[j : j + 1] != [","]:
+                break
+            j += 1
+    return sorted(tables)
+
+
+class QueryCache:
+    """
+    Results of Snowflake queries shared by all sessions, stored as arrow tables.
+
+    An entry is keyed by the normalised query and the LAST_ALTERED time of every table
+    it reads, so reloading a table invalidates the results of all queries on it. The
+    times are taken from the shared Snowflake listing of the inventory, listed again
+    after QUERY_CACHE_LISTING_TTL seconds, so running a query does not need a metadata
+    query of its own. Loads by the app refresh the listing at once; loads by other
+    processes, e.g. the sync CLI, are noticed once the listing is listed again. Only
+    SELECT queries that read nothing but dataset tables of the current schema and call
+    no volatile functions are cached, see get_query_tables, and only if their result is
+    at most max_entry_bytes. The least recently used entries are spilled to arrow IPC files in
+    spill_folder when the memory budget is exceeded and deleted when the disk budget is
+    exceeded. Spilled results are read back memory-mapped.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = QUERY_CACHE_BYTES,
+        max_disk_bytes: int = QUERY_CACHE_DISK_BYTES,
+        max_entry_bytes: int = QUERY_CACHE_MAX_ENTRY_BYTES,
+        folder: Path = spill_folder,
+    ):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> arrow table, least recently used first
+        self.spilled = OrderedDict()  # key -> (IPC file, bytes), least recently used first
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # result bytes served from the cache instead of Snowflake
+        if folder is not None:
+            # the keys of files spilled by an earlier process are unknown
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def get_key(self, query: str) -> tuple:
+        """
+        Returns the cache key of a query, or None if its result must not be cached: it is
+        not a SELECT, reads no dataset table, reads another relation, calls a volatile
+        function or reads a table that does not exist.
+        """
+        normalized = normalize_sql(query)
+        if not normalized.startswith(("select", "with")):
+            return None
+        table_names = get_query_tables(query)
+        if not table_names:
+            return None
+        listing = inventory.get_inventory().get_listing(
+            "snowflake", ttl=QUERY_CACHE_LISTING_TTL
+        )
+        altered = {entry["table_name"]: entry["last_altered"] for entry in listing.values()}
+        if any(name not in altered for name in table_names):
+            return None
+        return (normalized, tuple((name, altered[name].isoformat()) for name in table_names))
+
+    def get(self, key: tuple) -> pa.Table:
+        """
+        Returns the cached result of a key, or None.
+        """
+        with self.lock:
+            table = self.entries.get(key)
+            if table is not None:
+                self.entries.move_to_end(key)
+            elif key in self.spilled:
+                self.spilled.move_to_end(key)
+                path = self.spilled[key][0]
+                try:
+                    with pa.memory_map(str(path)) as source:
+                        table = pa.ipc.open_file(source).read_all()
+                except OSError:
+                    self._remove_spilled(key)
+            if table is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += table.nbytes
+            return table
+
+    def put(self, key: tuple, table: pa.Table):
+        """
+        Adds a query result, evicting the least recently used results over the budget.
+        """
+        if table.nbytes > self.max_entry_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = table
+            self.bytes += table.nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_table = self.entries.popitem(last=False)
+                self.bytes -= old_table.nbytes
+                self._spill(old_key, old_table)
+
+    def _spill(self, key: tuple, table: pa.Table):
+        if self.folder is None or table.nbytes > self.max_disk_bytes or key in self.spilled:
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self.folder / (hashlib.sha256(repr(key).encode()).hexdigest() + ".arrow")
+        with pa.OSFile(str(path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.spilled[key] = (path, table.nbytes)
+        self.disk_bytes += table.nbytes
+        while self.disk_bytes > self.max_disk_bytes:
+            self._remove_spilled(next(iter(self.spilled)))
+
+    def _remove_spilled(self, key: tuple):
+        path, size = self.spilled.pop(key)
+        self.disk_bytes -= size
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass  # still memory-mapped by a session on Windows
+
+    def get_result_batches(self, query: str) -> list:
+        """
+        Returns the result of a query as a list of batches for ods.fetch_result_page.
+        A cached result is returned without running the query. Otherwise the query is
+        executed and, if its result is small enough, downloaded completely and cached;
+        larger results are returned as Snowflake ResultBatch objects, which are fetched
+        page by page.
+        """
+        try:
+            key = self.get_key(query)
+        except Exception:
+            key = None  # the query itself reports why Snowflake cannot be reached
+        if key is not None:
+            table = self.get(key)
+            if table is not None:
+                with metrics.record("snowflake_query_cache", ods.get_query_dataset(query)) as m:
+                    m["rows"], m["bytes"] = table.num_rows, table.nbytes
+                return [ods.TableBatch(table)] if table.num_rows else []
+        batches = ods.get_query_result_batches(query)
+        size = sum(batch.uncompressed_size or 0 for batch in batches)
+        if key is None or not batches or size > self.max_entry_bytes:
+            return batches
+        try:
+            with metrics.record("snowflake_fetch", ods.get_query_dataset(query)) as m:
+                table = pa.concat_tables([batch.to_arrow() for batch in batches])
+                m["rows"], m["bytes"] = table.num_rows, table.nbytes
+        except Exception:
+            return batches  # paged from Snowflake, which reports the error
+        self.put(key, table)
+        return [ods.TableBatch(table)] if table.num_rows else []
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of the cache: "hits", "misses", "bytes_saved", and the
+        number and size of the results in memory ("entries", "bytes") and on disk
+        ("spilled", "disk_bytes").
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "spilled": len(self.spilled),
+                "disk_bytes": self.disk_bytes,
+            }
+
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """
+    Returns the query result cache shared by all sessions.
+    """
+    return QueryCache()
@@ -0,0 +1,220 @@
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+import pandas as pd
+import streamlit as st
+
+import ods
+
+SEARCH_FIELDS = {  # catalog fields in the index and their weight in the ranking
+    "title": 3.0,
+    "keywords": 2.0,
+    "themes": 2.0,
+    "publisher": 1.0,
+    "description": 1.0,
+}
+BM25_K1 = 1.2  # term frequency saturation
+BM25_B = 0.75  # field length normalisation
+PREFIX_WEIGHT = 0.5  # share of the score of a term that only starts with the query word
+MAX_PREFIX_TERMS = 200  # most frequent terms a short prefix is expanded to
+
+GERMAN_FOLDING = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+
+
+def fold(text: str) -> str:
+    """
+    Folds text for matching: lower case, umlauts to their base vowel, ß to ss and other
+    accents removed, so "Bevölkerung", "BEVÖLKERUNG" and "Bevolkerung" match.
+    """
+    text = text.casefold().translate(GERMAN_FOLDING)
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text) -> list:
+    """
+    Returns the folded words of a text. Missing values have no words.
+    """
+    if not isinstance(text, str):
+        return []
+    return re.findall(r"\w+", fold(text))
+
+
+class SearchIndex:
+    """
+    Inverted index over the ODS catalog, ranked with BM25F over SEARCH_FIELDS.
+
+    The index is updated incrementally: only datasets whose metadata_processed changed
+    are indexed again, and datasets removed from the catalog are removed from the index.
+    The sorted vocabulary for prefix matching is rebuilt only if terms were added or
+    removed.
+    """
+
+    def __init__(self):
+        self.version = None
+        # dataset identifier -> (metadata_processed, {field: Counter}, {field: length})
+        self.documents = {}
+        self.postings = {}  # term -> {dataset identifier: {field: term frequency}}
+        self.field_lengths = {field: 0 for field in SEARCH_FIELDS}  # tokens of all documents
+        self.terms = []  # sorted vocabulary
+        self.lock = threading.Lock()
+
+    def update(self, metadata: pd.DataFrame, version) -> int:
+        """
+        Brings the index up to date with a version of the ODS catalog. Does nothing if the
+        index already has this version.
+
+        Args:
+            metadata (pd.DataFrame): The ODS catalog.
+            version: The version of the catalog, e.g. ods.metadata_version.
+
+        Returns:
+            int: The number of datasets indexed or removed.
+        """
+        with self.lock:
+            if version == self.version:
+                return 0
+            fields = [field for field in SEARCH_FIELDS if field in metadata.columns]
+            processed = (
+                metadata["metadata_processed"].astype(str)
+                if "metadata_processed" in metadata.columns
+                else pd.Series("", index=metadata.index)
+            )
+            identifiers = metadata["dataset_identifier"].astype(str)
+            current = set(identifiers)
+            changes = 0
+            vocabulary_changed = False
+            for ds_id in [ds_id for ds_id in self.documents if ds_id not in current]:
+                vocabulary_changed |= self._remove(ds_id)
+                changes += 1
+            records = metadata[fields].to_dict("records")
+            for ds_id, stamp, record in zip(identifiers, processed, records):
+                document = self.documents.get(ds_id)
+                if document is not None and document[0] == stamp:
+                    continue
+                if document is not None:
+                    vocabulary_changed |= self._remove(ds_id)
+                vocabulary_changed |= self._add(ds_id, stamp, record)
+                changes += 1
+            if vocabulary_changed:
+                self.terms = sorted(self.postings)
+            self.version = version
+            return changes
+
+    def _add(self, ds_id: str, stamp: str, record: dict) -> bool:
+        fields = {field: Counter(tokenize(record.get(field))) for field in SEARCH_FIELDS}
+        lengths = {field: sum(counts.values()) for field, counts in fields.items()}
+        self.documents[ds_id] = (stamp, fields, lengths)
+        added = False
+        for field, counts in fields.items():
+            self.field_lengths[field] += lengths[field]
+            for term, count in counts.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    added = True
+                self.postings[term].setdefault(ds_id, {})[field] = count
+        return added
+
+    def _remove(self, ds_id: str) -> bool:
+        _, fields, lengths = self.documents.pop(ds_id)
+        removed = False
+        for field, counts in fields.items():
+            self.field_lengths[field] -= lengths[field]
+            for term in counts:
+                documents = self.postings.get(term)
+                if documents is not None and documents.pop(ds_id, None) is not None:
+                    if not documents:
+                        del self.postings[term]
+                        removed = True
+        return removed
+
+    def _expand(self, word: str) -> list:
+        # terms starting with word, found by bisecting the sorted vocabulary
+        start = bisect_left(self.terms, word)
+        end = bisect_left(self.terms, word + "\U0010ffff", start)
+        terms = self.terms[start:end]
+        if len(terms) > MAX_PREFIX_TERMS:
+            terms = sorted(terms, key=lambda term: len(self.postings[term]), reverse=True)
+            terms = terms[:MAX_PREFIX_TERMS]
+        return terms
+
+    def _score_term(self, term: str, average_lengths: dict) -> dict:
+        documents = self.postings[term]
+        count = len(self.documents)
+        idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+        scores = {}
+        for ds_id, frequencies in documents.items():
+            lengths = self.documents[ds_id][2]
+            weighted = 0.0
+            for field, frequency in frequencies.items():
+                norm = 1 - BM25_B + BM25_B * lengths[field] / max(average_lengths[field], 1e-9)
+                weighted += SEARCH_FIELDS[field] * frequency / norm
+            scores[ds_id] = idf * weighted / (BM25_K1 + weighted)
+        return scores
+
+    def search(self, query: str, limit: int = None) -> list:
+        """
+        Returns the datasets matching every word of a query, best match first. A query
+        word matches the terms it is a prefix of; whole-word matches rank higher.
+
+        Args:
+            query (str): The search words.
+            limit (int): Maximum number of results, all if None.
+
+        Returns:
+            list: Pairs of dataset identifier and score.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            count = max(len(self.documents), 1)
+            average_lengths = {
+                field: length / count for field, length in self.field_lengths.items()
+            }
+            scores = None
+            for word in dict.fromkeys(words):
+                word_scores = {}
+                for term in self._expand(word):
+                    weight = 1.0 if term == word else PREFIX_WEIGHT
+                    for ds_id, score in self._score_term(term, average_lengths).items():
+                        word_scores[ds_id] = max(word_scores.get(ds_id, 0.0), weight * score)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {
+                        ds_id: score + word_scores[ds_id]
+                        for ds_id, score in scores.items()
+                        if ds_id in word_scores
+                    }
+                if not scores:
+                    return []
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return results[:limit] if limit else results
+
+
+@st.cache_resource
+def get_search_index() -> SearchIndex:
+    """
+    Returns the search index shared by all sessions.
+    """
+    return SearchIndex()
+
+
+def search_datasets(query: str, limit: int = None) -> list:
+    """
+    Searches the ODS catalog, updating the index first if the catalog changed since the
+    last search.
+
+    Returns:
+        list: Pairs of dataset identifier and score, best match first.
+    """
+    index = get_search_index()
+    # read the version first: a catalog replaced in between is indexed on the next search
+    version = ods.metadata_version
+    index.update(ods.get_ods_metadata(), version)
+    return index.search(query, limit)
@@ -0,0 +1,451 @@
+"""
+Downloads ODS datasets and uploads them to Azure and Snowflake without the Streamlit UI.
+
+    python sync.py download 100051 100113 --upload azure snowflake
+    python sync.py stale --upload azure
+    python sync.py plan --priority 100051=4
+    python sync.py schedule --upload azure snowflake --priority 100051=4
+
+The scheduler checks the ODS catalog every tick and refreshes the stale local datasets
+whose refresh interval has passed since their last download. The refresh interval follows
+how often a dataset is updated on ODS, estimated from the history of its modification
+timestamps, and grows with the size of the dataset and shrinks with its priority.
+"""
+import argparse
+import logging
+import math
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+import catalog
+import ods
+
+SCHEDULER_TICK = 300  # seconds between two checks of the ODS catalog
+MIN_REFRESH_INTERVAL = 15 * 60  # seconds a dataset is kept at least before it is refreshed again
+MAX_REFRESH_INTERVAL = 24 * 3600  # seconds after which a stale dataset is refreshed at the latest
+REFRESH_FRACTION = 0.5  # share of the update interval after which a dataset is refreshed
+DEFAULT_UPDATE_INTERVAL = 7 * 24 * 3600  # assumed for datasets without a known periodicity
+PRIOR_WEIGHT = 2  # number of observed intervals the declared periodicity weighs as much as
+HISTORY_INTERVALS = 10  # most recent update intervals used for the estimate
+SIZE_REFERENCE = 100 * 1024 * 1024  # larger datasets are refreshed less often
+DEFAULT_PRIORITY = 1.0
+
+snowflake_load_mode = "auto"  # see ods.load_files_to_snowflake
+periodicity_field = "accrual_periodicity"  # update frequency declared in the ODS catalog
+PERIODICITY_INTERVALS = {  # seconds per EU frequency code, None if no interval is declared
+    "CONT": 15 * 60,
+    "UPDATE_CONT": 15 * 60,
+    "HOURLY": 3600,
+    "DAILY": 24 * 3600,
+    "DAILY_2": 12 * 3600,
+    "WEEKLY": 7 * 24 * 3600,
+    "WEEKLY_2": 3.5 * 24 * 3600,
+    "BIWEEKLY": 14 * 24 * 3600,
+    "MONTHLY": 30 * 24 * 3600,
+    "MONTHLY_2": 15 * 24 * 3600,
+    "BIMONTHLY": 61 * 24 * 3600,
+    "QUARTERLY": 91 * 24 * 3600,
+    "ANNUAL_2": 182 * 24 * 3600,
+    "ANNUAL": 365 * 24 * 3600,
+    "BIENNIAL": 730 * 24 * 3600,
+    "TRIENNIAL": 1095 * 24 * 3600,
+    "NEVER": MAX_REFRESH_INTERVAL / REFRESH_FRACTION,
+    "IRREG": None,
+    "IRREGULAR": None,  # plain value instead of the code
+    "UNKNOWN": None,
+}
+
+
+def log(message: str):
+    print(f"{datetime.now(timezone.utc).isoformat(timespec='seconds')} {message}", flush=True)
+
+
+def get_periodicity_interval(periodicity) -> float:
+    """
+    Returns the update interval in seconds of a declared periodicity, e.g.
+    http://publications.europa.eu/resource/authority/frequency/DAILY or the plain value
+    daily, or None if the periodicity is missing, irregular or unknown.
+    """
+    if not isinstance(periodicity, str) or not periodicity.strip():
+        return None
+    code = periodicity.strip().rstrip("/").rsplit("/", 1)[-1].upper()
+    return PERIODICITY_INTERVALS.get(code)
+
+
+def estimate_update_interval(modified: list, periodicity=None) -> float:
+    """
+    Estimates how often a dataset is updated. The median of the most recent intervals
+    between its modification timestamps is combined with the declared periodicity, which
+    weighs as much as PRIOR_WEIGHT observed intervals, so a few observations do not
+    outweigh the declaration but a long history does.
+
+    Args:
+        modified (list): Modification timestamps of the dataset as seen on ODS.
+        periodicity: The declared update frequency of the dataset, if any.
+
+    Returns:
+        float: The estimated update interval in seconds.
+    """
+    prior = get_periodicity_interval(periodicity) or DEFAULT_UPDATE_INTERVAL
+    timestamps = pd.to_datetime(pd.Series(modified, dtype=object), utc=True, errors="coerce")
+    timestamps = timestamps.dropna().sort_values().tail(HISTORY_INTERVALS + 1)
+    intervals = timestamps.diff().dt.total_seconds().dropna()
+    intervals = intervals[intervals > 0]
+    if intervals.empty:
+        return prior
+    n = len(intervals)
+    # weighted geometric mean, intervals span orders of magnitude
+    return math.exp(
+        (PRIOR_WEIGHT * math.log(prior) + n * math.log(intervals.median())) / (PRIOR_WEIGHT + n)
+    )
+
+
+def get_refresh_interval(
+    update_interval: float, size: float = None, priority: float = DEFAULT_PRIORITY
+) -> float:
+    """
+    Returns the seconds after which a stale dataset is refreshed: a fraction of its
+    update interval, longer for datasets larger than SIZE_REFERENCE and shorter for a
+    higher priority, within MIN_REFRESH_INTERVAL and MAX_REFRESH_INTERVAL.
+    """
+    size_factor = 1.0
+    if size is not None and not pd.isna(size):
+        size_factor = max(1.0, math.sqrt(float(size) / SIZE_REFERENCE))
+    interval = update_interval * REFRESH_FRACTION * size_factor / max(priority, 1e-6)
+    return min(max(interval, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+
+
+def get_schedule(priorities: dict = None) -> pd.DataFrame:
+    """
+    Returns the refresh schedule of the locally stored datasets that are still in the ODS
+    catalog, the most overdue first.
+
+    Args:
+        priorities (dict): Priority per dataset identifier, DEFAULT_PRIORITY otherwise.
+
+    Returns:
+        pd.DataFrame: One row per dataset with its stale flag, estimated update and refresh
+            intervals in seconds, last download, due time and overdue ratio (the time since
+            the last download divided by the refresh interval).
+    """
+    priorities = priorities or {}
+    now = datetime.now(timezone.utc)
+    metadata = ods.get_metadata_view()
+    history = catalog.get_modified_history().groupby("dataset_identifier")["modified"]
+    history = {ds_id: values.tolist() for ds_id, values in history}
+    stale = set(ods.get_stale_datasets()["dataset_identifier"])
+    rows = []
+    for entry in catalog.get_datasets().itertuples():
+        ds_id = entry.dataset_identifier
+        if ds_id not in metadata.index:
+            continue  # removed from ODS
+        ds = metadata.loc[ds_id]
+        update_interval = estimate_update_interval(
+            history.get(ds_id, []), ds.get(periodicity_field)
+        )
+        priority = priorities.get(ds_id, DEFAULT_PRIORITY)
+        refresh_interval = get_refresh_interval(
+            update_interval, ds.get("size_of_records_in_the_dataset_in_bytes"), priority
+        )
+        # entries migrated from log.json have no download time and are due at once
+        downloaded_at = pd.to_datetime(entry.downloaded_at, utc=True)
+        if pd.isna(downloaded_at):
+            due_at, overdue = now, math.inf
+        else:
+            due_at = downloaded_at + timedelta(seconds=refresh_interval)
+            overdue = (now - downloaded_at).total_seconds() / refresh_interval
+        rows.append(
+            {
+                "dataset_identifier": ds_id,
+                "title": ds["title"],
+                "stale": ds_id in stale,
+                "priority": priority,
+                "update_interval": update_interval,
+                "refresh_interval": refresh_interval,
+                "downloaded_at": downloaded_at,
+                "due_at": due_at,
+                "overdue": overdue,
+            }
+        )
+    # the dtypes are set explicitly, an empty catalog would leave every column object
+    dtypes = {
+        "dataset_identifier": object,
+        "title": object,
+        "stale": bool,
+        "priority": float,
+        "update_interval": float,
+        "refresh_interval": float,
+        "downloaded_at": "datetime64[ns, UTC]",
+        "due_at": "datetime64[ns, UTC]",
+        "overdue": float,
+    }
+    df = pd.DataFrame(rows, columns=list(dtypes)).astype(dtypes)
+    return df.sort_values("overdue", ascending=False)
+
+
+def get_due_datasets(schedule: pd.DataFrame, limit: int = None) -> list:
+    """
+    Returns the identifiers of the stale datasets that are due, by priority and then the
+    most overdue first.
+    """
+    due = schedule[schedule["stale"] & (schedule["overdue"] >= 1)]
+    due = due.sort_values(["priority", "overdue"], ascending=False)
+    return due["dataset_identifier"].head(limit).tolist()
+
+
+def upload_datasets(
+    identifiers: list, targets: list, workers: int = ods.AZURE_TRANSFER_WORKERS
+) -> dict:
+    """
+    Uploads the local files of datasets to the targets and records the uploads in the
+    catalog.
+
+    Returns:
+        dict: The error per failed dataset identifier.
+    """
+    errors = {}
+    paths = {str(ods.get_local_path(ds_id)): ds_id for ds_id in identifiers}
+    if not paths:
+        return errors
+    if "azure" in targets:
+        for result in ods.upload_files_to_azure(list(paths), workers=workers):
+            ds_id = paths[result["file_path"]]
+            if result["error"] is None:
+                catalog.mark_synced(ds_id, "azure")
+                log(f"{ds_id}: uploaded to Azure ({result['bytes'] / 2**20:.1f} MB, {result['mb_per_s']:.2f} MB/s)")
+            else:
+                errors[ds_id] = result["error"]
+                log(f"{ds_id}: upload to Azure failed: {result['error']}")
+    if "snowflake" in targets:
+        results = ods.load_files_to_snowflake(
+            list(paths), workers=workers, mode=snowflake_load_mode
+        )
+        for result in results:
+            ds_id = paths[result["file_path"]]
+            if result["error"] is None:
+                catalog.mark_synced(ds_id, "snowflake")
+                log(f"{ds_id}: loaded into {result['table_name']} by {result['mode']} ({result['status']}, {result['rows_loaded']} rows)")
+            else:
+                errors[ds_id] = result["error"]
+                log(f"{ds_id}: load into Snowflake failed: {result['error']}")
+    return errors
+
+
+def sync_datasets(
+    identifiers: list,
+    targets: list = (),
+    incremental: bool = True,
+    memory_budget: int = ods.DOWNLOAD_MEMORY_BUDGET,
+    workers: int = ods.DOWNLOAD_WORKERS,
+) -> dict:
+    """
+    Downloads datasets, records them in the catalog and uploads the downloaded ones to
+    the targets.
+
+    Args:
+        identifiers (list): The dataset identifiers.
+        targets (list): Any of catalog.SYNC_TARGETS.
+        incremental (bool): If True, time series are updated by appending the new rows.
+        memory_budget (int): Maximum number of bytes all downloads together may hold in memory.
+        workers (int): Number of datasets downloaded and uploaded in parallel.
+
+    Returns:
+        dict: The error per failed dataset identifier.
+    """
+    errors = {}
+    datasets = []
+    for ds_id in identifiers:
+        try:
+            datasets.append(ods.get_dataset_metadata(ds_id))
+        except KeyError:
+            errors[ds_id] = f"Dataset {ds_id} not found in the ODS catalog"
+            log(f"{ds_id}: not found in the ODS catalog")
+    downloaded = []
+    if datasets:
+        ods.data_folder.mkdir(exist_ok=True)
+        for result in ods.download_datasets(datasets, memory_budget, workers, incremental):
+            ds = result["ds"]
+            ds_id = ds["dataset_identifier"]
+            if result["error"] is None:
+                ods.register_download(ds, result["rows"], result["content_hash"])
+                downloaded.append(ds_id)
+                log(f"{ds_id}: {result['rows']} records ({result['bytes'] / 2**20:.1f} MB) in {result['seconds']:.1f}s")
+                for column, values in result["coerced"].items():
+                    log(f"{ds_id}: {values} values of {column} do not fit its type, stored as text")
+            else:
+                errors[ds_id] = result["error"]
+                log(f"{ds_id}: download failed: {result['error']}")
+    errors.update(upload_datasets(downloaded, targets, workers))
+    return errors
+
+
+def run_tick(
+    targets: list,
+    priorities: dict = None,
+    limit: int = None,
+    memory_budget: int = ods.DOWNLOAD_MEMORY_BUDGET,
+    workers: int = ods.DOWNLOAD_WORKERS,
+) -> dict:
+    """
+    Revalidates the ODS catalog, records the modification timestamps of all datasets and
+    refreshes the datasets that are due.
+
+    Returns:
+        dict: The error per failed dataset identifier.
+    """
+    ods.refresh_ods_metadata()
+    metadata = ods.get_ods_metadata()
+    catalog.record_modified(zip(metadata["dataset_identifier"], metadata["modified"]))
+    due = get_due_datasets(get_schedule(priorities), limit)
+    if not due:
+        return {}
+    log(f"Refreshing {len(due)} datasets: {', '.join(due)}")
+    return sync_datasets(due, targets, True, memory_budget, workers)
+
+
+def run_scheduler(
+    targets: list,
+    priorities: dict = None,
+    tick: float = SCHEDULER_TICK,
+    limit: int = None,
+    memory_budget: int = ods.DOWNLOAD_MEMORY_BUDGET,
+    workers: int = ods.DOWNLOAD_WORKERS,
+):
+    """
+    Runs run_tick every tick seconds until interrupted. Errors of a tick, e.g. a network
+    outage, are logged and the next tick is tried as usual.
+    """
+    log(f"Scheduler started, checking the ODS catalog every {tick:.0f}s")
+    while True:
+        start = time.monotonic()
+        try:
+            run_tick(targets, priorities, limit, memory_budget, workers)
+        except Exception as e:
+            log(f"Error in scheduler tick: {e}")
+        time.sleep(max(0.0, tick - (time.monotonic() - start)))
+
+
+def parse_priority(value: str) -> tuple:
+    """
+    Parses a --priority value ID=WEIGHT into the dataset identifier and the weight. Used as
+    argument type, so argparse reports invalid values as usage errors.
+    """
+    ds_id, _, priority = value.partition("=")
+    try:
+        return ds_id.strip(), float(priority)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid priority {value!r}, expected ID=WEIGHT")
+
+
+def format_schedule(schedule: pd.DataFrame) -> pd.DataFrame:
+    df = schedule.copy()
+    for column in ["update_interval", "refresh_interval"]:
+        df[column] = pd.to_timedelta(df[column].astype(float).round(), unit="s")
+    df["overdue"] = df["overdue"].round(2)
+    df["title"] = df["title"].str.slice(0, 40)
+    return df
+
+
+def main(argv: list = None) -> int:
+    global snowflake_load_mode
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--upload",
+        nargs="*",
+        default=[],
+        choices=catalog.SYNC_TARGETS,
+        help="targets the downloaded datasets are uploaded to",
+    )
+    common.add_argument(
+        "--memory-budget",
+        type=int,
+        default=ods.DOWNLOAD_MEMORY_BUDGET // 2**20,
+        help="MB all downloads together may hold in memory",
+    )
+    common.add_argument(
+        "--load-mode",
+        default=snowflake_load_mode,
+        choices=ods.SNOWFLAKE_LOAD_MODES,
+        help="how existing Snowflake tables are updated",
+    )
+    common.add_argument(
+        "--workers",
+        type=int,
+        default=ods.DOWNLOAD_WORKERS,
+        help="datasets transferred in parallel",
+    )
+    priority = argparse.ArgumentParser(add_help=False)
+    priority.add_argument(
+        "--priority",
+        nargs="*",
+        default=[],
+        type=parse_priority,
+        metavar="ID=WEIGHT",
+        help=f"refresh weight of a dataset, {DEFAULT_PRIORITY} by default",
+    )
+
+    download = subparsers.add_parser("download", parents=[common], help="download datasets")
+    download.add_argument("identifiers", nargs="+", help="dataset identifiers")
+    download.add_argument(
+        "--incremental", action="store_true", help="append the new rows of time series"
+    )
+    subparsers.add_parser("stale", parents=[common], help="refresh all stale datasets now")
+    subparsers.add_parser("plan", parents=[priority], help="show the refresh schedule")
+    schedule = subparsers.add_parser(
+        "schedule", parents=[common, priority], help="refresh the datasets when they are due"
+    )
+    schedule.add_argument(
+        "--tick",
+        type=float,
+        default=SCHEDULER_TICK,
+        help="seconds between two checks of the ODS catalog",
+    )
+    schedule.add_argument("--limit", type=int, help="maximum datasets refreshed per tick")
+    schedule.add_argument("--once", action="store_true", help="run a single tick and exit")
+    args = parser.parse_args(argv)
+    # errors of the modules, e.g. a failed catalog revalidation, are logged to stderr
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    if args.command == "plan":
+        priorities = dict(args.priority)
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(format_schedule(get_schedule(priorities)).to_string(index=False))
+        return 0
+
+    snowflake_load_mode = args.load_mode
+    memory_budget = args.memory_budget * 2**20
+    if args.command == "download":
+        errors = sync_datasets(
+            args.identifiers, args.upload, args.incremental, memory_budget, args.workers
+        )
+    elif args.command == "stale":
+        ods.refresh_ods_metadata()
+        identifiers = ods.get_stale_datasets()["dataset_identifier"].tolist()
+        log(f"Refreshing {len(identifiers)} stale datasets")
+        errors = sync_datasets(identifiers, args.upload, True, memory_budget, args.workers)
+    else:
+        priorities = dict(args.priority)
+        if args.once:
+            errors = run_tick(
+                args.upload, priorities, args.limit, memory_budget, args.workers
+            )
+        else:
+            try:
+                run_scheduler(
+                    args.upload, priorities, args.tick, args.limit, memory_budget, args.workers
+                )
+            except KeyboardInterrupt:
+                log("Scheduler stopped")
+            return 0
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import io
+import sys
+from datetime import date
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ods  # noqa: E402
+
+
+@pytest.fixture
+def fake_ods(tmp_path, monkeypatch):
+    # ODS fields and CSV export of dataset 100001, set by the tests; the rows of an
+    # incremental export (with a where filter) are set separately
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ods, "data_folder", tmp_path)
+    state = {"fields": {}, "csv": "", "new_csv": ""}
+    monkeypatch.setattr(
+        ods,
+        "get_ods_fields",
+        lambda ds_id: [{"name": name, "type": t} for name, t in state["fields"].items()],
+    )
+
+    def urlopen(url):
+        return io.BytesIO(state["new_csv" if "where=" in url else "csv"].encode())
+
+    monkeypatch.setattr(ods.urllib.request, "urlopen", urlopen)
+    return state
+
+
+def test_sync_with_new_field_downloads_completely(fake_ods, tmp_path):
+    pq.write_table(
+        pa.table({"datum": pa.array([date(2024, 1, 1)]), "wert": [1]}),
+        tmp_path / "100001.parquet",
+    )
+    fake_ods["fields"] = {"datum": "date", "wert": "int", "neu": "text"}
+    fake_ods["csv"] = "datum;wert;neu\n2024-01-01;1;a\n2024-01-02;2;b\n"
+    fake_ods["new_csv"] = "datum;wert;neu\n2024-01-02;2;b\n"
+    ds = {"dataset_identifier": "100001", "number_of_records": 2}
+    assert ods.sync_dataset(ds) == (2, "full")
+    table = pq.read_table(tmp_path / "100001.parquet")
+    assert table.column_names == ["datum", "wert", "neu"]
+
+
+def test_values_that_do_not_fit_the_type_are_kept_as_text(fake_ods, tmp_path):
+    # the stray values are in the second chunk, after the schema was fixed
+    fake_ods["fields"] = {"wert": "int"}
+    fake_ods["csv"] = "wert\n" + "1\n" * ods.MIN_CHUNK_ROWS + "abc\n2.5\n"
+    coerced = {}
+    rows = ods.download_ods_table(
+        "100001", tmp_path / "100001.parquet", memory_budget=1, row_size=1, coerced=coerced
+    )
+    assert rows == ods.MIN_CHUNK_ROWS + 2
+    assert pq.read_table(tmp_path / "100001.parquet")["wert"].to_pylist()[-2:] == ["abc", "2.5"]
+    assert coerced == {"wert": 2}
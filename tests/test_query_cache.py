@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import query_cache  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "query, tables",
+    [
+        ("SELECT a.x FROM DS_1 a JOIN ds_2 b ON a.id = b.id", ["DS_1", "DS_2"]),
+        ("select * from ds_1, ds_2 t where t.x = 'from other'", ["DS_1", "DS_2"]),
+        ("with x as (select * from ds_1) select * from x, (select * from ds_2)", ["DS_1", "DS_2"]),
+        ("select extract(year from datum), count(*) from ds_1 group by 1", ["DS_1"]),
+        ("select * from ds_1 join other on true", None),
+        ("select * from ds_1 where id in (select id from other)", None),
+        ('select * from "MYDB"."PUBLIC".DS_1', None),
+        ("select * from public.ds_1", None),
+        ("select current_timestamp, * from ds_1", None),
+        ("select random() from ds_1", None),
+        ("select * from ds_1 sample (10)", None),
+    ],
+)
+def test_query_tables(query, tables):
+    assert query_cache.get_query_tables(query) == tables
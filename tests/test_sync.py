@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import catalog  # noqa: E402
+import ods  # noqa: E402
+import sync  # noqa: E402
+
+
+@pytest.fixture
+def empty_catalog(tmp_path, monkeypatch):
+    # a new catalog.db in an empty folder, without any ODS access
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ods, "get_metadata_view", lambda: pd.DataFrame(columns=["title"]))
+    monkeypatch.setattr(
+        ods, "get_stale_datasets", lambda: pd.DataFrame(columns=["dataset_identifier"])
+    )
+
+
+def test_schedule_of_empty_catalog(empty_catalog):
+    schedule = sync.get_schedule()
+    assert schedule.empty
+    assert pd.api.types.is_float_dtype(schedule["overdue"])
+    assert sync.format_schedule(schedule).empty
+    assert sync.get_due_datasets(schedule) == []
+
+
+def test_plan_with_empty_catalog(empty_catalog, capsys):
+    assert sync.main(["plan"]) == 0
+    assert "overdue" in capsys.readouterr().out
+
+
+def test_invalid_priority_is_a_usage_error(empty_catalog, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        sync.main(["plan", "--priority", "100051=high"])
+    assert exit_info.value.code == 2
+    assert "invalid priority" in capsys.readouterr().err
+
+
+def test_priorities(empty_catalog):
+    assert sync.parse_priority(" 100051=4") == ("100051", 4.0)
+
+
+def test_schedule_uses_declared_periodicity(empty_catalog, monkeypatch):
+    frequency = "http://publications.europa.eu/resource/authority/frequency/"
+    metadata = pd.DataFrame(
+        {
+            "title": ["Daily", "Irregular", "Plain"],
+            "accrual_periodicity": [frequency + "DAILY", frequency + "IRREG", "daily"],
+        },
+        index=["100001", "100002", "100003"],
+    )
+    monkeypatch.setattr(ods, "get_metadata_view", lambda: metadata)
+    for ds_id in metadata.index:
+        ds = {"dataset_identifier": ds_id, "title": metadata.loc[ds_id, "title"]}
+        catalog.upsert_dataset(ds, row_count=1, file_size=1, content_hash="")
+    intervals = sync.get_schedule().set_index("dataset_identifier")["update_interval"]
+    assert intervals["100001"] == sync.PERIODICITY_INTERVALS["DAILY"]
+    assert intervals["100002"] == sync.DEFAULT_UPDATE_INTERVAL
+    assert intervals["100003"] == sync.PERIODICITY_INTERVALS["DAILY"]
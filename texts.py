@@ -17,6 +17,7 @@ By enabling **local caching, Azure Blob storage, and Snowflake integration**, th
 📥 **Functionality:**  
 - Downloads data from **data.bs.ch (OGD OpenData repository)**.
 - Saves datasets as **Parquet files** on the local machine for efficient storage and retrieval. You need to copy these parquet files to and deploy them with your applications. However you will have to include a mechanism to keep your data up to date. Also, these data updates will be lost when you restart your application. 
+- Stores large time series as **monthly partitions** (`<id>/year=YYYY/month=MM/part-*.parquet`), so updates only add new files and queries filtering on year and month read only the months they need.
   
 📌 **Use Case:**  
 Ideal for **small to medium datasets** that need repeated access without querying ODS directly.
@@ -96,6 +97,8 @@ This application is **ideal for organizations and developers** working with **da
     "title_page2": "Download ODS datasets",
     "info_page2": """Select the files you want to download from the ODS repository and save them to your local disk. Then, click the Download button to start the process.
 
+The search in the sidebar finds datasets by title, description, keywords, themes and publisher. Words may be shortened ("bevölk" finds "Bevölkerung") and umlauts may be written without dots; the best matches are listed first.
+
 If a file has already been saved locally, you will see entries in the columns "Records (Local)" and "Uploaded". To check if the dataset is up to date, compare the following columns:
 
 - "Modified": The last modified date of the dataset in the ODS repository.  
@@ -104,18 +107,25 @@ If a file has already been saved locally, you will see entries in the columns "R
 If the "Modified" and "Uploaded" timestamps are identical, the dataset is already synchronized. If they differ, consider downloading the latest version to keep your local copy up to date.""",
 
     "title_page3": "Upload local parqet files to Azure",
-    "info_page3": """The list below shows all Parquet files stored locally. Select the files you want to upload to Azure Blob Storage and click the Upload button to start the process.""",
+    "info_page3": """The list below shows all Parquet files stored locally. Select the files you want to upload to Azure Blob Storage and click the Upload button to start the process.
+
+The Azure column shows whether a dataset is missing in the container, behind (its blobs are older than the local file or than the last change on ODS) or current. The button in the sidebar uploads only the files that are missing or newer than their copy in Azure. The container listing is cached for a few minutes; use "Refresh Azure listing" after changes made outside the app.""",
 
 "title_page4": "Upload local parqet files to Snowflake",
-    "info_page4": """The list below shows all Parquet files stored locally. Select the files you want to upload to Azure Blob Storage and click the Upload button to start the process.""",
+    "info_page4": """The list below shows all Parquet files stored locally. Select the files you want to upload to Azure Blob Storage and click the Upload button to start the process.
+
+The Snowflake column shows whether the table of a dataset is missing, behind (last changed before the local download or the last change on ODS) or current. The button in the sidebar loads only the files whose table is missing or older than the file. The table listing is cached for a few minutes; use "Refresh Snowflake listing" after changes made outside the app.""",
 
 "title_page5": "Load remote data from Azure",
-    "info_page5": """The list below shows all Parquet files stored in Azure Blob Storage. Select the files you want to download and click the Download button to start the process.""",
+    "info_page5": """The list below shows all Parquet files stored in Azure Blob Storage. Select a file to page through its data: only the row groups of the current page and the selected columns are downloaded, so large files can be previewed quickly. Load whole dataset downloads the file once into memory shared by all users.""",
 
 "title_page6": "Query Snowflake data",
-    "info_page6": """Select the Snowflake-stored dataset you want to query. Enter an SQL query in the text area and click the Run SQL Data button to execute the query. The results will be displayed below.""",
+    "info_page6": """Select the Snowflake-stored dataset you want to query. Enter an SQL query in the text area and click the Run SQL Data button to execute the query. The results will be displayed below. Results of SELECT queries that only read dataset tables are cached for all users until one of the queried tables is reloaded, so repeating a query does not use the warehouse again. Queries calling functions such as CURRENT_TIMESTAMP or RANDOM are not cached. Tables reloaded outside this app, e.g. by the scheduled sync, are noticed within a minute; until then the previous result may be shown.""",
 
 "title_page7": "Preview local parqet files",
-    "info_page7": """The list below shows all Parquet files stored locally. Select the files you want to preview and click the Preview button to display the data in a table.""",
+    "info_page7": """The list below shows all Parquet files stored locally. Select a file and switch on Preview to page through its data. Only the row groups of the current page and the selected columns are read, so large files are previewed without loading them. You can also run SQL queries on the local files: each file is available as a table named DS_<identifier>, like the Snowflake tables, and queries may filter, aggregate and join several datasets.""",
+
+"title_page8": "Metrics",
+    "info_page8": """Downloads, uploads and queries record their duration, the bytes and rows they processed, the peak memory of the app and their errors. The tables below show the totals per operation, the most recent operations and the datasets with the slowest operations. Downloads are split into the time spent on the ODS export ("export") and on writing parquet ("write"). Use the export buttons to save the metrics as JSON lines or in the Prometheus text format.""",
 
 }
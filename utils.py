@@ -6,4 +6,27 @@ def show_header(title: str, help_text):
         st.markdown(help_text)
 
 def show_records(text: str, records: int):
-    st.markdown(text.format(records))
\ No newline at end of file
+    st.markdown(text.format(records))
+
+def show_preview(preview, key: str, columns: list = None, page_rows: int = 1000):
+    """
+    Shows a page of a parquet preview (ods.ParquetPreview) with buttons for the previous
+    and the next page. The page is kept in the session state under key, so every file
+    should have a key of its own.
+    """
+    page_count = preview.get_page_count(page_rows)
+    page = min(st.session_state.get(key, 0), page_count - 1)
+    table = preview.read_page(page, page_rows, columns)
+    first_row = page * page_rows
+    st.markdown(
+        f"**{preview.num_rows} records**, showing {min(first_row + 1, preview.num_rows)} "
+        f"to {first_row + table.num_rows} (page {page + 1} of {page_count})"
+    )
+    st.dataframe(table.to_pandas())
+    cols = st.columns([1, 1, 8])
+    if cols[0].button("Previous", key=f"{key}_previous", disabled=page == 0):
+        st.session_state[key] = page - 1
+        st.rerun()
+    if cols[1].button("Next", key=f"{key}_next", disabled=page >= page_count - 1):
+        st.session_state[key] = page + 1
+        st.rerun()